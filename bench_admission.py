@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Benchmark: overload with and without admission control (--admit).
+#
+#   python bench_admission.py [--rates=50,200,400] [--seconds=3] [--queue=4]
+#
+# For every offered rate, a 4-node --auto cluster is started without and then
+# with --admit=QUEUE (the per-client rate limit is lifted, so only the queue
+# bounds the load). The benchmark sends deposits open-loop at that rate for
+# --seconds, each tagged req=<n>. It does not retry BUSY replies. A request is
+# done once f+1 REPLYs contain it. Latency is measured for the requests that
+# were admitted, and "threads" is the leader's peak thread count (from /proc,
+# Linux only).
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from pbft_request import ops_of
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+class LoadClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.sent = {}           # req -> send time
+        self.seen = {}           # req -> set of replying nodes
+        self.done = {}           # req -> latency
+        self.busy = 0
+
+    def on_msg(self, msg, addr):
+        now = time.time()
+        with self.lock:
+            if msg.get("type") == "BUSY":
+                self.busy += 1
+                return
+            if msg.get("type") != "REPLY" or msg.get("result") != "COMMITTED":
+                return
+            for op in ops_of(msg.get("data")):
+                req = op.get("req")
+                if req not in self.sent or req in self.done:
+                    continue
+                self.seen.setdefault(req, set()).add(msg.get("from"))
+                if len(self.seen[req]) >= 2:
+                    self.done[req] = now - self.sent[req]
+
+def threads_of(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def run(client, rate, seconds, queue):
+    flags = ["--auto"] + ([f"--admit={queue}", "--client-rate=100000"] if queue else [])
+    workdir = tempfile.mkdtemp(prefix="pbft_bench_")
+    cluster = Cluster(flags, workdir)
+    cluster.start()
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    client.reset()
+    peak = [0]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            peak[0] = max(peak[0], threads_of(cluster.procs["P0"].pid) or 0)
+            time.sleep(0.05)
+
+    threading.Thread(target=sample, daemon=True).start()
+    try:
+        t0 = time.time()
+        n = 0
+        while time.time() - t0 < seconds:
+            due = t0 + n / rate
+            if due > time.time():
+                time.sleep(due - time.time())
+            req = str(n)
+            with client.lock:
+                client.sent[req] = time.time()
+            try:
+                json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                                          "data": f"account=alice,amount=1,operation=deposit,req={req}"})
+            except OSError:
+                pass
+            n += 1
+        deadline = time.time() + 15.0
+        while time.time() < deadline:
+            with client.lock:
+                if len(client.done) + client.busy >= n:
+                    break
+            time.sleep(0.1)
+        elapsed = time.time() - t0
+    finally:
+        stop.set()
+        cluster.stop()
+    with client.lock:
+        lat = sorted(x * 1000 for x in client.done.values())
+        busy = client.busy
+    return n, lat, busy, elapsed, peak[0]
+
+def main(argv):
+    _, flags = split_flags(argv)
+    rates = [float(x) for x in str(flags.get("rates", "50,200,400")).split(",") if x]
+    seconds = float(flags.get("seconds", 3))
+    queue = int(flags.get("queue", 4))
+    client = LoadClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"Open-loop deposits for {seconds:.0f}s per run, N=4, admission queue {queue}")
+    print(f"{'rate':>6} {'mode':<10} {'done':>9} {'busy':>5} {'tput/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'threads':>8}")
+    for rate in rates:
+        for q in (0, queue):
+            sent, lat, busy, elapsed, threads = run(client, rate, seconds, q)
+            mode = f"admit={q}" if q else "unbounded"
+            p50 = f"{statistics.median(lat):8.1f}" if lat else f"{'-':>8}"
+            p95 = f"{lat[min(len(lat) - 1, int(0.95 * len(lat)))]:8.1f}" if lat else f"{'-':>8}"
+            print(f"{rate:>6.0f} {mode:<10} {len(lat):>4}/{sent:<4} {busy:>5} {len(lat) / elapsed:>7.1f} "
+                  f"{p50} {p95} {threads:>8}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Benchmark: unbatched --auto vs the adaptive batcher (--slo) under load.
+#
+#   python bench_batching.py [--rates=20,50,100,200] [--seconds=5] [--slo=100]
+#
+# For every offered rate, a 4-node cluster is started with --auto, and then
+# with --auto --slo=MS. The benchmark sends deposits open-loop at that rate
+# for --seconds, each tagged req=<n>. A request is done once f+1 REPLYs
+# contain it, either as the tx itself or as one op of a batch. The last
+# column is the leader's batching line from 'status' at the end of the run.
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from pbft_request import ops_of
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+class LoadClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.sent = {}           # req -> send time
+        self.seen = {}           # req -> set of replying nodes
+        self.done = {}           # req -> latency
+        self.need = 2
+
+    def on_msg(self, msg, addr):
+        if msg.get("type") != "REPLY" or msg.get("tentative") or msg.get("result") != "COMMITTED":
+            return
+        now = time.time()
+        with self.lock:
+            for op in ops_of(msg.get("data")):
+                req = op.get("req")
+                if req not in self.sent or req in self.done:
+                    continue
+                self.seen.setdefault(req, set()).add(msg.get("from"))
+                if len(self.seen[req]) >= self.need:
+                    self.done[req] = now - self.sent[req]
+
+def run(client, rate, seconds, slo):
+    flags = ["--auto"] + ([f"--slo={slo}"] if slo else [])
+    workdir = tempfile.mkdtemp(prefix="pbft_bench_")
+    cluster = Cluster(flags, workdir)
+    cluster.start()
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    client.reset()
+    batching = ""
+    try:
+        t0 = time.time()
+        n = 0
+        while time.time() - t0 < seconds:
+            due = t0 + n / rate
+            if due > time.time():
+                time.sleep(due - time.time())
+            req = str(n)
+            with client.lock:
+                client.sent[req] = time.time()
+            json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                                      "data": f"account=alice,amount=1,operation=deposit,req={req}"})
+            n += 1
+        deadline = time.time() + 10.0
+        while time.time() < deadline and len(client.done) < n:
+            time.sleep(0.1)
+        elapsed = time.time() - t0
+        if slo:
+            cluster.cmd("P0", "status")
+            time.sleep(0.5)
+            with open(os.path.join(workdir, "P0.out"), encoding="utf-8", errors="replace") as f:
+                lines = [l.strip() for l in f if l.strip().startswith("Batching (")]
+            batching = lines[-1] if lines else ""
+    finally:
+        cluster.stop()
+    with client.lock:
+        lat = sorted(x * 1000 for x in client.done.values())
+    return n, lat, elapsed, batching
+
+def main(argv):
+    _, flags = split_flags(argv)
+    rates = [float(x) for x in str(flags.get("rates", "20,50,100,200")).split(",") if x]
+    seconds = float(flags.get("seconds", 5))
+    slo = int(flags.get("slo", 100))
+    client = LoadClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"Open-loop deposits for {seconds:.0f}s per run, N=4, SLO {slo} ms")
+    print(f"{'rate':>6} {'mode':<9} {'done':>9} {'tput/s':>7} {'p50 ms':>8} {'p95 ms':>8}  leader")
+    for rate in rates:
+        for s in (0, slo):
+            sent, lat, elapsed, batching = run(client, rate, seconds, s)
+            mode = f"slo={s}" if s else "unbatched"
+            p50 = f"{statistics.median(lat):8.1f}" if lat else f"{'-':>8}"
+            p95 = f"{lat[min(len(lat) - 1, int(0.95 * len(lat)))]:8.1f}" if lat else f"{'-':>8}"
+            print(f"{rate:>6.0f} {mode:<9} {len(lat):>4}/{sent:<4} {len(lat) / elapsed:>7.1f} {p50} {p95}  {batching}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
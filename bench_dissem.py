@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Benchmark: leader egress with direct PRE_PREPARE vs tree dissemination.
+#
+#   python bench_dissem.py [--sizes=4,7,13] [--requests=3] [--payload=65536] [--fanout=2]
+#
+# For every N, P0..P(N-1) are started with --auto, and then with
+# --auto --tree=K. The benchmark sends deposits that carry a large memo
+# field, one at a time, and waits for a REPLY from every node. Each REPLY
+# carries "bytes", the consensus bytes its sender sent for the instance. The
+# table shows P0's (the leader's) share and the total across all nodes.
+import statistics
+import sys
+import tempfile
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+from bench_linear import ReplyCounter
+
+def run(counter, n, fanout, requests, payload):
+    flags = ["--auto"] + ([f"--tree={fanout}"] if fanout else [])
+    cluster = Cluster(flags, tempfile.mkdtemp(prefix="pbft_bench_"))
+    cluster.start(n)
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    f = max(0, (n - 1) // 3)
+    memo = "x" * payload
+    lat, leader, total = [], [], []
+    try:
+        for i in range(requests):
+            with counter.cv:
+                counter.replies = {}
+            json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                                      "data": f"account=alice,amount=1,operation=deposit,memo={memo}"})
+            first, got = counter.wait(n, f + 1, time.time() + 30.0)
+            if first is not None:
+                lat.append(first)
+            leader.append(got.get("P0", {}).get("bytes", 0))
+            total.append(sum(r.get("bytes", 0) for r in got.values()))
+    finally:
+        cluster.stop()
+    return lat, leader, total
+
+def main(argv):
+    _, flags = split_flags(argv)
+    sizes = [int(x) for x in str(flags.get("sizes", "4,7,13")).split(",") if x]
+    requests = int(flags.get("requests", 3))
+    payload = int(flags.get("payload", 65536))
+    fanout = int(flags.get("fanout", 2))
+    counter = ReplyCounter()
+    json_server(HOST, CLIENT_PORT, counter.on_msg)
+    print(f"Payload dissemination: {requests} deposits of {payload // 1024} KiB per run")
+    print(f"{'N':>3} {'mode':<8} {'leader KiB':>11} {'total KiB':>10} {'mean ms':>9}")
+    for n in sizes:
+        for k in (0, fanout):
+            lat, leader, total = run(counter, n, k, requests, payload)
+            mode = f"tree={k}" if k else "direct"
+            mean = f"{statistics.mean(lat) * 1000:9.1f}" if lat else f"{'-':>9}"
+            print(f"{n:>3} {mode:<8} {statistics.mean(leader) / 1024:>11.1f} "
+                  f"{statistics.mean(total) / 1024:>10.1f} {mean}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
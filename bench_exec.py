@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Benchmark: per-batch cost of executing account ops, dict walk vs pbft_exec.
+#
+#   python bench_exec.py [--sizes=1,10,100,1000,10000] [--accounts=1000] [--repeat=20] [--workers=4]
+#
+# Every batch is an ordered list of deposit/withdraw ops over --accounts
+# accounts, as a committed {"operation": "batch"} carries them. "dict" is the
+# old path: parse each op's amount string, walk the batch in order for the
+# overdraft check, then add each op into a balance dict. "ledger" compiles the
+# batch once to index/amount arrays, checks it (one pass for accounts touched
+# once, in order only for the rest) and applies it. Times are the median of
+# --repeat samples of check + apply. numpy is used when it is installed.
+# "parallel" is the ledger with --workers exec threads (batches of at least
+# pbft_exec.PARALLEL_MIN ops). Both ledgers see the same ops, and their state
+# digests are compared after every size.
+import random
+import statistics
+import sys
+import time
+
+import pbft_exec
+from pbft_utils import split_flags
+
+def make_ops(n, accounts, rng):
+    ops = []
+    for _ in range(n):
+        kind = "withdraw" if rng.random() < 0.2 else "deposit"
+        ops.append({"account": f"acct{rng.randrange(accounts)}", "amount": str(rng.randint(1, 100)),
+                    "operation": kind})
+    return ops
+
+def signed(op):
+    try:
+        v = int(str(op.get("amount")))
+    except Exception:
+        return None, None
+    return op.get("account"), -v if str(op.get("operation")).lower() == "withdraw" else v
+
+def dict_path(ops, bal):
+    run = dict(bal)
+    for op in ops:
+        acct, val = signed(op)
+        if acct is None or val is None:
+            return False
+        run[acct] = run.get(acct, 0) + val
+        if run[acct] < 0:
+            return False
+    for op in ops:
+        acct, val = signed(op)
+        bal[acct] = bal.get(acct, 0) + val
+    return True
+
+def ledger_path(ops, ledger):
+    batch = ledger.compile(ops)
+    if not ledger.allowed(batch):
+        return False
+    return ledger.apply(batch)
+
+def measure(fn, ops, state, repeat):
+    # small batches run several times per sample so timer overhead does not dominate
+    loops = max(1, 2000 // len(ops))
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            assert fn(ops, state)
+        times.append((time.perf_counter() - t0) / loops)
+    return statistics.median(times)
+
+def main(argv):
+    _, flags = split_flags(argv)
+    sizes = [int(s) for s in str(flags.get("sizes", "1,10,100,1000,10000")).split(",")]
+    accounts = int(flags.get("accounts", 1000))
+    repeat = int(flags.get("repeat", 20))
+    workers = int(flags.get("workers", 4))
+    rng = random.Random(5567)
+    funded = {f"acct{i}": 10 ** 9 for i in range(accounts)}
+    deposits = [{"account": a, "amount": str(v), "operation": "deposit"} for a, v in funded.items()]
+    ledger, parallel = pbft_exec.Ledger(), pbft_exec.Ledger()
+    ledger.apply(ledger.compile(deposits))
+    parallel.apply(parallel.compile(deposits))
+    backend = "numpy" if pbft_exec.numpy is not None else "array (numpy not installed)"
+    print(f"Execution benchmark: {accounts} accounts, median of {repeat}, ledger backend: {backend}")
+    print(f"{'batch':>7} {'dict us':>10} {'ledger us':>10} {'parallel us':>12} {'dict ns/op':>11} "
+          f"{'ledger ns/op':>13} {'speedup':>8} {'state':>6}")
+    for n in sizes:
+        ops = make_ops(n, accounts, rng)
+        d = measure(dict_path, ops, dict(funded), repeat)
+        pbft_exec.configure(0)
+        v = measure(ledger_path, ops, ledger, repeat)
+        pbft_exec.configure(workers)
+        p = measure(ledger_path, ops, parallel, repeat)
+        same = "same" if ledger.digest() == parallel.digest() else "DIFF"
+        print(f"{n:>7} {d * 1e6:>10.1f} {v * 1e6:>10.1f} {p * 1e6:>12.1f} {d / n * 1e9:>11.0f} "
+              f"{v / n * 1e9:>13.0f} {d / v:>7.2f}x {same:>6}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Benchmark: a slow (Byzantine) leader with and without leader monitoring.
+#
+#   python bench_leader.py [--rate=20] [--seconds=8] [--delay=300]
+#
+# Each scenario starts a 4-node --auto cluster (P3 is the Byzantine node),
+# offers deposits open-loop at --rate to every replica, as an Aardvark client
+# does, and moves the leader P0 -> P1 -> P2 -> P3 with 'view change'. Once P3
+# leads, the measured phase starts: the benchmark sends for --seconds and
+# counts a request done at f+1 REPLYs. In the "slow" scenarios P3 runs
+# 'misbehave slow --delay', holding every PRE_PREPARE back by that many ms.
+#   honest     P3 leads normally
+#   slow       nothing watches P3
+#   monitor    --monitor: replicas vote P3 out when ordering stalls
+#   rotate     --rotate=2: P3 loses the job after 2 s whatever it does
+# "leader" is the leader at the end and "views" the view changes after P3
+# took over.
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import pbft_config
+from pbft_utils import json_send, json_server, split_flags
+from bench_admission import LoadClient
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+SCENARIOS = [("honest", [], False), ("slow", [], True),
+             ("monitor", ["--monitor"], True), ("rotate", ["--rotate=2"], True)]
+
+def leader_of(workdir):
+    # -> (view, leader) from P1's last NEW_VIEW
+    with open(f"{workdir}/P1.out", encoding="utf-8", errors="replace") as f:
+        found = re.findall(r"NEW_VIEW received: view=(\d+), new leader=(P\d+)", f.read())
+    return (int(found[-1][0]), found[-1][1]) if found else (0, "P0")
+
+def run(client, flags, slow, rate, seconds, delay):
+    workdir = tempfile.mkdtemp(prefix="pbft_bench_")
+    cluster = Cluster(["--auto"] + flags, workdir)
+    cluster.start()
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    client.reset()
+    addrs = list(pbft_config.nodes.values())
+    phase = {"measure": False, "stop": False}
+    counted = []
+
+    def load():
+        n = 0
+        t0 = time.time()
+        while not phase["stop"]:
+            due = t0 + n / rate
+            if due > time.time():
+                time.sleep(due - time.time())
+            req = str(n)
+            with client.lock:
+                client.sent[req] = time.time()
+            if phase["measure"]:
+                counted.append(req)
+            msg = {"type": "CLIENT_TX", "from_port": CLIENT_PORT, "to_all": True,
+                   "data": f"account=alice,amount=1,operation=deposit,req={req},client_id=bench{n},ts=1"}
+            for h, p in addrs:
+                try:
+                    json_send(h, p, msg)
+                except OSError:
+                    pass
+            n += 1
+
+    try:
+        threading.Thread(target=load, daemon=True).start()
+        time.sleep(1.8)
+        for _ in range(3):
+            for nid in ("P0", "P1", "P2", "P3"):
+                cluster.cmd(nid, "view change")
+            time.sleep(1.2)
+        start_view, _ = leader_of(workdir)
+        if slow:
+            cluster.cmd("P3", f"misbehave slow {delay}")
+        phase["measure"] = True
+        time.sleep(seconds)
+        phase["stop"] = True
+        deadline = time.time() + 10.0
+        while time.time() < deadline:
+            with client.lock:
+                if all(r in client.done for r in counted):
+                    break
+            time.sleep(0.1)
+        view, leader = leader_of(workdir)
+    finally:
+        cluster.stop()
+    with client.lock:
+        lat = sorted(client.done[r] * 1000 for r in counted if r in client.done)
+    return len(counted), lat, leader, view - start_view
+
+def main(argv):
+    _, flags = split_flags(argv)
+    rate = float(flags.get("rate", 20))
+    seconds = float(flags.get("seconds", 8))
+    delay = int(flags.get("delay", 300))
+    client = LoadClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"Slow leader: P3 leads, {rate:.0f} req/s to every replica for {seconds:.0f}s, "
+          f"slow P3 delays each PRE_PREPARE {delay} ms")
+    print(f"{'scenario':<9} {'done':>9} {'tput/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'leader':>7} {'views':>6}")
+    for name, extra, slow in SCENARIOS:
+        sent, lat, leader, views = run(client, extra, slow, rate, seconds, delay)
+        p50 = f"{statistics.median(lat):8.1f}" if lat else f"{'-':>8}"
+        p95 = f"{lat[min(len(lat) - 1, int(0.95 * len(lat)))]:8.1f}" if lat else f"{'-':>8}"
+        print(f"{name:<9} {len(lat):>4}/{sent:<4} {len(lat) / seconds:>7.1f} {p50} {p95} {leader:>7} {views:>6}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Benchmark: all-to-all votes vs linear (collector) votes as N grows.
+#
+#   python bench_linear.py [--sizes=4,7,13,31] [--requests=5]
+#
+# For every N, P0..P(N-1) are started with --auto, and then with
+# --auto --linear, in a scratch directory. The benchmark plays the client:
+# it sends deposits one at a time and waits for a REPLY from every node.
+# Each REPLY carries "msgs", the number of consensus messages that node sent
+# for the instance (PRE_PREPARE, votes, certificates). Their sum is the
+# total cost of one instance.
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+class ReplyCounter:
+    def __init__(self):
+        self.cv = threading.Condition()
+        self.replies = {}        # txid -> {node: REPLY}
+
+    def on_msg(self, msg, addr):
+        if msg.get("type") != "REPLY" or msg.get("tentative"):
+            return
+        with self.cv:
+            self.replies.setdefault(msg["txid"], {})[msg.get("from")] = msg
+            self.cv.notify_all()
+
+    def wait(self, n, first_need, deadline):
+        # -> (seconds until first_need replies, {node: REPLY}) for the one tx in flight
+        t0 = time.time()
+        first = None
+        with self.cv:
+            while time.time() < deadline:
+                got = next(iter(self.replies.values()), {})
+                if first is None and len(got) >= first_need:
+                    first = time.time() - t0
+                if len(got) >= n:
+                    break
+                self.cv.wait(0.05)
+            return first, dict(next(iter(self.replies.values()), {}))
+
+def run(counter, n, linear, requests):
+    flags = ["--auto"] + (["--linear"] if linear else [])
+    cluster = Cluster(flags, tempfile.mkdtemp(prefix="pbft_bench_"))
+    cluster.start(n)
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    f = max(0, (n - 1) // 3)
+    lat, msgs, partial = [], [], 0
+    try:
+        for i in range(requests):
+            with counter.cv:
+                counter.replies = {}
+            json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "data": "account=alice,amount=1,operation=deposit",
+                                      "from_port": CLIENT_PORT})
+            first, got = counter.wait(n, f + 1, time.time() + 30.0)
+            if first is not None:
+                lat.append(first)
+            if len(got) < n:
+                partial += 1
+            msgs.append(sum(r.get("msgs", 0) for r in got.values()))
+    finally:
+        cluster.stop()
+    return lat, msgs, partial
+
+def main(argv):
+    _, flags = split_flags(argv)
+    sizes = [int(x) for x in str(flags.get("sizes", "4,7,13,31")).split(",") if x]
+    requests = int(flags.get("requests", 5))
+    counter = ReplyCounter()
+    json_server(HOST, CLIENT_PORT, counter.on_msg)
+    print(f"Vote dissemination: {requests} sequential deposits per run")
+    print(f"{'N':>3} {'mode':<11} {'msgs/inst':>10} {'N^2':>6} {'mean ms':>9} {'p50 ms':>8} {'partial':>8}")
+    for n in sizes:
+        for linear in (False, True):
+            lat, msgs, partial = run(counter, n, linear, requests)
+            mode = "linear" if linear else "all-to-all"
+            ms = [x * 1000 for x in lat]
+            mean = f"{statistics.mean(ms):9.1f}" if ms else f"{'-':>9}"
+            p50 = f"{statistics.median(ms):8.1f}" if ms else f"{'-':>8}"
+            print(f"{n:>3} {mode:<11} {statistics.mean(msgs) if msgs else 0:>10.0f} {n * n:>6} "
+                  f"{mean} {p50} {partial:>8}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
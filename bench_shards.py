@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Benchmark: ordering throughput against the number of shards (--shards=K).
+#
+#   python bench_shards.py [--shards=1,2,4] [--rate=600] [--seconds=4] [--accounts=64]
+#
+# Each K starts P0..P3 with --auto --shards=K in a scratch directory. The
+# benchmark plays the client: for --seconds it offers deposits at --rate,
+# spread over --accounts accounts, and sends each one straight to the leader
+# of its account's shard (the same crc32 rule the nodes use). A request is
+# done at 2 matching COMMITTED REPLYs (f+1 with N=4). "tput/s" is done
+# requests over the time from the first send to the last reply; with K
+# shards, K leaders on different nodes propose instances side by side.
+import statistics
+import sys
+import tempfile
+import time
+
+import pbft_config
+import pbft_shard
+from pbft_utils import json_send, json_server, split_flags
+from bench_admission import LoadClient
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+def run(client, k, rate, seconds, accounts):
+    pbft_shard.configure(k)
+    cluster = Cluster(["--auto", f"--shards={k}"], tempfile.mkdtemp(prefix="pbft_bench_"))
+    cluster.start()
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    ids = ["P0"] + sorted(n for n in pbft_config.nodes if n != "P0")
+    leaders = {s: tuple(pbft_config.nodes[pbft_shard.shard_leader(ids, "P0", s)]) for s in range(k)}
+    client.reset()
+    try:
+        t0 = time.time()
+        n = 0
+        while time.time() - t0 < seconds:
+            time.sleep(max(0.0, t0 + n / rate - time.time()))
+            acct = f"acct{n % accounts}"
+            req = str(n)
+            with client.lock:
+                client.sent[req] = time.time()
+            try:
+                json_send(*leaders[pbft_shard.shard_of(acct)], {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                          "data": f"account={acct},amount=1,operation=deposit,req={req}"})
+            except OSError:
+                pass
+            n += 1
+        deadline = time.time() + 15.0
+        while time.time() < deadline:
+            with client.lock:
+                if len(client.done) >= n:
+                    break
+            time.sleep(0.1)
+        with client.lock:
+            last = max((client.sent[r] + d for r, d in client.done.items()), default=time.time())
+            lat = sorted(x * 1000 for x in client.done.values())
+    finally:
+        cluster.stop()
+    return n, lat, last - t0
+
+def main(argv):
+    _, flags = split_flags(argv)
+    ks = [int(x) for x in str(flags.get("shards", "1,2,4")).split(",") if x]
+    rate = float(flags.get("rate", 600))
+    seconds = float(flags.get("seconds", 4))
+    accounts = int(flags.get("accounts", 64))
+    client = LoadClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"Sharded ordering: N=4, {rate:.0f} deposits/s offered for {seconds:.0f}s over {accounts} accounts")
+    print(f"{'K':>3} {'done':>11} {'tput/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for k in ks:
+        sent, lat, elapsed = run(client, k, rate, seconds, accounts)
+        p50 = f"{statistics.median(lat):8.1f}" if lat else f"{'-':>8}"
+        p95 = f"{lat[min(len(lat) - 1, int(0.95 * len(lat)))]:8.1f}" if lat else f"{'-':>8}"
+        print(f"{k:>3} {len(lat):>5}/{sent:<5} {len(lat) / elapsed:>8.1f} {p50} {p95}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Benchmark: standard PBFT path vs speculative (Zyzzyva-style) path.
+#
+#   python bench_speculative.py [--requests=50] [--spec-timeout=0.2]
+#
+# Starts P0..P3 with --auto (honest replicas vote and progress by themselves)
+# in a scratch directory. The benchmark itself plays the client and sends
+# deposits one at a time, measuring latency until a request completes:
+#   standard     f+1 matching REPLYs (the PBFT client rule)
+#   speculative  3f+1 matching SPEC_REPLYs; otherwise, after --spec-timeout,
+#                SPEC_FALLBACK and then f+1 matching REPLYs
+# Each path runs twice: once with P3 honest and once with P3 Byzantine
+# ('misbehave on': it votes no and reports corrupted history digests).
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from pbft_launch import Cluster
+
+HOST = "127.0.0.1"
+P0_PORT = 5000
+CLIENT_PORT = 7100
+
+class BenchClient:
+    def __init__(self):
+        self.cv = threading.Condition()
+        self.members = {}
+        self.reset()
+
+    def reset(self):
+        self.replies = {}        # txid -> {node: result}
+        self.spec = {}           # txid -> {node: (history, result)}
+
+    def on_msg(self, msg, addr):
+        t = msg.get("type")
+        with self.cv:
+            if t == "MEMBERS":
+                self.members = {k: tuple(v) for k, v in msg.get("members", {}).items()}
+            elif t == "REPLY" and not msg.get("tentative"):
+                self.replies.setdefault(msg["txid"], {})[msg.get("from")] = msg.get("result")
+            elif t == "SPEC_REPLY":
+                self.spec.setdefault(msg["txid"], {})[msg.get("from")] = (msg.get("history"), msg.get("result"))
+            self.cv.notify_all()
+
+    def f(self):
+        return max(0, (len(self.members) - 1) // 3)
+
+    def _matching(self, votes):
+        best = 0
+        for v in votes.values():
+            best = max(best, sum(1 for w in votes.values() if w == v))
+        return best
+
+    def wait_replies(self, need, deadline):
+        with self.cv:
+            while time.time() < deadline:
+                for txid, votes in self.replies.items():
+                    if self._matching(votes) >= need:
+                        return txid
+                self.cv.wait(0.05)
+        return None
+
+    def wait_spec(self, need, deadline):
+        with self.cv:
+            while time.time() < deadline:
+                for txid, votes in self.spec.items():
+                    if self._matching(votes) >= need:
+                        hist = max(votes.values(), key=lambda v: sum(1 for w in votes.values() if w == v))
+                        return txid, hist[0]
+                    if len(votes) >= len(self.members):
+                        return txid, None  # everyone answered, no 3f+1 match: fall back now
+                self.cv.wait(0.01)
+            txid = next(iter(self.spec), None)
+        return txid, None
+
+    def to_all(self, obj):
+        for pid, (h, p) in list(self.members.items()):
+            json_send(h, p, obj)
+
+def run_scenario(client, speculative, byzantine, requests, spec_timeout):
+    flags = ["--auto"] + (["--speculative"] if speculative else [])
+    workdir = tempfile.mkdtemp(prefix="pbft_bench_")
+    cluster = Cluster(flags, workdir)
+    cluster.start()
+    client.members = {}
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    if byzantine:
+        cluster.cmd("P3", "misbehave on")
+        time.sleep(0.2)
+    f = client.f()
+    lat, fast = [], 0
+    try:
+        for i in range(requests):
+            client.reset()
+            t0 = time.time()
+            json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "data": "account=alice,amount=1,operation=deposit",
+                                      "from_port": CLIENT_PORT})
+            if speculative:
+                txid, hist = client.wait_spec(3 * f + 1, t0 + spec_timeout)
+                if hist is not None:
+                    client.to_all({"type": "SPEC_COMMIT", "txid": txid, "history": hist})
+                    lat.append(time.time() - t0); fast += 1
+                    continue
+                if txid is None:
+                    txid, _ = client.wait_spec(1, t0 + 5.0)
+                if txid:
+                    client.to_all({"type": "SPEC_FALLBACK", "txid": txid})
+            if client.wait_replies(f + 1, t0 + 10.0):
+                lat.append(time.time() - t0)
+    finally:
+        cluster.stop()
+    return lat, fast
+
+def main(argv):
+    _, flags = split_flags(argv)
+    requests = int(flags.get("requests", 50))
+    spec_timeout = float(flags.get("spec-timeout", 0.2))
+    client = BenchClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"Speculative vs standard path: N=4, {requests} sequential deposits per scenario")
+    print(f"{'path':<12} {'P3':<10} {'done':>5} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'fast path':>10} {'req/s':>7}")
+    for speculative in (False, True):
+        for byzantine in (False, True):
+            lat, fast = run_scenario(client, speculative, byzantine, requests, spec_timeout)
+            name = "speculative" if speculative else "standard"
+            who = "Byzantine" if byzantine else "honest"
+            if not lat:
+                print(f"{name:<12} {who:<10} {0:>5}  (no request completed)")
+                continue
+            ms = sorted(x * 1000 for x in lat)
+            p95 = ms[min(len(ms) - 1, int(0.95 * len(ms)))]
+            print(f"{name:<12} {who:<10} {len(ms):>5} {statistics.mean(ms):>9.1f} {statistics.median(ms):>8.1f} "
+                  f"{p95:>8.1f} {100.0 * fast / len(ms):>9.0f}% {len(ms) / (sum(lat) or 1):>7.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Benchmark: catching up a replica that lagged far behind.
+#
+#   python bench_sync.py [--requests=4000] [--rate=400] [--checkpoint=64]
+#
+# Each mode starts a 4-node --auto --slo=50 cluster and crashes P3. The
+# benchmark then offers --requests deposits at --rate, waits for the log to
+# settle, and runs 'recover' on P3. Recovery time is the time from 'recover'
+# to P3 printing "Checkpoint/state synced". "KiB" is what reached P3: the
+# CHECKPOINT_SYNC and, in the chunked modes, every STATE_CHUNK served to it.
+#   single       no checkpoints: the whole state in one CHECKPOINT_SYNC
+#   none/zlib/lzma/auto
+#                --checkpoint plus --sync-codec: chunks fetched in parallel
+#                from every replica and checked against the stable digest
+# "match" says whether P3's state digest equals P0's afterwards.
+import re
+import sys
+import tempfile
+import time
+
+from pbft_utils import json_send, json_server, split_flags
+from bench_admission import LoadClient
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+def modes(k):
+    return [("single", [])] + [(c, [f"--checkpoint={k}", f"--sync-codec={c}"]) for c in ("none", "zlib", "lzma", "auto")]
+
+def tail(workdir, nid):
+    with open(f"{workdir}/{nid}.out", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def wait_for(workdir, nid, pattern, after, deadline):
+    while time.time() < deadline:
+        found = re.findall(pattern, tail(workdir, nid)[after:])
+        if found:
+            return found
+        time.sleep(0.01)
+    return []
+
+def run(flags, requests, rate):
+    workdir = tempfile.mkdtemp(prefix="pbft_bench_")
+    cluster = Cluster(["--auto", "--slo=50"] + flags, workdir)
+    cluster.start()
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    try:
+        cluster.cmd("P3", "crash")
+        t0 = time.time()
+        for n in range(requests):
+            time.sleep(max(0.0, t0 + n / rate - time.time()))
+            try:
+                json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                                          "data": f"account=acct{n % 50},amount=1,operation=deposit,"
+                                                  f"client_id=bench{n},ts=1"})
+            except OSError:
+                pass
+        time.sleep(3.0)
+        marks = {nid: len(tail(workdir, nid)) for nid in ("P0", "P1", "P2", "P3")}
+        t1 = time.time()
+        cluster.cmd("P3", "recover")
+        synced = wait_for(workdir, "P3", r"Checkpoint/state synced", marks["P3"], time.time() + 60)
+        took = time.time() - t1 if synced else None
+        time.sleep(0.3)
+        for nid in ("P0", "P1", "P2", "P3"):
+            cluster.cmd(nid, "status")
+        time.sleep(1.0)
+        sent = sum(float(x) for x in re.findall(r"recovering node .*? \(([\d.]+) KiB\)", tail(workdir, "P0")[marks["P0"]:]))
+        for nid in ("P0", "P1", "P2"):
+            served = re.findall(r"served \d+ chunks \(([\d.]+) KiB sent\)", tail(workdir, nid)[marks[nid]:])
+            sent += float(served[-1]) if served else 0.0
+        digests = {nid: re.findall(r"State digest: (\w+)", tail(workdir, nid)[marks[nid]:]) for nid in ("P0", "P3")}
+        match = bool(digests["P0"] and digests["P3"] and digests["P0"][-1] == digests["P3"][-1])
+        sources = re.findall(r"KiB from ([\w, ]+) in", tail(workdir, "P3")[marks["P3"]:])
+    finally:
+        cluster.stop()
+    return took, sent, match, ", ".join(sources) or "-"
+
+def main(argv):
+    _, flags = split_flags(argv)
+    requests = int(flags.get("requests", 4000))
+    rate = float(flags.get("rate", 400))
+    k = int(flags.get("checkpoint", 64))
+    client = LoadClient()
+    json_server(HOST, CLIENT_PORT, client.on_msg)
+    print(f"State transfer: P3 misses {requests} deposits ({rate:.0f}/s), then recovers")
+    print(f"{'mode':<8} {'recover ms':>11} {'KiB':>9} {'match':>6}  sources")
+    for name, extra in modes(k):
+        took, sent, match, sources = run(extra, requests, rate)
+        ms = f"{took * 1000:11.1f}" if took is not None else f"{'-':>11}"
+        print(f"{name:<8} {ms} {sent:>9.1f} {'yes' if match else 'no':>6}  {sources}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Benchmark: votes over TCP vs UDP unicast vs UDP multicast, on loopback.
+#
+#   python bench_udp.py [--requests=200] [--nodes=4] [--loss=0.05]
+#
+# Each mode starts P0..P(N-1) with --auto in a scratch directory; the
+# benchmark plays the client and sends deposits one at a time. An instance is
+# PRE_PREPARE plus two all-to-all vote rounds, so its latency (send to f+1
+# matching REPLYs) is mostly vote latency. CPU per instance is the user+system
+# time of all node processes over the run (from /proc) divided by the number
+# of requests. "msgs" is the consensus messages sent per instance, summed
+# over the nodes' REPLYs. The lossy row drops --loss of the datagrams, so the
+# VOTE_NACK retransmission is exercised.
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from pbft_utils import json_server, json_send, split_flags
+from bench_linear import ReplyCounter
+from bench_speculative import Cluster, HOST, P0_PORT, CLIENT_PORT
+
+def modes(loss):
+    return [("tcp", []), ("udp", ["--udp"]), ("multicast", ["--udp=multicast"]),
+            (f"udp {loss:g} loss", ["--udp", f"--udp-loss={loss}"])]
+
+def cpu_seconds(procs):
+    # user + system time of the node processes, or None without /proc
+    total = 0
+    try:
+        for p in procs.values():
+            with open(f"/proc/{p.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+    except OSError:
+        return None
+    return total / os.sysconf("SC_CLK_TCK")
+
+def run(counter, n, flags, requests):
+    cluster = Cluster(["--auto"] + flags, tempfile.mkdtemp(prefix="pbft_bench_"))
+    cluster.start(n)
+    json_send(HOST, P0_PORT, {"type": "CLIENT_HELLO", "host": HOST, "port": CLIENT_PORT})
+    time.sleep(0.5)
+    f = max(0, (n - 1) // 3)
+    lat, msgs, lost = [], [], 0
+    try:
+        c0 = cpu_seconds(cluster.procs)
+        for i in range(requests):
+            with counter.cv:
+                counter.replies = {}
+            json_send(HOST, P0_PORT, {"type": "CLIENT_TX", "from_port": CLIENT_PORT,
+                                      "data": f"account=alice,amount=1,operation=deposit,client_id=bench{i},ts=1"})
+            first, got = counter.wait(n, f + 1, time.time() + 10.0)
+            if first is None:
+                lost += 1
+            else:
+                lat.append(first)
+            msgs.append(sum(r.get("msgs", 0) for r in got.values()))
+        c1 = cpu_seconds(cluster.procs)
+    finally:
+        cluster.stop()
+    cpu = (c1 - c0) / requests if c0 is not None and c1 is not None else None
+    return lat, msgs, cpu, lost
+
+def main(argv):
+    _, flags = split_flags(argv)
+    requests = int(flags.get("requests", 200))
+    n = int(flags.get("nodes", 4))
+    loss = float(flags.get("loss", 0.05))
+    counter = ReplyCounter()
+    json_server(HOST, CLIENT_PORT, counter.on_msg)
+    print(f"Vote transport: {n} nodes, {requests} sequential deposits per mode, loopback")
+    print(f"{'mode':<15} {'msgs/inst':>10} {'mean ms':>8} {'p50 ms':>7} {'p99 ms':>7} {'cpu ms/inst':>12} {'timeouts':>9}")
+    for name, extra in modes(loss):
+        lat, msgs, cpu, lost = run(counter, n, extra, requests)
+        ms = sorted(x * 1000 for x in lat)
+        mean = f"{statistics.mean(ms):8.2f}" if ms else f"{'-':>8}"
+        p50 = f"{statistics.median(ms):7.2f}" if ms else f"{'-':>7}"
+        p99 = f"{ms[min(len(ms) - 1, int(0.99 * len(ms)))]:7.2f}" if ms else f"{'-':>7}"
+        cpu_ms = f"{cpu * 1000:12.2f}" if cpu is not None else f"{'-':>12}"
+        print(f"{name:<15} {statistics.mean(msgs) if msgs else 0:>10.0f} {mean} {p50} {p99} {cpu_ms} {lost:>9}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
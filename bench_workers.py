@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Benchmark: receive-path CPU scaling of json_server vs json_server_mp.
+#
+#   python bench_workers.py [--max=8] [--seconds=3] [--loaders=4] [--batch=50] [--payload=2048]
+#
+# Loader processes flood one server with PRE_PREPARE-sized messages (several
+# per connection, as a busy replica sees them). The handler does the same
+# kind of vote bookkeeping a node does. The table reports delivered msgs/s and
+# CPU seconds split between the consensus process and the decode workers.
+# "threads" is the stock thread-per-connection json_server.
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import time
+
+from pbft_utils import json_server, split_flags, ENCODING
+from pbft_workers import json_server_mp
+
+HOST = "127.0.0.1"
+
+def free_port():
+    s = socket.socket(); s.bind((HOST, 0)); p = s.getsockname()[1]; s.close()
+    return p
+
+def loader(port, seconds, batch, payload):
+    blob = "x" * payload
+    line = (json.dumps({"type": "PRE_PREPARE", "txid": "bench", "from": "P0", "data": {"blob": blob}}) + "\n")
+    data = (line * batch).encode(ENCODING)
+    end = time.time() + seconds
+    while time.time() < end:
+        try:
+            s = socket.create_connection((HOST, port), timeout=3.0)
+            s.sendall(data)
+            s.shutdown(socket.SHUT_RDWR)
+            s.close()
+        except OSError:
+            time.sleep(0.01)
+
+def run(workers, seconds, loaders, batch, payload):
+    port = free_port()
+    votes = {}
+    count = [0]
+
+    def handler(msg, addr):
+        votes.setdefault(msg.get("txid"), {})[msg.get("from")] = msg.get("type")
+        count[0] += 1
+
+    pool = None
+    if workers:
+        pool = json_server_mp(HOST, port, handler, workers=workers)
+    else:
+        srv = json_server(HOST, port, handler)
+    time.sleep(0.3)
+    ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+    procs = [ctx.Process(target=loader, args=(port, seconds, batch, payload)) for _ in range(loaders)]
+    c0 = time.process_time(); n0 = count[0]; t0 = time.time()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    time.sleep(0.5)  # drain
+    elapsed = time.time() - t0
+    core_cpu = time.process_time() - c0
+    worker_cpu = sum(pool.worker_cpu()) if pool else 0.0
+    delivered = count[0] - n0
+    if pool:
+        pool.close()
+    else:
+        srv.close()
+    return delivered / elapsed, core_cpu, worker_cpu
+
+def main(argv):
+    _, flags = split_flags(argv)
+    max_workers = int(flags.get("max", 8))
+    seconds = float(flags.get("seconds", 3))
+    loaders = int(flags.get("loaders", 4))
+    batch = int(flags.get("batch", 50))
+    payload = int(flags.get("payload", 2048))
+    print(f"Receive-path benchmark: {loaders} loaders x {seconds}s, {batch} msgs/conn, "
+          f"{payload}B payload, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'msgs/s':>10} {'speedup':>8} {'core cpu s':>11} {'worker cpu s':>13}")
+    base = None
+    counts = [0] + [w for w in (1, 2, 4, 8, 16) if w <= max_workers]
+    for w in counts:
+        rate, core, wcpu = run(w, seconds, loaders, batch, payload)
+        base = base or rate
+        name = "threads" if w == 0 else str(w)
+        print(f"{name:>8} {rate:>10.0f} {rate/base:>7.2f}x {core:>11.2f} {wcpu:>13.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Admission control and backpressure (--admit[=QUEUE], --client-rate=R).
+#
+# On the leader, a CLIENT_TX is admitted only if both hold:
+#   - the client's token bucket has a token (RATE per second, up to BURST);
+#   - fewer than `capacity` admitted requests are still undecided.
+# Otherwise the client gets {"type": "BUSY", "reason", "retry_after": ms,
+# "data"} and sends the same request again later. It keeps its client_id/ts,
+# so it can never execute twice. retry_after is the time until the bucket
+# refills, or, for a full queue, the recent admitted-request latency.
+# A request leaves the queue when its instance is decided, or right away if
+# the leader does not propose it (invalid, duplicate, would overdraw). One
+# lost to a view change leaves after EXPIRY.
+#
+# A replica counts the instances it has seen ordered (PRE_PREPARE) but not yet
+# decided. When that lag reaches LAG_HIGH, it sends every member
+# FLOW {"pause": true}, and FLOW {"pause": false} once it drains to LAG_LOW.
+# A still-lagging replica repeats the pause every EXPIRY/2, and a pause that is
+# not repeated lapses after EXPIRY, so a crashed replica cannot hold it.
+# A leader halves its queue capacity while any replica is paused. It admits
+# nothing while more than f are paused, since then no quorum can keep up.
+#
+# With --admit, the node's json_server also runs at most MAX_THREADS
+# connection handlers. Further connections wait in the listen backlog instead
+# of each getting a thread. With --workers the same bound caps the decoded
+# messages queued for the dispatcher; a full queue stops the workers
+# accepting, so the backlog fills the same way.
+import collections
+import threading
+import time
+
+from pbft_request import key_of
+
+enabled = False
+capacity = 16
+RATE = 50.0                 # per client, requests per second
+BURST = 20
+EXPIRY = 10.0
+LAG_HIGH = 32
+LAG_LOW = 8
+MAX_THREADS = 64
+latency_ewma = None
+admitted = 0
+rejected = collections.Counter()    # reason -> count
+_buckets = {}                       # client -> [tokens, last refill]
+_queue = {}                         # request key -> admit time
+_ordered = {}                       # txid -> time seen ordered (replica lag)
+_paused = {}                        # pid -> (lag it reported, time)
+_pausing = 0.0                      # when we last asked the others to pause; 0: not pausing
+_signal = None
+_lock = threading.Lock()
+
+def configure(queue, rate, signal):
+    # signal(pause, lag): broadcast FLOW
+    global enabled, capacity, RATE, _signal
+    enabled = True
+    capacity = max(1, int(queue))
+    if rate:
+        RATE = max(0.1, float(rate))
+    _signal = signal
+
+def _expire(now):
+    for k in [k for k, t in _queue.items() if now - t > EXPIRY]:
+        del _queue[k]
+
+def limit(f):
+    # queue capacity given the replicas that asked to pause
+    now = time.time()
+    for p in [p for p, (_, t) in _paused.items() if now - t > EXPIRY]:
+        del _paused[p]
+    if len(_paused) > f:
+        return 0
+    return capacity // 2 if _paused else capacity
+
+def admit(op, client, f):
+    # -> None if admitted, else (reason, retry_after ms)
+    global admitted
+    now = time.time()
+    with _lock:
+        tokens, last = _buckets.get(client, (BURST, now))
+        tokens = min(BURST, tokens + (now - last) * RATE)
+        if tokens < 1:
+            _buckets[client] = [tokens, now]
+            rejected["rate"] += 1
+            return "rate", int((1 - tokens) / RATE * 1000) + 1
+        _expire(now)
+        cap = limit(f)
+        if len(_queue) >= cap:
+            _buckets[client] = [tokens, now]
+            reason = "replicas lagging" if cap < capacity else "queue full"
+            rejected[reason] += 1
+            return reason, int((latency_ewma or 0.1) * 1000) + 1
+        _buckets[client] = [tokens - 1, now]
+        _queue[key_of(op)] = now
+        admitted += 1
+    return None
+
+def drop(op):
+    # the leader did not propose an admitted request (invalid, duplicate, would overdraw)
+    with _lock:
+        _queue.pop(key_of(op), None)
+
+def ordered(txid):
+    global _pausing
+    if not enabled:
+        return
+    now = time.time()
+    with _lock:
+        _ordered[txid] = now
+        lag = len(_ordered)
+        fire = lag >= LAG_HIGH and now - _pausing > EXPIRY / 2
+        if fire:
+            _pausing = now
+    if fire and _signal:
+        _signal(True, lag)
+
+def decided(txid, ops):
+    global latency_ewma, _pausing
+    if not enabled:
+        return
+    now = time.time()
+    with _lock:
+        for op in ops:
+            t0 = _queue.pop(key_of(op), None)
+            if t0 is not None:
+                lat = now - t0
+                latency_ewma = lat if latency_ewma is None else 0.8 * latency_ewma + 0.2 * lat
+        _ordered.pop(txid, None)
+        for t in [t for t, ts in _ordered.items() if now - ts > EXPIRY]:
+            del _ordered[t]
+        lag = len(_ordered)
+        fire = bool(_pausing) and lag <= LAG_LOW
+        if fire:
+            _pausing = 0.0
+    if fire and _signal:
+        _signal(False, lag)
+
+def on_flow(pid, pause, lag):
+    with _lock:
+        if pause:
+            _paused[pid] = (lag, time.time())
+        else:
+            _paused.pop(pid, None)
+
+def summary_lines(f):
+    with _lock:
+        _expire(time.time())
+        cap = limit(f)
+        lines = [f"Admission: queue {len(_queue)}/{cap} (capacity {capacity}), {admitted} admitted, "
+                 f"busy {dict(rejected) or 0}, {RATE:g} req/s per client (burst {BURST}), "
+                 f"latency {'-' if latency_ewma is None else f'{latency_ewma * 1000:.1f} ms'}"]
+        lines.append(f"  Execution lag: {len(_ordered)} ordered, not decided"
+                     f"{' (asked the others to pause)' if _pausing else ''}; "
+                     f"paused replicas: {', '.join(f'{p} (lag {n})' for p, (n, _) in sorted(_paused.items())) or 'none'}; "
+                     f"threads: {threading.active_count()}")
+    return lines
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# Offline auditor: do the replicas' checkpoint files agree?
+#
+#   python pbft_audit.py <file or dir>... [--jobs=N] [--limit=10]
+#
+# Reads any number of checkpoint files (directories: every *.log under them):
+#   - manual snapshots ('checkpoint', final_checkpoint_<id>.log,
+#     P*_recovered_from_checkpoint.log): "# Node <ID> snapshot @ <time> ..."
+#     followed by "Transactions:", "Balances:" and "Client table:" lists
+#   - automatic checkpoints (P*_checkpoints.log, final_checkpoint_<s>_<n>.log):
+#     "# Node <ID> checkpoint shard=S seq=N digest=D" and one JSON body line
+# Each section is attributed to the node in its header, whatever the file.
+#
+# Files are parsed in parallel, one worker per file, and streamed: lines one
+# at a time, and a checkpoint body (one JSON line that grows with the history)
+# op by op, so memory does not grow with the file. Every fact becomes a
+# record (id, node, status, fingerprint), spread by id over hash buckets in a
+# scratch directory. The buckets are then compared in parallel, each one on
+# its own, so memory is bounded by a bucket, not by the history. Per id, a
+# node's latest record counts (latest snapshot, or highest checkpoint), and
+# every node that differs from the majority is reported:
+#   status   a tx with another status (COMMITTED vs ABORTED...)
+#   data     the same tx id or checkpointed seq with other op data
+#   balance  another balance in the latest snapshot, or at the same checkpoint
+#   digest   another checkpoint digest at the same shard/seq
+#   missing  ids the other nodes have (a lagging node, or files not given)
+# Exit status: 0 when nothing diverges, 1 otherwise.
+import collections
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from pbft_utils import split_flags
+
+BLOCK = 1 << 20             # characters read at a time
+BUCKET_BYTES = 16 << 20     # input bytes per bucket, roughly
+KINDS = ("status", "data", "balance", "digest", "missing")
+
+SNAPSHOT = re.compile(r"^# Node (\S+) snapshot @ (.+?) \(view=(\d+), leader=([^,)]+)(?:, shard=(\d+))?\)")
+CHECKPOINT = re.compile(r"^# Node (\S+) checkpoint shard=(\d+) seq=(\d+) digest=(\w+)")
+TX_LINE = re.compile(r"^  - (?:\[[^\]]*\] )?(\S+): (\S+) (.*)$")
+BAL_LINE = re.compile(r"^  - (.+?): (\S+)$")
+
+_dec = json.JSONDecoder()
+
+class Reader:
+    # lines of a text file, plus JSON values read in place for huge lines
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self):
+        data = self.f.read(BLOCK)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def readline(self):
+        while True:
+            i = self.buf.find("\n", self.pos)
+            if i >= 0:
+                line, self.pos = self.buf[self.pos:i + 1], i + 1
+                return line
+            if not self._fill():
+                line, self.pos = self.buf[self.pos:], len(self.buf)
+                return line
+
+    def peek(self, n):
+        while len(self.buf) - self.pos < n and self._fill():
+            pass
+        return self.buf[self.pos:self.pos + n]
+
+    def expect(self, literal):
+        if self.peek(len(literal)) != literal:
+            raise ValueError(f"expected {literal!r}, found {self.peek(20)!r}")
+        self.pos += len(literal)
+
+    def value(self):
+        while True:
+            try:
+                obj, end = _dec.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return obj
+
+def body_items(r):
+    # a checkpoint body {"balances":{...},"ops":[[seq,data],...],"state":"..."},
+    # keys sorted as pbft_checkpoint writes it -> ("balances", dict), ("op", seq, data)...
+    r.expect('{"balances":')
+    yield ("balances", r.value())
+    r.expect(',"ops":[')
+    while r.peek(1) != "]":
+        if r.peek(1) == ",":
+            r.expect(",")
+        seq, data = r.value()
+        yield ("op", seq, data)
+    r.expect("]")
+    r.readline()
+
+def fingerprint(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+class Spill:
+    # records of one input file, spread over bucket files by id
+    def __init__(self, workdir, tag, buckets):
+        self.workdir, self.tag, self.buckets = workdir, tag, buckets
+        self.files = {}
+        self.count = 0
+
+    def add(self, rid, node, status, fp, order):
+        b = zlib.crc32(rid.encode("utf-8")) % self.buckets
+        f = self.files.get(b)
+        if f is None:
+            f = self.files[b] = open(os.path.join(self.workdir, f"{b}.{self.tag}"), "w", encoding="utf-8")
+        f.write(f"{rid}\t{node}\t{status}\t{fp}\t{order}\n")
+        self.count += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def scan_checkpoint(r, spill, m):
+    # the body after a "# Node X checkpoint" header, streamed op by op
+    node, shard, seq, digest = m.group(1), int(m.group(2)), int(m.group(3)), m.group(4)
+    order = f"{seq:012d}"
+    spill.add(f"checkpoint {shard}/{seq}", node, "CHECKPOINT", digest, order)
+    per_seq = collections.Counter()
+    for item in body_items(r):
+        if item[0] == "balances":
+            for acct, val in item[1].items():
+                spill.add(f"balance {acct} @ {shard}/{seq}", node, "BALANCE", val, order)
+        else:
+            _, s, data = item
+            k = per_seq[s]
+            per_seq[s] += 1
+            spill.add(f"seq {shard}/{s}" + (f"/{k}" if k else ""), node, "COMMITTED",
+                      fingerprint(json.dumps(data, sort_keys=True)), order)
+
+def scan(job):
+    # one input file -> {"records", "nodes", "error"}; records go to the bucket files
+    path, tag, workdir, buckets = job
+    spill = Spill(workdir, tag, buckets)
+    nodes, error = set(), None
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            r = Reader(f)
+            node, stamp, section, n = None, "", None, 0
+            while True:
+                line = r.readline()
+                if not line:
+                    break
+                n += 1
+                line = line.rstrip("\n")
+                if section == "tx" and line.startswith("  - "):
+                    m = TX_LINE.match(line)
+                    if m:
+                        # the data as the node printed it; replicas print the leader's dict in its order
+                        spill.add(f"tx {m.group(1)}", node, m.group(2), fingerprint(m.group(3)), stamp)
+                    continue
+                if line.startswith("#"):
+                    node, section = None, None       # "# Stable checkpoint ...", "# Chunked snapshot ..."
+                    m = SNAPSHOT.match(line)
+                    if m:
+                        node = m.group(1)
+                        stamp = f"{m.group(2)}|{tag}|{n:012d}"      # later snapshot wins; ties: later in the file
+                        nodes.add(node)
+                    m = CHECKPOINT.match(line)
+                    if m:
+                        scan_checkpoint(r, spill, m)
+                        nodes.add(m.group(1))
+                    continue
+                if node is None:
+                    continue
+                if line.startswith("Transactions:"):
+                    section = "tx"
+                elif line.startswith("Balances:"):
+                    section = "balance"
+                elif line.startswith("Client table:"):
+                    section = None
+                elif section == "balance":
+                    m = BAL_LINE.match(line)
+                    if m:
+                        spill.add(f"balance {m.group(1)}", node, "BALANCE", m.group(2), stamp)
+    except (OSError, ValueError, json.JSONDecodeError) as e:
+        error = f"{path}: {e}"
+    finally:
+        spill.close()
+    return {"records": spill.count, "nodes": sorted(nodes), "error": error}
+
+def kind_of(rid, mine, common):
+    if rid.startswith("checkpoint "):
+        return "digest"
+    if rid.startswith("balance "):
+        return "balance"
+    return "status" if mine[0] != common[0] else "data"
+
+def compare(job):
+    # one bucket -> ({node: Counter(kind)}, [example], ids compared)
+    workdir, b, nodes, limit = job
+    latest = {}                 # id -> {node: (order, status, fp)}
+    for name in os.listdir(workdir):
+        if not name.startswith(f"{b}."):
+            continue
+        with open(os.path.join(workdir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                rid, node, status, fp, order = line.rstrip("\n").split("\t")
+                seen = latest.setdefault(rid, {})
+                if node not in seen or seen[node][0] < order:
+                    seen[node] = (order, status, fp)
+    counts = {n: collections.Counter() for n in nodes}
+    examples = []
+    for rid, seen in latest.items():
+        values = {node: (status, fp) for node, (_, status, fp) in seen.items()}
+        common, votes = collections.Counter(values.values()).most_common(1)[0]
+        if not rid.startswith("balance ") or "@" in rid:
+            for node in nodes:
+                if node not in values:
+                    counts[node]["missing"] += 1
+        odd = {node: v for node, v in values.items() if v != common}
+        if not odd or len(values) < 2:
+            continue
+        for node, v in odd.items():
+            counts[node][kind_of(rid, v, common)] += 1
+        if len(examples) < limit:
+            examples.append((rid, common, sorted(n for n, v in values.items() if v == common), odd))
+    return counts, examples, len(latest)
+
+def inputs(paths):
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                out += [os.path.join(root, n) for n in sorted(names) if n.endswith(".log")]
+        else:
+            out.append(p)
+    return out
+
+def show(value):
+    # a balance or digest as is; a tx as its status and data fingerprint
+    status, fp = value
+    return fp if status in ("BALANCE", "CHECKPOINT") else f"{status} {fp[:8]}"
+
+def main(argv):
+    paths, flags = split_flags(argv)
+    files = inputs(paths)
+    if not files:
+        print("Usage: python pbft_audit.py <file or dir>... [--jobs=N] [--limit=10]")
+        return 2
+    jobs = max(1, int(flags.get("jobs", os.cpu_count() or 1)))
+    limit = int(flags.get("limit", 10))
+    size = sum(os.path.getsize(p) for p in files if os.path.exists(p))
+    buckets = max(jobs, size // BUCKET_BYTES + 1)
+    workdir = tempfile.mkdtemp(prefix="pbft_audit_")
+    t0 = time.time()
+    try:
+        with mp.Pool(min(jobs, len(files))) as pool:
+            scanned = pool.map(scan, [(p, f"{i:05d}", workdir, buckets) for i, p in enumerate(files)])
+        t1 = time.time()
+        nodes = sorted({n for s in scanned for n in s["nodes"]})
+        with mp.Pool(min(jobs, buckets)) as pool:
+            compared = pool.map(compare, [(workdir, b, nodes, limit) for b in range(buckets)])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    t2 = time.time()
+    for s in scanned:
+        if s["error"]:
+            print(f"× {s['error']}")
+    records = sum(s["records"] for s in scanned)
+    counts = {n: collections.Counter() for n in nodes}
+    examples, ids = [], 0
+    for c, ex, n in compared:
+        ids += n
+        for node, kinds in c.items():
+            counts[node].update(kinds)
+        examples += ex
+    print(f"Audit: {len(files)} files ({size / 1048576:.1f} MiB), nodes {', '.join(nodes) or 'none'}")
+    print(f"  {records} records, {ids} ids; parsed in {t1 - t0:.2f}s ({size / 1048576 / max(t1 - t0, 1e-6):.1f} MiB/s), "
+          f"compared in {t2 - t1:.2f}s; {jobs} jobs, {buckets} buckets")
+    diverged = [n for n in nodes if any(counts[n][k] for k in KINDS if k != "missing")]
+    print(f"{'node':<6} " + " ".join(f"{k:>8}" for k in KINDS))
+    for n in nodes:
+        print(f"{n:<6} " + " ".join(f"{counts[n][k]:>8}" for k in KINDS))
+    if examples:
+        print(f"Examples (majority | others), first {min(limit, len(examples))}:")
+        for rid, common, agree, odd in sorted(examples)[:limit]:
+            others = "; ".join(f"{n} {show(v)}" for n, v in sorted(odd.items()))
+            print(f"  {rid}: {','.join(agree)} {show(common)} | {others}")
+    if diverged:
+        print(f"× Divergence on {', '.join(diverged)}")
+        return 1
+    print("✓ No divergence" + (" (some nodes miss ids; see 'missing')" if any(counts[n]["missing"] for n in nodes) else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
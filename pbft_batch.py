@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Adaptive request batching at the leader (--slo=MS, with --auto).
+#
+# CLIENT_TX requests are queued, and a batcher thread cuts them into
+# instances whose data is {"operation": "batch", "ops": [...]}. A cut happens
+# when `size` requests are waiting, or when the oldest one has waited
+# `timeout`, and only while fewer than `max_inflight` batches are in flight.
+# The operator sets only the latency SLO. After every finished batch the
+# controller retunes the three knobs from the queue depth, the in-flight
+# count and the measured commit latency (PRE_PREPARE to finalize) and
+# end-to-end latency (queue arrival to finalize):
+#   timeout       half of the headroom the SLO leaves above commit latency
+#   backlog       more pipelining first, then double the batch size
+#   over the SLO  without backlog: fewer in flight, halve the batch size
+#   well under    shrink the batch size by one (less time spent filling)
+import collections
+import threading
+import time
+
+enabled = False
+slo = 0.05                  # seconds
+size = 1
+timeout = 0.0
+max_inflight = 2
+MAX_SIZE = 256
+MAX_INFLIGHT = 8
+INFLIGHT_EXPIRY = 5.0       # a batch lost to a view change stops counting after this
+commit_ewma = None
+latency_ewma = None
+batches = 0
+history = collections.deque(maxlen=8)   # (time, size, timeout, max_inflight, reason)
+_queue = collections.deque()            # (data_str, arrival time)
+_inflight = {}                          # txid -> (start time, oldest arrival, n requests)
+_early = {}                             # txid -> finish time, when it finished before being registered
+_cv = threading.Condition()
+_propose = None
+
+def configure(slo_ms, propose):
+    # propose(list of data strings) -> txids of the instances started
+    global enabled, slo, timeout, _propose
+    enabled = True
+    slo = max(1.0, float(slo_ms)) / 1000.0
+    timeout = slo / 4
+    _propose = propose
+    history.append((time.time(), size, timeout, max_inflight, "start"))
+    threading.Thread(target=_loop, name="batcher", daemon=True).start()
+
+def submit(data_str):
+    with _cv:
+        _queue.append((data_str, time.time()))
+        _cv.notify_all()
+
+def _ready(now):
+    if not _queue or len(_inflight) >= max_inflight:
+        return False
+    return len(_queue) >= size or now - _queue[0][1] >= timeout
+
+def _loop():
+    while True:
+        with _cv:
+            while True:
+                now = time.time()
+                for txid in [t for t, v in _inflight.items() if now - v[0] > INFLIGHT_EXPIRY]:
+                    del _inflight[txid]
+                for txid in [t for t, ts in _early.items() if now - ts > INFLIGHT_EXPIRY]:
+                    del _early[txid]
+                if _ready(now):
+                    break
+                wait = 0.5
+                if _queue and len(_inflight) < max_inflight:
+                    wait = max(0.0005, timeout - (now - _queue[0][1]))
+                _cv.wait(wait)
+            cut = [_queue.popleft() for _ in range(min(size, len(_queue)))]
+        started = time.time()
+        try:
+            txids = _propose([d for d, _ in cut]) or []
+        except Exception as e:
+            print("× Batch proposal failed: ", e)
+            txids = []
+        with _cv:
+            for txid in txids:
+                info = (started, cut[0][1], len(cut))
+                if txid in _early:
+                    _finish(info, _early.pop(txid))
+                else:
+                    _inflight[txid] = info
+
+def on_done(txid):
+    # leader: a batch committed or aborted
+    with _cv:
+        info = _inflight.pop(txid, None)
+        if info is None:
+            _early[txid] = time.time()
+            return
+        _finish(info, time.time())
+
+def _finish(info, now):
+    global commit_ewma, latency_ewma, batches
+    commit, e2e = now - info[0], now - info[1]
+    commit_ewma = commit if commit_ewma is None else 0.8 * commit_ewma + 0.2 * commit
+    latency_ewma = e2e if latency_ewma is None else 0.8 * latency_ewma + 0.2 * e2e
+    batches += 1
+    _adjust()
+    _cv.notify_all()
+
+def _adjust():
+    global size, timeout, max_inflight
+    before = (size, timeout, max_inflight)
+    reason = None
+    timeout = min(slo / 2, max(0.0, slo - commit_ewma) / 2)
+    backlog = len(_queue) >= size
+    over = latency_ewma > slo
+    if backlog and not over and max_inflight < MAX_INFLIGHT:
+        max_inflight += 1; reason = "backlog, under SLO: more in flight"
+    elif backlog and size < MAX_SIZE:
+        size = min(MAX_SIZE, size * 2); reason = "backlog: bigger batches"
+    elif over and not backlog:
+        max_inflight = max(1, max_inflight - 1)
+        size = max(1, size // 2)
+        reason = "over SLO: fewer in flight, smaller batches"
+    elif latency_ewma < slo / 2 and not _queue and size > 1:
+        size -= 1; reason = "well under SLO: smaller batches"
+    moved = abs(timeout - before[1]) > 0.25 * max(before[1], 0.001)
+    if reason or moved:
+        history.append((time.time(), size, timeout, max_inflight, reason or "timeout follows commit latency"))
+
+def summary_lines():
+    with _cv:
+        lines = [f"Batching (SLO {slo * 1000:.0f} ms): size {size}, timeout {timeout * 1000:.1f} ms, "
+                 f"in flight {len(_inflight)}/{max_inflight}, queue {len(_queue)}, {batches} batches"]
+        if commit_ewma is not None:
+            lines.append(f"  commit {commit_ewma * 1000:.1f} ms, end-to-end {latency_ewma * 1000:.1f} ms (EWMA)")
+        for ts, s, to, mi, why in history:
+            lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(ts))}  size={s} "
+                         f"timeout={to * 1000:.1f}ms inflight={mi}  {why}")
+    return lines
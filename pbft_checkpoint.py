@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Automatic checkpoints (--checkpoint[=K], default K=16).
+#
+# Each node tracks, per shard, the highest seq n such that every seq 1..n is
+# decided locally (advance). Each time that frontier passes a multiple of K,
+# the node takes a checkpoint at that multiple.
+#
+# Decided instances are never modified again, so the snapshot is a list of
+# references to the committed entries with seq <= n, taken on the thread
+# that decided the instance. This is copy-on-write in effect: consensus keeps
+# changing the live log while the snapshot stays fixed. A background thread
+# serializes the snapshot, computes its digest, appends it to
+# checkpoints/<id>_checkpoints.log and announces the digest to every member
+# as CHECKPOINT_DIGEST.
+#
+# A checkpoint is stable once 2f+1 members report the same digest. The
+# digest covers the committed ops, in seq order, and the balances the node's
+# own ledger (pbft_exec) holds with exactly those ops executed, read from the
+# live executed state (balances_of), so a replica whose execution diverged
+# cannot match. The shard leader then writes final_checkpoint_<shard>_<seq>.log,
+# which recovery ships. Without 2f+1 matching digests after TIMEOUT, the
+# checkpoint is dropped with a warning instead of waiting forever.
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+interval = 0                # K; 0: automatic checkpoints off
+TIMEOUT = 5.0
+stable = {}                 # shard -> (seq, digest, signers)
+history = collections.deque(maxlen=8)   # (time, shard, seq, outcome)
+_frontier = {}              # shard -> every seq up to here is decided
+_votes = {}                 # (shard, seq) -> {digest: set(pids)}
+_mine = {}                  # (shard, seq) -> (digest, text)
+_balances = {}              # (shard, seq) -> the balances our digest covers
+_closed = set()             # (shard, seq) stable or timed out
+_stable_at = {}             # (shard, seq) -> (digest, signers), kept until our own snapshot is in
+_on_stable = None
+_lock = threading.Lock()
+
+def configure(k, on_stable):
+    # on_stable(shard, seq, digest, signers, text): 2f+1 matched and our snapshot has that digest
+    global interval, _on_stable
+    interval = max(1, int(k))
+    _on_stable = on_stable
+
+def advance(shard, decided):
+    # decided(seq) -> bool; returns the checkpoint seqs the frontier just passed
+    if not interval:
+        return []
+    due = []
+    with _lock:
+        n = _frontier.get(shard, 0)
+        while decided(n + 1):
+            n += 1
+            if n % interval == 0:
+                due.append(n)
+        _frontier[shard] = n
+    return due
+
+def state_of(ops, balances):
+    # ops: [(seq, data)] committed, in seq order; balances: the executed state
+    # after exactly those ops -> (canonical JSON, digest)
+    state = hashlib.sha256(json.dumps(sorted(balances.items()), separators=(",", ":")).encode("utf-8")).hexdigest()[:32]
+    body = json.dumps({"ops": ops, "balances": balances, "state": state},
+                      sort_keys=True, separators=(",", ":"))
+    return body, hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]
+
+def take(node, shard, seq, ops, balances_of, announce):
+    # ops is the frozen snapshot; balances_of(shard, seq) reads the ledger as of seq.
+    # Everything else happens off the consensus path
+    def run():
+        t0 = time.time()
+        balances = balances_of(shard, seq)
+        body, digest = state_of(ops, balances)
+        text = f"# Node {node} checkpoint shard={shard} seq={seq} digest={digest}\n{body}\n"
+        os.makedirs("checkpoints", exist_ok=True)
+        with open(os.path.join("checkpoints", f"{node}_checkpoints.log"), "a", encoding="utf-8") as f:
+            f.write(text)
+        with _lock:
+            _mine[(shard, seq)] = (digest, text)
+            _balances[(shard, seq)] = balances
+            late = _stable_at.pop((shard, seq), None)
+        print(f"\n→ Checkpoint shard {shard} seq {seq}: digest {digest[:12]}… "
+              f"({len(ops)} ops, {(time.time() - t0) * 1000:.1f} ms in background)")
+        if late and late[0] == digest and _on_stable:
+            _on_stable(shard, seq, digest, late[1], text)
+        announce(shard, seq, digest)
+        threading.Timer(TIMEOUT, _expire, args=(shard, seq)).start()
+    threading.Thread(target=run, name="checkpoint", daemon=True).start()
+
+def balances_at(shard, seq):
+    # the executed balances behind our checkpoint at (shard, seq), or None
+    with _lock:
+        return _balances.get((shard, seq))
+
+def vote(shard, seq, pid, digest, quorum):
+    # a CHECKPOINT_DIGEST (ours included); -> True the first time 2f+1 match
+    key = (shard, seq)
+    with _lock:
+        if key in _closed:
+            return False
+        signers = _votes.setdefault(key, {}).setdefault(digest, set())
+        signers.add(pid)
+        if len(signers) < quorum:
+            return False
+        _closed.add(key)
+        signers = sorted(signers)
+        stable[shard] = (seq, digest, signers)
+        history.append((time.time(), shard, seq, f"stable, {len(signers)} matching"))
+        for old in [k for k in _votes if k[0] == shard and k[1] <= seq]:
+            _votes.pop(old, None)
+        for old in [k for k in _mine if k[0] == shard and k[1] < seq]:
+            _mine.pop(old, None)
+            _balances.pop(old, None)
+        mine = _mine.get(key)
+        if mine is None:
+            _stable_at[key] = (digest, signers)
+    if mine and mine[0] != digest:
+        print(f"\n! Checkpoint shard {shard} seq {seq}: our digest {mine[0][:12]}… differs from the stable one")
+    elif mine and _on_stable:
+        _on_stable(shard, seq, digest, signers, mine[1])
+    return True
+
+def _expire(shard, seq):
+    key = (shard, seq)
+    with _lock:
+        if key in _closed:
+            return
+        _closed.add(key)
+        counts = {d[:12]: len(s) for d, s in _votes.pop(key, {}).items()}
+        history.append((time.time(), shard, seq, f"timed out, digests {counts}"))
+    print(f"\n× Checkpoint shard {shard} seq {seq} not stable after {TIMEOUT:.0f}s (digests seen: {counts})")
+
+def write_final(shard, seq, digest, signers, text):
+    os.makedirs("checkpoints", exist_ok=True)
+    path = os.path.join("checkpoints", f"final_checkpoint_{shard}_{seq}.log")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# Stable checkpoint shard={shard} seq={seq} digest={digest} signers={','.join(signers)}\n")
+        f.write(text)
+    return path
+
+def summary_lines():
+    lines = [f"Checkpoints every {interval} seqs: " +
+             (", ".join(f"shard {s} stable at seq {v[0]} ({v[1][:12]}…, {len(v[2])} signers)"
+                        for s, v in sorted(stable.items())) or "none stable yet")]
+    for ts, shard, seq, outcome in history:
+        lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(ts))}  shard {shard} seq {seq}: {outcome}")
+    return lines
@@ -2,28 +2,234 @@
 import sys
 import threading
 import time
-from pbft_utils import json_server, json_send
+from pbft_utils import json_server, json_send, split_flags, short_uuid
+import pbft_trace
+import pbft_config
+import pbft_workload
+from pbft_request import ops_of
 
 HOST = "127.0.0.1"
 client_port = None
+client_id = None      # stamped on every request with a strictly growing ts (exactly-once)
+last_ts = 0
+last_request = None
 primary_host, primary_port = "127.0.0.1", 5000
+view = -1             # newest view a replica told us about; requests go to its leader
+leader = "P0"
+waiting = {}          # ts -> request data with no REPLY yet
+REQUEST_TIMEOUT = 2.0
 
 def banner():
-    print(f"✓ Client started at localhost:{client_port}")
+    print(f"✓ Client started at {HOST}:{client_port}")
     try:
-        json_send(primary_host, primary_port, {"type":"CLIENT_HELLO", "host":"127.0.0.1", "port": client_port})
+        json_send(primary_host, primary_port, {"type":"CLIENT_HELLO", "host":HOST, "port": client_port})
         print(f"✓ Connected to primary {primary_host}:{primary_port}")
     except Exception:
         print("× Cannot connect to primary; please make sure the primary is running")
     print("="*60)
     print("\nCommands:")
-    print("  send <k=v,...>  - send a request to the current leader")
+    print("  send <k=v,...>  - send a request to the current leader (every replica if it does not answer)")
+    print("  retry           - re-send the last request (same client_id/ts) to every replica")
+    print("  balance account=<name> - read-only query (2f+1 matching replies, no consensus)")
     print("  list            - show number of replies received (from all nodes)")
     print("  quit            - exit")
     print("\nclient> ", end="", flush=True)
 
 replies = []
 current_txid = None
+members = {}          # id -> (host, port), learned from P0's MEMBERS
+pending_reads = {}    # qid -> {"account","replies":{node: balance},"t0","done"}
+READ_TIMEOUT = 2.0
+reads_lock = threading.Lock()
+tentative_replies = {}  # txid -> {node: (result, balance)}
+accepted = set()        # txids accepted on 2f+1 matching tentative replies
+spec_replies = {}       # txid -> {"replies":{node: (history, result, balance)},"t0","done"}
+SPEC_TIMEOUT = 0.5
+busy_retries = {}       # request data -> BUSY replies so far
+MAX_BUSY_RETRIES = 5
+
+def next_ts():
+    # milliseconds, strictly increasing even across restarts with the same client id
+    global last_ts
+    last_ts = max(last_ts + 1, int(time.time() * 1000))
+    return last_ts
+
+def read_quorum():
+    N = len(members)
+    f = max(0, (N - 1)//3)
+    return 2*f + 1
+
+def start_read(account):
+    if not members:
+        print("× Membership unknown yet; is the primary running?")
+        return
+    qid = short_uuid()
+    with reads_lock:
+        pending_reads[qid] = {"account": account, "replies": {}, "t0": time.time(), "done": False}
+    req = {"type":"READ","qid":qid,"account":account,"host":HOST,"port":client_port}
+    for pid,(h,p) in list(members.items()):
+        try:
+            json_send(h, p, req)
+        except Exception:
+            pass
+    threading.Timer(READ_TIMEOUT, read_timeout, args=(qid,)).start()
+    print(f"→ Read-only query {qid} sent to {len(members)} replicas (need {read_quorum()} matching)")
+
+def ordered_read(qid, account, reason):
+    # called outside reads_lock, once the caller marked the read done. Only a
+    # leader started with --auto orders it; a manual leader just logs it
+    print(f"\n! Read {qid} {reason}; falling back to an ordered read through the leader "
+          f"(answered when the nodes run with --auto)")
+    h, p = leader_addr()
+    try:
+        json_send(h, p, {"type":"CLIENT_TX", "data": f"account={account},operation=balance",
+                         "from_port": client_port})
+    except Exception:
+        print(f"× Cannot reach leader {leader} for the ordered read")
+    print("client> ", end="", flush=True)
+
+def on_read_reply(msg):
+    qid = msg.get("qid")
+    fallback = None
+    with reads_lock:
+        info = pending_reads.get(qid)
+        if not info or info["done"]:
+            return
+        info["replies"][msg.get("from")] = msg.get("balance")
+        tally = {}
+        for v in info["replies"].values():
+            tally[v] = tally.get(v, 0) + 1
+        need = read_quorum()
+        best, n = max(tally.items(), key=lambda kv: kv[1])
+        if n >= need:
+            info["done"] = True
+            ms = (time.time() - info["t0"]) * 1000
+            print(f"\n✓ balance {info['account']} = {best}  ({n}/{len(members)} matching, fast path, {ms:.1f} ms)")
+            print("client> ", end="", flush=True)
+            return
+        missing = len(members) - len(info["replies"])
+        if n + missing < need:
+            info["done"] = True
+            fallback = (qid, info["account"], f"got mismatching replies {tally}")
+    if fallback:
+        ordered_read(*fallback)
+
+def to_all_members(obj):
+    for pid,(h,p) in list(members.items()):
+        try:
+            json_send(h, p, obj)
+        except Exception:
+            pass
+
+def leader_addr():
+    return tuple(members.get(leader) or (primary_host, primary_port))
+
+def learn_view(msg):
+    # REPLY/SPEC_REPLY/BUSY/MEMBERS say which view the sender is in and who leads it
+    global view, leader
+    v = msg.get("view")
+    if not isinstance(v, int) or v <= view or not msg.get("leader"):
+        return
+    if msg["leader"] != leader:
+        print(f"\n→ Leader is now {msg['leader']} (view {v})")
+    view, leader = v, msg["leader"]
+
+def send_to_all(data):
+    # every replica gets its own copy; the leader orders it, the others watch it
+    targets = dict(members) or {"P0": (primary_host, primary_port)}
+    for pid, (h, p) in targets.items():
+        try:
+            json_send(h, p, {"type":"CLIENT_TX", "data": data, "from_port": client_port, "to_all": True})
+        except Exception:
+            pass
+    return len(targets)
+
+def submit(data, ts):
+    # to the leader we know of; a replica that is not the leader forwards it
+    waiting[ts] = data
+    h, p = leader_addr()
+    try:
+        json_send(h, p, {"type":"CLIENT_TX", "data": data, "from_port": client_port})
+    except Exception:
+        waiting.pop(ts, None)
+        print(f"× Cannot reach leader {leader}; sent to {send_to_all(data)} replicas")
+        return
+    threading.Timer(REQUEST_TIMEOUT, request_timeout, args=(ts,)).start()
+
+def request_timeout(ts):
+    data = waiting.pop(ts, None)
+    if data is None:
+        return
+    n = send_to_all(data)
+    print(f"\n! No reply from leader {leader} in {REQUEST_TIMEOUT:g}s; sent {client_id}#{ts} to {n} replicas")
+    print("client> ", end="", flush=True)
+
+def on_spec_reply(msg):
+    txid = msg.get("txid")
+    with reads_lock:
+        info = spec_replies.get(txid)
+        if info is None:
+            info = spec_replies[txid] = {"replies": {}, "t0": time.time(), "done": False}
+            threading.Timer(SPEC_TIMEOUT, spec_timeout, args=(txid,)).start()
+        if info["done"]:
+            return
+        info["replies"][msg.get("from")] = (msg.get("history"), msg.get("result"), msg.get("balance"))
+        mine = info["replies"][msg.get("from")]
+        n = sum(1 for v in info["replies"].values() if v == mine)
+        f = max(0, (len(members) - 1)//3)
+        fast = n >= 3*f + 1
+        if fast:
+            info["done"] = True
+        elif len(info["replies"]) < len(members):
+            return
+    if not fast:
+        spec_timeout(txid)  # every replica answered without 3f+1 agreement: fall back now
+        return
+    ms = (time.time() - info["t0"]) * 1000
+    extra = f", balance={mine[2]}" if mine[2] is not None else ""
+    print(f"\n✓ Tx {txid} {mine[1]}{extra}: {n} matching speculative replies ({ms:.1f} ms, fast path)")
+    to_all_members({"type":"SPEC_COMMIT","txid":txid,"history":mine[0],"host":HOST,"port":client_port})
+    print("client> ", end="", flush=True)
+
+def spec_timeout(txid):
+    with reads_lock:
+        info = spec_replies.get(txid)
+        if not info or info["done"]:
+            return
+        info["done"] = True
+    print(f"\n! Tx {txid}: only {len(info['replies'])} speculative replies / not all matching; "
+          f"falling back to PREPARE/COMMIT")
+    to_all_members({"type":"SPEC_FALLBACK","txid":txid})
+    print("client> ", end="", flush=True)
+
+def on_busy(msg):
+    # --admit on the leader: resend the same request (same client_id/ts) after retry_after
+    data = msg.get("data")
+    n = busy_retries.get(data, 0) + 1
+    busy_retries[data] = n
+    if n > MAX_BUSY_RETRIES:
+        print(f"\n× {msg.get('from')} still busy ({msg.get('reason')}) after {MAX_BUSY_RETRIES} retries; giving up")
+        busy_retries.pop(data, None)
+    else:
+        delay = msg.get("retry_after", 100) / 1000.0
+        print(f"\n! {msg.get('from')} busy ({msg.get('reason')}); retrying in {delay * 1000:.0f} ms ({n}/{MAX_BUSY_RETRIES})")
+        threading.Timer(delay, resend, args=(data,)).start()
+    print("client> ", end="", flush=True)
+
+def resend(data):
+    try:
+        h, p = leader_addr()
+        json_send(h, p, {"type":"CLIENT_TX", "data": data, "from_port": client_port})
+    except Exception:
+        print(f"\n× Cannot reach leader {leader} to retry {data}")
+
+def read_timeout(qid):
+    with reads_lock:
+        info = pending_reads.get(qid)
+        if not info or info["done"]:
+            return
+        info["done"] = True
+    ordered_read(qid, info["account"], f"timed out with {len(info['replies'])} replies")
 
 
 # def on_msg(msg, addr):
@@ -37,8 +243,33 @@ current_txid = None
 def on_msg(msg, addr):
     global current_txid, replies
     t = msg.get("type")
+    if t in ("MEMBERS", "REPLY", "SPEC_REPLY", "BUSY"):
+        learn_view(msg)
+    if t == "MEMBERS":
+        members.clear()
+        members.update({k: tuple(v) for k, v in msg.get("members", {}).items()})
+        return
+    if t == "READ_REPLY":
+        on_read_reply(msg)
+        return
+    if t == "SPEC_REPLY":
+        on_spec_reply(msg)
+        return
+    if t == "BUSY":
+        on_busy(msg)
+        return
+    if t == "REPLY" and msg.get("txid") is None:
+        # dropped by the leader before ordering (overdraft, wrong shard leader, ...)
+        for op in ops_of(msg.get("data") if isinstance(msg.get("data"), dict) else None):
+            if op.get("client_id") == client_id:
+                waiting.pop(str(op.get("ts")), None)
+        print(f"\n× Request not ordered by {msg.get('from')} ({msg.get('result')}: {msg.get('reason')}): {msg.get('data')}")
+        print("client> ", end="", flush=True)
+        return
     if t == "REPLY":
         txid = msg.get("txid")
+        pbft_trace.span(msg.get("trace_id"), txid, "receive", msg=t, src=msg.get("from"),
+                        result=msg.get("result"))
         # 若收到新的交易 ID，则清零统计
         if current_txid != txid:
             current_txid = txid
@@ -46,17 +277,41 @@ def on_msg(msg, addr):
             print(f"\n=== New transaction started: {txid} ===")
 
         replies.append(msg)
+        for op in ops_of(msg.get("data") if isinstance(msg.get("data"), dict) else None):
+            if op.get("client_id") == client_id:
+                waiting.pop(str(op.get("ts")), None)
         src = msg.get("from", "unknown")
         result = msg.get("result", "?")
+        if "balance" in msg:
+            result += f", balance={msg['balance']}"
+        if msg.get("cached"):
+            result += ", from reply cache"
+        if msg.get("tentative"):
+            result += ", tentative"
         print(f"\n→ REPLY received from {src} ({result})")
         print(f"  Total replies for tx {current_txid}: {len(replies)} (expected: all nodes will reply)")
+        if msg.get("tentative"):
+            votes = tentative_replies.setdefault(txid, {})
+            votes[src] = (msg.get("result"), msg.get("balance"))
+            n = sum(1 for v in votes.values() if v == votes[src])
+            if txid not in accepted and n >= read_quorum():
+                accepted.add(txid)
+                print(f"✓ Tx {txid} accepted: {n} matching tentative replies ({msg.get('result')})")
         print("client> ", end="", flush=True)
 
 
+def parse_account(arg):
+    for pair in arg.split(","):
+        k, eq, v = pair.partition("=")
+        if eq and k.strip() == "account":
+            return v.strip()
+    return arg if arg and "=" not in arg else None
+
 def server():
-    json_server("127.0.0.1", client_port, on_msg, on_ready=banner)
+    json_server(HOST, client_port, on_msg, on_ready=banner)
 
 def repl():
+    global last_request
     while True:
         try:
             cmd = input("client> ").strip()
@@ -66,8 +321,22 @@ def repl():
             continue
         if cmd.startswith("send "):
             payload = cmd[len("send "):].strip()
-            json_send(primary_host, primary_port, {"type":"CLIENT_TX", "data": payload, "from_port": client_port})
-            print("→ Submitted to primary")
+            last_request = f"{payload},client_id={client_id},ts={next_ts()}"
+            submit(last_request, str(last_ts))
+            pbft_workload.record(last_request, f"{HOST}:{client_port}")
+            print(f"→ Submitted to leader {leader} ({client_id}#{last_ts})")
+        elif cmd == "retry":
+            if not last_request:
+                print("× Nothing sent yet")
+                continue
+            print(f"→ Retried {last_request} to {send_to_all(last_request)} replicas")
+        elif cmd.startswith("balance "):
+            arg = cmd[len("balance "):].strip()
+            account = parse_account(arg)
+            if not account:
+                print("Usage: balance account=<name>")
+            else:
+                start_read(account)
         elif cmd == "list":
             print(f"Replies received: {len(replies)}")
         elif cmd == "quit":
@@ -78,12 +347,28 @@ def repl():
             print("Unknown command")
 
 if __name__ == "__main__":
-    if len(sys.argv) >= 2:
+    args, flags = split_flags(sys.argv[1:])
+    own = None
+    if flags.get("config"):
+        pbft_config.load(flags["config"])
+        primary_host, primary_port = pbft_config.nodes["P0"]
+        members.update(pbft_config.members())
+        own = pbft_config.clients.get(flags.get("id"))
+        if own:
+            HOST = own[0]
+    if len(args) >= 1:
         try:
-            client_port = int(sys.argv[1])
+            client_port = int(args[0])
         except Exception:
             client_port = 7000
     else:
-        client_port = 7000
+        client_port = own[1] if own else 7000
+    client_id = flags.get("id") if isinstance(flags.get("id"), str) else f"C{client_port}"
+    if flags.get("trace"):
+        path = pbft_trace.enable(f"C{client_port}", None if flags["trace"] is True else flags["trace"])
+        print(f"✓ Tracing enabled: {path}")
+    if flags.get("record"):
+        path = pbft_workload.enable(client_id, None if flags["record"] is True else flags["record"])
+        print(f"✓ Recording requests: {path}")
     threading.Thread(target=server, daemon=True).start()
     repl()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Static cluster configuration (--config=FILE), shared by all three scripts.
+#
+#   {
+#     "nodes":   {"P0": {"host": "10.0.0.1", "port": 5000, "key": "<hex>"},
+#                 "P1": {"host": "10.0.0.2", "port": 5001, "key": "<hex>"}, ...},
+#     "clients": {"C1": {"host": "10.0.0.9", "port": 7000}},
+#     "byzantine": "P3",            optional, the lab's Byzantine node
+#     "dir": "/srv/pbft"            optional, repo path on remote hosts (pbft_launch)
+#   }
+#
+# A node started with --config binds to its own address and starts with the
+# full membership, so it skips the REGISTER/MEMBERS handshake with P0. P0 is
+# still the bootstrap leader and still takes CLIENT_HELLO. A key is a shared
+# secret per node that a --join request presents. A node that registers
+# instead has no config and so no key: a configured P0 accepts its REGISTER
+# only if the id is listed at the address it registers from.
+import json
+import secrets
+
+path = None
+nodes = {}                  # id -> (host, port)
+clients = {}                # id -> (host, port)
+keys = {}                   # id -> key
+byzantine = None
+remote_dir = None
+
+def load(p):
+    global path, byzantine, remote_dir
+    with open(p, encoding="utf-8") as f:
+        cfg = json.load(f)
+    if "P0" not in cfg.get("nodes", {}):
+        raise ValueError(f"{p}: 'nodes' must include P0")
+    path = p
+    nodes.clear(); clients.clear(); keys.clear()
+    for nid, n in cfg["nodes"].items():
+        nodes[nid] = (n.get("host", "127.0.0.1"), int(n["port"]))
+        if n.get("key"):
+            keys[nid] = n["key"]
+    for cid, c in (cfg.get("clients") or {}).items():
+        clients[cid] = (c.get("host", "127.0.0.1"), int(c["port"]))
+    byzantine = cfg.get("byzantine")
+    remote_dir = cfg.get("dir")
+    return cfg
+
+def loaded():
+    return path is not None
+
+def members():
+    return {nid: tuple(hp) for nid, hp in nodes.items()}
+
+def key_ok(pid, key):
+    # JOIN_REQUEST check on a configured node
+    return pid in nodes and (pid not in keys or key == keys[pid])
+
+def listed_at(pid, host, port):
+    # REGISTER check on a configured P0
+    return nodes.get(pid) == (host, int(port))
+
+def make(n, hosts=("127.0.0.1",), base_port=5000, byzantine="P3", n_clients=0, client_port=7000):
+    # nodes P0..P(n-1) round-robin over hosts; ports are unique per cluster
+    cfg = {"nodes": {}, "clients": {}}
+    for i in range(n):
+        cfg["nodes"][f"P{i}"] = {"host": hosts[i % len(hosts)], "port": base_port + i, "key": secrets.token_hex(16)}
+    for i in range(n_clients):
+        cfg["clients"][f"C{i + 1}"] = {"host": hosts[0], "port": client_port + i}
+    if byzantine and byzantine in cfg["nodes"]:
+        cfg["byzantine"] = byzantine
+    return cfg
+
+def save(cfg, p):
+    with open(p, "w", encoding="utf-8") as f:
+        json.dump(cfg, f, indent=2)
+        f.write("\n")
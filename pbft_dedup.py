@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Exactly-once client requests: per-client table of executed stamps and replies.
+#
+# The client stamps each request with client_id=<id>,ts=<n>, where n grows
+# strictly per client. The stamps travel inside the tx data (and inside every
+# op of a batch). Each node keeps one entry per client: the highest ts it
+# executed and the replies to the stamps it executed within WINDOW of that.
+# A client may have several requests in flight, and they can be ordered in
+# any order, so "executed" is per stamp, not "anything up to the newest":
+#   - a retry of an executed request is answered from the table, without
+#     running consensus again (CLIENT_TX at any replica)
+#   - the leader does not propose a request that is already in flight or
+#     executed (begin, right before proposing; release when it drops one)
+#   - an honest replica votes no on an instance that carries an executed
+#     stamp, or one older than the window (is_new), so a duplicate cannot
+#     commit even if a leader proposes it
+# The table is bounded by clients x WINDOW. It is written into checkpoints
+# and shipped with CHECKPOINT_SYNC on recovery.
+import threading
+
+WINDOW = 64                 # executed stamps remembered per client, below its highest
+table = {}                  # client_id -> {"ts": highest, "done": {"<ts>": {"txid", "result", "balance"?}}}
+_pending = {}               # client_id -> {ts proposed by this node, not executed yet}
+_lock = threading.Lock()
+
+def stamp(op):
+    cid = (op or {}).get("client_id")
+    try:
+        return (cid, int(str(op.get("ts")))) if cid else (None, None)
+    except Exception:
+        return None, None
+
+def _executed(cid, ts, txid=None):
+    # under _lock: ts already executed (or too old to tell), other than as instance txid
+    last = table.get(cid)
+    if last is None:
+        return False
+    done = last["done"].get(str(ts))
+    if done is not None:
+        return txid is None or done["txid"] != txid
+    return ts <= last["ts"] - WINDOW
+
+def is_new(op, txid=None):
+    # the same instance seen again (e.g. re-proposed after a view change) still counts as new
+    cid, ts = stamp(op)
+    if cid is None:
+        return True
+    with _lock:
+        return not _executed(cid, ts, txid)
+
+def cached(op):
+    # -> the recorded reply if this exact request already executed, else None
+    cid, ts = stamp(op)
+    if cid is None:
+        return None
+    with _lock:
+        last = table.get(cid)
+        done = last and last["done"].get(str(ts))
+        return dict(done, ts=ts) if done else None
+
+def begin(op):
+    # leader, right before proposing: False if the request already executed or is in flight
+    cid, ts = stamp(op)
+    if cid is None:
+        return True
+    with _lock:
+        if _executed(cid, ts) or ts in _pending.get(cid, ()):
+            return False
+        _pending.setdefault(cid, set()).add(ts)
+        return True
+
+def release(op):
+    # leader: a begun request was dropped before it was proposed
+    cid, ts = stamp(op)
+    if cid is None:
+        return
+    with _lock:
+        _done_pending(cid, ts)
+
+def _done_pending(cid, ts):
+    waiting = _pending.get(cid)
+    if waiting is not None:
+        waiting.discard(ts)
+        if not waiting:
+            del _pending[cid]
+
+def _merge(cid, ts, done):
+    # under _lock
+    last = table.setdefault(cid, {"ts": ts, "done": {}})
+    last["done"].update(done)
+    last["ts"] = max(last["ts"], ts)
+    for k in [k for k in last["done"] if int(k) <= last["ts"] - WINDOW]:
+        del last["done"][k]
+
+def record(op, txid, result, balance=None):
+    cid, ts = stamp(op)
+    if cid is None:
+        return
+    entry = {"txid": txid, "result": result}
+    if balance is not None:
+        entry["balance"] = balance
+    with _lock:
+        _merge(cid, ts, {str(ts): entry})
+        _done_pending(cid, ts)
+
+def load(incoming):
+    if not isinstance(incoming, dict):
+        return
+    with _lock:
+        for cid, entry in incoming.items():
+            if "done" in entry:
+                _merge(cid, entry["ts"], entry["done"])
+            else:       # one reply per client, as older nodes ship it
+                _merge(cid, entry["ts"], {str(entry["ts"]): {k: v for k, v in entry.items() if k != "ts"}})
+
+def snapshot():
+    with _lock:
+        return {cid: {"ts": entry["ts"], "done": {k: dict(v) for k, v in entry["done"].items()}}
+                for cid, entry in table.items()}
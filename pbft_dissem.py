@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Fan-out tree dissemination of request payloads (--tree[=K]).
+#
+# Without it the leader sends the full payload in PRE_PREPARE to every
+# replica, so its egress grows with N. With --tree the leader sends each
+# replica only a digest-only PRE_PREPARE, which is enough to order the
+# request. The payload itself goes out as PAYLOAD to the leader's K children
+# in a K-ary tree over the members (leader first, then the others in id
+# order). Every node checks it against its digest (and against the order's
+# digest, if the order is already here) before forwarding it to its own
+# children, so a corrupted payload stops at the first hop. A replica goes on with
+# the ordinary PRE_PREPARE handling once it holds both parts and the payload
+# matches the digest. If the payload has not arrived after FETCH_AFTER seconds
+# (for example because a forwarder crashed), the replica fetches it from the
+# leader with PAYLOAD_REQUEST. Delivered txids are remembered, oldest first,
+# up to MAX_DELIVERED, which is enough to drop a late duplicate PAYLOAD.
+import collections
+import hashlib
+import json
+import threading
+
+enabled = False
+fanout = 2
+FETCH_AFTER = 1.0
+MAX_DELIVERED = 4096
+_orders = {}                # txid -> digest-only PRE_PREPARE waiting for its payload
+_payloads = {}              # txid -> (digest, data) waiting for its PRE_PREPARE
+_delivered = collections.OrderedDict()   # txids already handed on (late duplicates are ignored)
+_lock = threading.Lock()
+
+def configure(k):
+    global enabled, fanout
+    enabled = True
+    fanout = max(1, int(k))
+
+def digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+def children(ids, root, node):
+    if root is None or root not in ids:
+        return []
+    order = [root] + [x for x in ids if x != root]
+    if node not in order:
+        return []
+    i = order.index(node)
+    return order[i * fanout + 1:i * fanout + fanout + 1]
+
+def digest_only(msg):
+    out = dict(msg)
+    out["digest"] = digest(msg["data"])
+    out["data"] = None
+    return out
+
+def payload(msg, sender, root=None):
+    return {"type": "PAYLOAD", "txid": msg["txid"], "digest": digest(msg["data"]), "data": msg["data"],
+            "root": root, "from": sender}
+
+def on_order(msg):
+    # -> the full PRE_PREPARE if the payload is already here, else None
+    with _lock:
+        _delivered.pop(msg["txid"], None)    # a re-sent order (new view) starts over
+        got = _payloads.pop(msg["txid"], None)
+        if got and got[0] == msg["digest"]:
+            _deliver(msg["txid"])
+            return dict(msg, data=got[1])
+        _orders[msg["txid"]] = msg
+        return None
+
+def valid(msg):
+    # a PAYLOAD is forwarded and used only if this holds
+    if digest(msg.get("data")) != msg.get("digest"):
+        print(f"× PAYLOAD for tx {msg.get('txid')} does not match its digest; dropped")
+        return False
+    with _lock:
+        order = _orders.get(msg.get("txid"))
+    if order and order["digest"] != msg["digest"]:
+        print(f"× PAYLOAD for tx {msg.get('txid')} does not match the order's digest; dropped")
+        return False
+    return True
+
+def on_payload(msg):
+    # msg passed valid() -> the full PRE_PREPARE if its digest-only order is already here, else None
+    with _lock:
+        if msg["txid"] in _delivered:
+            return None
+        order = _orders.get(msg["txid"])
+        if order and order["digest"] == msg["digest"]:
+            del _orders[msg["txid"]]
+            _deliver(msg["txid"])
+            return dict(order, data=msg["data"])
+        if order is None:
+            _payloads[msg["txid"]] = (msg["digest"], msg["data"])
+        return None
+
+def _deliver(txid):
+    # under _lock
+    _delivered[txid] = True
+    while len(_delivered) > MAX_DELIVERED:
+        _delivered.popitem(last=False)
+
+def waiting(txid):
+    with _lock:
+        return txid in _orders
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Account state machine: interned accounts and a balance vector.
+#
+# Each account name gets an integer index the first time it is seen, and all
+# balances live in one array('q'). A tx's ops are compiled once into two
+# parallel arrays, account index and signed amount, so every amount string is
+# parsed a single time. Applying a compiled batch is one pass over the two
+# arrays: numpy.add.at on zero-copy views when numpy is installed and the
+# batch has at least VECTOR_MIN ops, and a tight loop otherwise.
+#
+# Overdraft checks work the same way. An account the batch touches once only
+# needs base + delta >= 0, and these are all checked in one pass. Only
+# accounts touched more than once are checked in seq order, because an early
+# withdraw can overdraw before a later deposit. The pure-Python path walks
+# them; with numpy every running balance is base + a prefix sum within the
+# account's ops. The result is the same as applying the ops one at a time.
+#
+# Each node keeps one Ledger of committed balances. A tx is applied once, when
+# it commits (apply with key=txid), instead of rebuilding balances from the
+# whole tx_log on every read.
+#
+# With --exec-workers=N, a batch of at least PARALLEL_MIN ops is split into N
+# conflict-free groups by account (index % N) and the groups are applied on a
+# thread pool. All ops on one account land in the same group, in seq order,
+# and groups share no balance, so the result is the same as applying the
+# batch sequentially. Under CPython the groups still take turns on the GIL
+# (numpy.add.at and the loop both hold it), so the pool does not run faster
+# than one thread; it is kept as the partitioning a GIL-free runtime would
+# use. digest() hashes the balances; checkpoints carry it, so
+# 2f+1 matching checkpoints also show the replicas executed identically.
+import array
+import collections
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VECTOR_MIN = 32             # below this, numpy's per-call overhead costs more than it saves
+LIMIT = 2 ** 62             # amounts beyond int64 headroom are not well formed
+PARALLEL_MIN = 256          # smaller batches are applied on the calling thread
+SIGNS = {"deposit": 1, "withdraw": -1}
+
+workers = 0
+_pool = None
+
+def configure(n):
+    global workers, _pool
+    workers = max(0, int(n))
+    _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exec") if workers > 1 else None
+
+class Batch:
+    __slots__ = ("idx", "delta")
+
+    def __init__(self):
+        self.idx = array.array("q")     # account index per op, in seq order
+        self.delta = array.array("q")   # signed amount per op
+
+    def __len__(self):
+        return len(self.idx)
+
+class Ledger:
+    def __init__(self):
+        self.names = []                 # index -> account
+        self.bal = array.array("q")     # index -> balance
+        self.live = set()               # indices some applied op touched
+        self.applied = set()            # keys (txids) already applied
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def intern(self, name):
+        with self._lock:
+            i = self._index.get(name)
+            if i is None:
+                i = self._index[name] = len(self.names)
+                self.names.append(name)
+            return i
+
+    def compile(self, ops, strict=True):
+        # -> Batch; strict: None if any op is not a well-formed deposit/withdraw,
+        # otherwise such ops (balance queries, ...) are skipped
+        b = Batch()
+        try:
+            # the usual batch: known accounts, lowercase kinds, string amounts
+            index, signs = self._index, SIGNS
+            idx = [index[op["account"]] for op in ops]
+            delta = [signs[op["operation"]] * int(op["amount"], 10) for op in ops]
+            if delta and max(map(abs, delta)) >= LIMIT:
+                raise ValueError
+        except Exception:
+            idx, delta = self._compile_slow(ops, strict)
+            if idx is None:
+                return None
+        b.idx = array.array("q", idx)
+        b.delta = array.array("q", delta)
+        return b
+
+    def _compile_slow(self, ops, strict):
+        idx, delta = [], []
+        for op in ops:
+            kind, acct = str(op.get("operation", "")).lower(), op.get("account")
+            try:
+                v = int(str(op.get("amount")))
+            except Exception:
+                v = None
+            if kind not in SIGNS or not acct or v is None or abs(v) >= LIMIT:
+                if strict:
+                    return None, None
+                continue
+            idx.append(self.intern(acct))
+            delta.append(SIGNS[kind] * v)
+        return idx, delta
+
+    def _grow(self):
+        short = len(self.names) - len(self.bal)
+        if short > 0:
+            self.bal.extend(array.array("q", bytes(8 * short)))
+
+    def apply(self, batch, key=None):
+        # -> False if key was already applied
+        with self._lock:
+            if key is not None and key in self.applied:
+                return False
+            self._grow()
+            if _pool is not None and len(batch) >= PARALLEL_MIN:
+                list(_pool.map(self._apply_group, *self._groups(batch)))
+            else:
+                self._apply_group(batch.idx, batch.delta)
+            self.live.update(batch.idx)
+            if key is not None:
+                self.applied.add(key)   # only once the balances hold it
+        return True
+
+    def _groups(self, batch):
+        # -> ([idx per group], [delta per group]); an account's ops stay in one group, in order
+        if numpy is not None:
+            idx = numpy.frombuffer(batch.idx, dtype=numpy.int64)
+            delta = numpy.frombuffer(batch.delta, dtype=numpy.int64)
+            masks = [idx % workers == k for k in range(workers)]
+            return [idx[m] for m in masks], [delta[m] for m in masks]
+        gi = [array.array("q") for _ in range(workers)]
+        gd = [array.array("q") for _ in range(workers)]
+        for i, d in zip(batch.idx, batch.delta):
+            gi[i % workers].append(i)
+            gd[i % workers].append(d)
+        return gi, gd
+
+    def _apply_group(self, idx, delta):
+        if numpy is not None and len(idx) >= VECTOR_MIN:
+            numpy.add.at(numpy.frombuffer(self.bal, dtype=numpy.int64),
+                         numpy.asarray(idx, dtype=numpy.int64), numpy.asarray(delta, dtype=numpy.int64))
+        else:
+            bal = self.bal
+            for i, d in zip(idx, delta):
+                bal[i] += d
+
+    def allowed(self, batch, extra=None, counted=False):
+        # the batch, applied in order on top of the balances plus extra
+        # ({account: delta}, e.g. tentative txs), never overdraws;
+        # counted: the batch is already part of extra
+        if batch is None:
+            return False
+        with self._lock:
+            self._grow()
+            if numpy is not None and len(batch) >= VECTOR_MIN:
+                return self._allowed_vec(batch, extra or {}, counted)
+            bal, index = self.bal, self._index
+            touched = collections.Counter(batch.idx)
+            base = {i: bal[i] for i in touched}
+            for a, v in (extra or {}).items():
+                if index.get(a) in base:
+                    base[index[a]] += v
+            if counted:
+                return min(base.values(), default=0) >= 0
+            for i, d in zip(batch.idx, batch.delta):
+                if touched[i] == 1:
+                    if base[i] + d < 0:
+                        return False
+                else:
+                    base[i] += d
+                    if base[i] < 0:
+                        return False
+            return True
+
+    def _allowed_vec(self, batch, extra, counted):
+        idx = numpy.frombuffer(batch.idx, dtype=numpy.int64)
+        delta = numpy.frombuffer(batch.delta, dtype=numpy.int64)
+        base = numpy.array(self.bal, dtype=numpy.int64)
+        for a, v in extra.items():
+            if a in self._index:
+                base[self._index[a]] += v
+        if counted:
+            return bool((base[idx] >= 0).all())
+        once = numpy.bincount(idx, minlength=len(base))[idx] == 1
+        if (base[idx[once]] + delta[once] < 0).any():
+            return False
+        # accounts touched more than once: group by account keeping seq order,
+        # then every running balance is base + the prefix sum within its group
+        many, d = idx[~once], delta[~once]
+        if not len(many):
+            return True
+        order = numpy.argsort(many, kind="stable")
+        many, d = many[order], d[order]
+        run = numpy.cumsum(d)
+        starts = numpy.flatnonzero(numpy.r_[True, many[1:] != many[:-1]])
+        run -= numpy.repeat(run[starts] - d[starts], numpy.diff(numpy.r_[starts, len(many)]))
+        return bool((base[many] + run >= 0).all())
+
+    def balances(self):
+        with self._lock:
+            return {self.names[i]: self.bal[i] for i in sorted(self.live)}
+
+    def balances_with(self, keys):
+        # -> (balances, the keys() already applied), read together: keys is called
+        # under the lock, so nothing is applied in between
+        with self._lock:
+            return ({self.names[i]: self.bal[i] for i in sorted(self.live)},
+                    {k for k in keys() if k in self.applied})
+
+    def digest(self):
+        # canonical hash of the balances: equal on replicas that executed the same ops
+        body = json.dumps(sorted(self.balances().items()), separators=(",", ":"))
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]
+
+    def reset(self):
+        # after a state transfer replaced tx_log; interned indices stay
+        with self._lock:
+            self.bal = array.array("q", bytes(8 * len(self.names)))
+            self.live.clear()
+            self.applied.clear()
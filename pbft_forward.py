@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Request forwarding to the leader.
+#
+# A replica that gets a CLIENT_TX for a shard it does not lead passes it on to
+# that shard's leader instead of dropping it. Forwarded requests are batched
+# per leader: the first one arms a FLUSH_AFTER timer, and the batch leaves as
+# one FORWARD {"requests": [CLIENT_TX, ...]} when the timer fires or MAX_BATCH
+# requests are waiting. Each forwarded CLIENT_TX keeps the client's "host" and
+# "from_port", so the leader answers (or sends BUSY to) the client directly.
+# It also carries "forwarded": <replica>, and a forwarded request is never
+# forwarded again; if the leader moved meanwhile, the client's retransmission
+# to every replica covers it. A request the client already sent to every
+# replica ("to_all") is not forwarded, since the leader has its own copy.
+import threading
+
+from pbft_utils import json_send
+
+FLUSH_AFTER = 0.002         # seconds
+MAX_BATCH = 64
+forwarded = 0
+batches = 0
+_queues = {}                # (host, port) -> [CLIENT_TX, ...]
+_lock = threading.Lock()
+
+def needed(msg):
+    return not msg.get("forwarded") and not msg.get("to_all")
+
+def forward(dest, msg, addr, me):
+    # queue msg for the leader at dest; the client is addr[0]:from_port
+    global forwarded
+    fwd = dict(msg, host=msg.get("host") or addr[0], forwarded=me)
+    with _lock:
+        forwarded += 1
+        queue = _queues.setdefault(dest, [])
+        queue.append(fwd)
+        first, full = len(queue) == 1, len(queue) >= MAX_BATCH
+    if full:
+        _flush(dest, me)
+    elif first:
+        threading.Timer(FLUSH_AFTER, _flush, args=(dest, me)).start()
+
+def _flush(dest, me):
+    global batches
+    with _lock:
+        reqs = _queues.pop(dest, [])
+        if reqs:
+            batches += 1
+    if not reqs:
+        return
+    try:
+        json_send(dest[0], dest[1], {"type": "FORWARD", "from": me, "requests": reqs})
+    except Exception:
+        print(f"\n× Cannot forward {len(reqs)} requests to the leader at {dest[0]}:{dest[1]}")
+
+def summary():
+    with _lock:
+        return f"Forwarded to the leader: {forwarded} requests in {batches} batches"
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Cluster launcher: start every node of a config file with one command.
+#
+#   python pbft_launch.py init [--nodes=4] [--hosts=h1,h2] [--base-port=5000]
+#                              [--clients=0] [--byzantine=P3|none] [--out=cluster.json]
+#   python pbft_launch.py start [--config=cluster.json] [--clients] [--logs=DIR] [node flags...]
+#
+# 'start' runs each node with --config, so all of them know the full
+# membership at once and there is no REGISTER round. Nodes whose address is
+# on this machine run as child processes. Other nodes run through
+# `ssh <host> "cd <dir> && python3 ..."`, where dir is the config's "dir"
+# (default: this directory) and the config is expected at the same relative
+# path there. Any flag not listed above (--auto, --linear, ...) goes to every
+# node. Output goes to <logs>/<id>.out.
+#
+# The launcher then reads commands:
+#   <ID> <command>    forward a console command to one node (e.g. "P1 status")
+#   all <command>     forward it to every node
+#   quit              stop the cluster
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pbft_config
+from pbft_utils import split_flags
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OWN_FLAGS = ("config", "clients", "logs", "nodes", "hosts", "base-port", "byzantine", "out")
+
+def is_local(host):
+    # an address this machine can bind to
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((host, 0))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def wait_ready(addrs, timeout=10.0):
+    # -> the (host, port) pairs that still do not accept connections
+    pending = set(addrs)
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for hp in list(pending):
+            try:
+                socket.create_connection(hp, timeout=0.2).close()
+                pending.discard(hp)
+            except OSError:
+                pass
+        if pending:
+            time.sleep(0.05)
+    return pending
+
+class Cluster:
+    def __init__(self, flags, workdir, config=None):
+        self.procs = {}
+        self.workdir = workdir
+        self.flags = list(flags)
+        self.config = config        # path; None: write a local one in start()
+
+    def _argv(self, nid):
+        if nid == "P0":
+            return ["primary_node.py"]
+        if nid in pbft_config.clients:
+            return ["pbft_client.py", f"--id={nid}"]
+        return ["pbft_node.py", nid]
+
+    def _start(self, nid, host):
+        script, *rest = self._argv(nid)
+        log = open(os.path.join(self.workdir, f"{nid}.out"), "w")
+        if is_local(host):
+            argv = [sys.executable, "-u", os.path.join(HERE, script)] + rest + [f"--config={self.config}"] + self.flags
+        else:
+            remote = pbft_config.remote_dir or HERE
+            args = rest + [f"--config={os.path.relpath(self.config, HERE)}"] + self.flags
+            argv = ["ssh", host, f"cd {remote} && python3 -u {script} " + " ".join(args)]
+        self.procs[nid] = subprocess.Popen(argv, cwd=self.workdir, stdin=subprocess.PIPE,
+                                           stdout=log, stderr=subprocess.STDOUT, text=True)
+
+    def start(self, n=4, clients=False):
+        if self.config is None:
+            self.config = os.path.join(self.workdir, "cluster.json")
+            pbft_config.save(pbft_config.make(n), self.config)
+        self.config = os.path.abspath(self.config)
+        pbft_config.load(self.config)
+        for nid, (h, p) in pbft_config.nodes.items():
+            self._start(nid, h)
+        missing = wait_ready(list(pbft_config.nodes.values()))
+        if missing:
+            print(f"! Nodes not reachable yet: {sorted(missing)}")
+        if clients:
+            for cid, (h, p) in pbft_config.clients.items():
+                self._start(cid, h)
+            wait_ready(list(pbft_config.clients.values()))
+
+    def cmd(self, name, line):
+        self.procs[name].stdin.write(line + "\n")
+        self.procs[name].stdin.flush()
+
+    def stop(self):
+        for name in self.procs:
+            try:
+                self.cmd(name, "quit")
+            except Exception:
+                pass
+        time.sleep(0.5)
+        for p in self.procs.values():
+            p.kill()
+
+def init(flags):
+    hosts = [h for h in str(flags.get("hosts", "127.0.0.1")).split(",") if h]
+    byz = flags.get("byzantine", "P3")
+    cfg = pbft_config.make(int(flags.get("nodes", 4)), hosts, int(flags.get("base-port", 5000)),
+                           None if byz in (True, "none") else byz, int(flags.get("clients", 0)))
+    out = flags.get("out") if isinstance(flags.get("out"), str) else "cluster.json"
+    pbft_config.save(cfg, out)
+    print(f"✓ Wrote {out}: {len(cfg['nodes'])} nodes, {len(cfg['clients'])} clients, Byzantine={cfg.get('byzantine')}")
+
+def start(argv, flags):
+    config = flags.get("config") if isinstance(flags.get("config"), str) else "cluster.json"
+    logs = flags.get("logs") if isinstance(flags.get("logs"), str) else "logs"
+    os.makedirs(logs, exist_ok=True)
+    node_flags = [a for a in argv if a.startswith("--") and a[2:].partition("=")[0] not in OWN_FLAGS]
+    cluster = Cluster(node_flags, logs, config)
+    t0 = time.time()
+    cluster.start(clients=bool(flags.get("clients")))
+    print(f"✓ Started {len(cluster.procs)} processes from {config} in {time.time() - t0:.2f}s; output in {logs}/")
+    print("Commands: <ID> <command> | all <command> | quit")
+    try:
+        while True:
+            try:
+                line = input("launch> ").strip()
+            except EOFError:
+                line = "quit"
+            if not line:
+                continue
+            if line == "quit":
+                break
+            target, _, rest = line.partition(" ")
+            names = list(cluster.procs) if target == "all" else [target]
+            for name in names:
+                if name not in cluster.procs:
+                    print(f"× Unknown process {name}")
+                elif cluster.procs[name].poll() is not None:
+                    print(f"× {name} has exited")
+                else:
+                    cluster.cmd(name, rest)
+    finally:
+        cluster.stop()
+        print("Bye!")
+
+def main(argv):
+    args, flags = split_flags(argv)
+    if args[:1] == ["init"]:
+        init(flags)
+    elif args[:1] == ["start"]:
+        start(argv[1:], flags)
+    else:
+        print("Usage: python pbft_launch.py init [--nodes=4] [--hosts=h1,h2] [--base-port=5000] [--clients=0] "
+              "[--byzantine=P3|none] [--out=cluster.json]")
+        print("       python pbft_launch.py start [--config=cluster.json] [--clients] [--logs=DIR] [node flags...]")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
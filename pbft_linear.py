@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Linear vote collection (--linear) and per-instance message counters.
+#
+# By default every replica sends PREPARE and COMMIT_VOTE to every other
+# member, which costs O(N^2) messages per instance. With --linear a replica
+# sends its votes only to the collector, which is the leader of the tx's
+# shard. Once the collector's votes decide a phase (a quorum, or every vote
+# in so that replicas can abort), it broadcasts them once as a PREPARE_CERT
+# or COMMIT_CERT. Replicas merge the certificate into their vote tables and
+# carry on as if the votes had arrived directly, so an instance costs O(N)
+# messages.
+#
+# sent[txid] counts the consensus messages (PRE_PREPARE, votes, certificates,
+# payloads) this node sent for that instance and sent_bytes[txid] their size.
+# REPLY carries the counts so far as "msgs" and "bytes".
+import threading
+
+from pbft_utils import json_send
+
+enabled = False
+sent = {}                   # txid -> consensus messages sent by this node
+sent_bytes = {}             # txid -> bytes of those messages
+_certified = set()          # (txid, phase) certificates already broadcast
+_lock = threading.Lock()
+
+def send(host, port, msg):
+    count(msg.get("txid"), json_send(host, port, msg))
+
+def count(txid, n):
+    # one message of n bytes sent for txid, over whatever transport
+    with _lock:
+        sent[txid] = sent.get(txid, 0) + 1
+        sent_bytes[txid] = sent_bytes.get(txid, 0) + n
+
+def first_cert(txid, phase):
+    # True only for the first caller, so each certificate goes out once
+    with _lock:
+        if (txid, phase) in _certified:
+            return False
+        _certified.add((txid, phase))
+        return True
+
+def summary():
+    mode = "linear" if enabled else "all-to-all"
+    if not sent:
+        return f"Consensus msgs ({mode}): none sent yet"
+    avg = sum(sent.values()) / len(sent)
+    kb = sum(sent_bytes.values()) / len(sent) / 1024
+    return (f"Consensus msgs ({mode}): {avg:.1f} sent per instance by this node "
+            f"({kb:.1f} KiB) over {len(sent)} instances")
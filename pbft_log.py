@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Consensus instances identified by (view, seq) and a seq-ordered tx log.
+#
+# The leader names an instance after the view it was proposed in and the
+# sequence number it got from pbft_shard, as "<view>.<seq>", or
+# "<view>.<shard>.<seq>" with --shards. The id is what clients see. Seqs
+# never repeat within a shard, so ids cannot collide. The view part keeps a
+# seq that a new leader reassigns apart from one a failed leader used.
+#
+# TxLog is the node's tx_log: a dict for O(1) lookup by txid, plus a list of
+# (seq, shard, view, txid) kept sorted with bisect. PRE_PREPAREs that arrive
+# out of order are still iterated in seq order, and latest() replaces
+# "the last key inserted". Ids in any other format sort after every seq'd
+# instance, in arrival order.
+import bisect
+import itertools
+import threading
+from collections.abc import MutableMapping
+
+_UNSEQUENCED = float("inf")
+_arrival = itertools.count()
+
+def make_txid(view, shard, seq, shards=1):
+    return f"{view}.{seq}" if shards == 1 else f"{view}.{shard}.{seq}"
+
+def parse_txid(txid):
+    # -> (view, shard, seq), or None for ids not made by make_txid
+    parts = str(txid).split(".")
+    if len(parts) not in (2, 3) or not all(p.isdigit() for p in parts):
+        return None
+    nums = [int(p) for p in parts]
+    return (nums[0], 0, nums[1]) if len(nums) == 2 else tuple(nums)
+
+class TxLog(MutableMapping):
+    def __init__(self):
+        self._items = {}        # txid -> info
+        self._keys = {}         # txid -> sort key
+        self._order = []        # sorted sort keys; the last element is the txid
+        self._lock = threading.Lock()
+
+    def _sort_key(self, txid):
+        parsed = parse_txid(txid)
+        if parsed is None:
+            return (_UNSEQUENCED, 0, next(_arrival), txid)
+        view, shard, seq = parsed
+        return (seq, shard, view, txid)
+
+    def __getitem__(self, txid):
+        return self._items[txid]
+
+    def __setitem__(self, txid, info):
+        with self._lock:
+            if txid not in self._items:
+                key = self._sort_key(txid)
+                self._keys[txid] = key
+                if not self._order or self._order[-1] < key:
+                    self._order.append(key)            # the usual case: the next seq
+                else:
+                    bisect.insort(self._order, key)
+            self._items[txid] = info
+
+    def __delitem__(self, txid):
+        with self._lock:
+            del self._items[txid]
+            key = self._keys.pop(txid)
+            del self._order[bisect.bisect_left(self._order, key)]
+
+    def __iter__(self):
+        with self._lock:
+            return iter([key[-1] for key in self._order])
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear(); self._keys.clear(); self._order.clear()
+
+    def latest(self, shard=None):
+        # the instance with the highest seq (what "the current tx" means), in one shard if given
+        for key in reversed(self._order):
+            if key[0] != _UNSEQUENCED and (shard is None or key[1] == shard):
+                return key[-1]
+        if shard is not None:
+            return None
+        return self._order[-1][-1] if self._order else None
+
+    def at(self, shard, seq):
+        # all views' instances for (shard, seq), oldest view first
+        i = bisect.bisect_left(self._order, (seq, shard))
+        out = []
+        while i < len(self._order) and self._order[i][:2] == (seq, shard):
+            out.append(self._order[i][-1])
+            i += 1
+        return out
+
+    def to_dict(self):
+        return {txid: self._items[txid] for txid in self}
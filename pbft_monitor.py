@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Leader monitoring and forced rotation (--monitor[=SECONDS], --rotate=SECONDS).
+#
+# A slow leader stalls everyone without breaking any protocol rule, so every
+# replica watches the leader of the current view (Aardvark-style):
+#   - Requests. A client that sends its CLIENT_TX to every replica lets them
+#     see what the leader should order. A replica keeps each valid request it
+#     saw until a PRE_PREPARE carries it. If one waits longer than `timeout`
+#     (--monitor=SECONDS, default 2), the leader is too slow.
+#   - Throughput. A replica counts the ops ordered in the last WINDOW seconds.
+#     The baseline is the best such rate seen in each of the last HISTORY
+#     views. With a backlog (a seen request waiting over WINDOW) and a rate
+#     below RATIO x baseline, the leader is too slow. Without a backlog a low
+#     rate only means little load.
+# Either way the replica sends VIEW_CHANGE {"view", "reason"} to every member,
+# once per view. The next leader takes over at 2f+1, as with 'view change',
+# and then orders the seen requests its predecessor never ordered.
+# Nothing is judged in the first GRACE seconds of a view, and a seen request's
+# wait restarts when the view changes.
+#
+# With --rotate=SECONDS every node, the leader included, asks for the next
+# leader once a view is that old, so no leader keeps the job for long. Given
+# alone, --rotate only rotates and does not judge the leader.
+import collections
+import threading
+import time
+
+from pbft_request import key_of
+
+enabled = False
+timeout = 2.0
+rotate = 0.0                # seconds per view; 0: no forced rotation
+PERIOD = 0.25               # how often the leader is judged
+WINDOW = 1.0
+GRACE = 1.0
+RATIO = 0.5
+HISTORY = 5
+demands = 0
+history = collections.deque(maxlen=8)       # (time, view, reason)
+_baseline = collections.deque(maxlen=HISTORY)   # best ops/s of each past view
+_recent = collections.deque()               # (time, ops) ordered in this view
+_pending = {}                               # request key -> [first seen, msg, addr]
+_done = collections.OrderedDict()           # request key -> time ordered (its CLIENT_TX may come later)
+_view = 0
+_view_start = time.time()
+_leading = False
+_peak = 0.0
+_demanded = None                            # view we already asked to leave
+_demand = None
+_lock = threading.Lock()
+
+def configure(seconds, rotate_s, leading, demand):
+    # demand(reason): broadcast VIEW_CHANGE for the current view
+    global enabled, timeout, rotate, _leading, _demand
+    enabled = True
+    if not seconds:
+        timeout = 0.0           # --rotate alone: rotation only, the leader is not judged
+    elif seconds is not True:
+        timeout = max(0.1, float(seconds))
+    rotate = max(0.0, float(rotate_s or 0))
+    _leading = leading
+    _demand = demand
+    threading.Thread(target=_loop, name="monitor", daemon=True).start()
+
+def seen(op, msg, addr):
+    # a replica got a client request directly; the leader should order it soon
+    if not enabled:
+        return
+    key = key_of(op)
+    with _lock:
+        if key not in _done:
+            _pending.setdefault(key, [time.time(), msg, addr])
+
+def ordered(ops):
+    # a PRE_PREPARE carrying ops arrived
+    if not enabled:
+        return
+    now = time.time()
+    with _lock:
+        _recent.append((now, len(ops)))
+        for op in ops:
+            key = key_of(op)
+            _pending.pop(key, None)
+            _done[key] = now
+        while _done and now - next(iter(_done.values())) > max(timeout, WINDOW) * 2:
+            _done.popitem(last=False)
+
+def new_view(view, leading):
+    # -> the seen requests to order now, if we are the new leader
+    global _view, _view_start, _leading, _peak
+    now = time.time()
+    with _lock:
+        if _peak > 0:
+            _baseline.append(_peak)
+        _view, _view_start, _leading, _peak = view, now, leading, 0.0
+        _recent.clear()
+        if leading:
+            taken = [(m, a) for _, m, a in _pending.values()]
+            _pending.clear()
+            return taken
+        for entry in _pending.values():
+            entry[0] = now
+    return []
+
+def _rate(now):
+    while _recent and now - _recent[0][0] > WINDOW:
+        _recent.popleft()
+    return sum(n for _, n in _recent) / WINDOW
+
+def judge(now):
+    # -> a reason to leave the current view, or None
+    global _peak, _demanded, demands
+    with _lock:
+        age = now - _view_start
+        rate = _rate(now)
+        if age >= WINDOW and not _leading:
+            _peak = max(_peak, rate)
+        if _demanded == _view or age < GRACE:
+            return None
+        waited = now - min((e[0] for e in _pending.values()), default=now)
+        base = max(_baseline, default=0.0)
+        reason = None
+        if rotate and age >= rotate:
+            reason = f"rotation: view {_view} is {age:.1f}s old"
+        elif _leading or not timeout:
+            return None
+        elif waited > timeout:
+            reason = f"a request waited {waited:.1f}s for the leader to order it"
+        elif waited > WINDOW and base and rate < RATIO * base:
+            reason = f"leader orders {rate:.1f} ops/s with a backlog, baseline {base:.1f} ops/s"
+        if reason:
+            _demanded = _view
+            demands += 1
+            history.append((now, _view, reason))
+        return reason
+
+def _loop():
+    while True:
+        time.sleep(PERIOD)
+        reason = judge(time.time())
+        if reason and _demand:
+            _demand(reason)
+
+def summary_lines():
+    with _lock:
+        now = time.time()
+        lines = [f"Leader monitor: view {_view} for {now - _view_start:.1f}s, {_rate(now):.1f} ops/s ordered, "
+                 f"baseline {max(_baseline, default=0.0):.1f} ops/s, {len(_pending)} seen requests waiting, "
+                 f"timeout {f'{timeout:g}s' if timeout else 'off'}" + (f", rotate every {rotate:g}s" if rotate else "")]
+        for ts, v, reason in history:
+            lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(ts))}  left view {v}: {reason}")
+    return lines
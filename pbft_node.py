@@ -1,13 +1,59 @@
 # -*- coding: utf-8 -*-
 import os, sys, threading, time, json, glob
-from pbft_utils import json_server, json_send, short_uuid
+from pbft_utils import json_server, json_send, split_flags, bad_flag
+from pbft_request import parse_kv, ops_of
+import pbft_trace
+import pbft_profile
+import pbft_shard
+import pbft_spec
+import pbft_linear
+import pbft_dissem
+import pbft_batch
+import pbft_dedup
+import pbft_log
+import pbft_votes
+import pbft_config
+import pbft_reconfig
+import pbft_checkpoint
+import pbft_exec
+import pbft_admit
+import pbft_monitor
+import pbft_workload
+import pbft_forward
+import pbft_udp
+import pbft_sync
+from pbft_workers import json_server_mp
 
 HOST = "127.0.0.1"
 DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT = "127.0.0.1", 5000
 
 id_ = None
 port = None
+workers = 0  # >0: decode in worker processes (pbft_workers)
+udp_mode = None  # --udp[=multicast|GROUP:PORT]: votes as datagrams (pbft_udp)
+udp_loss = 0.0
+tentative_mode = False
+auto_mode = False     # vote/progress automatically (honest replica behaviour)
+misbehave = False     # Byzantine node only: lie in auto/speculative mode
+slow_leader = 0.0     # Byzantine node only: hold every PRE_PREPARE back this long while leading
+auto_lock = threading.RLock()   # reentrant: finalize can release a held speculative reconfig, which progresses it
+order_lock = threading.Lock()
+NUMERIC_FLAGS = {           # flag -> (type, lowest, highest, bare --flag allowed); checked at startup
+    "profile": (int, 1, None, True),
+    "shards": (int, 1, None, False),
+    "udp-loss": (float, 0, 1, False),
+    "monitor": (float, 0.1, None, True),
+    "rotate": (float, 0, None, False),
+    "admit": (int, 1, None, True),
+    "client-rate": (float, 0.1, None, False),
+    "exec-workers": (int, 0, None, True),
+    "checkpoint": (int, 1, None, True),
+    "slo": (float, 1, None, True),
+    "tree": (int, 1, None, True),
+    "workers": (int, 0, None, False),
+}
 crashed = False
+join_via = None   # --join: (host, port) to send JOIN_REQUEST to instead of REGISTER
 self_prepare_vote = {}  # txid -> "VOTE_YES" | "VOTE_NO"
 self_commit_vote  = {}
 members = {"P0": (DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT)}
@@ -18,20 +64,24 @@ view = 0
 byzantine_id = None  # will be set via MEMBERS/NEW_VIEW; this node is Byzantine iff id_ == byzantine_id
 
 state_data = {}
-tx_log = {}
-current_tx = None
+tx_log = pbft_log.TxLog()   # txid "<view>.<seq>" -> info, iterated in seq order
+ledger = pbft_exec.Ledger()  # committed balances; each tx applied once, on commit
+current_tx = {}             # shard -> instance 'progress' drives
 
-prepare_votes = {}
+prepare_votes = {}  # (txid, view) -> pbft_votes.Tally
 commit_votes = {}
 
-pending_prepare_tx = None
+pending_prepare_tx = {}     # shard -> instance awaiting this node's manual PREPARE
 clients = set()
 
 vc_votes = {}
 vc_done_for_view = set()
+shard_vc_votes = {}         # (shard, rotation) -> ids asking to replace that shard's leader
+shard_vc_done = set()
 
 checkpoint_reports = {}
 checkpoint_expected = {}
+checkpoint_done = set()
 last_final_checkpoint_path = None
 
 def ensure_dir(path):
@@ -57,12 +107,22 @@ def next_primary_id():
     return next_primary_id_from(current_primary)
 
 def banner():
-    print(f"✓ Node '{id_}' started at localhost:{port}")
-    try:
-        json_send(DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT, {"type":"REGISTER","id":id_,"host":HOST,"port":port})
-        print(f"✓ Registered to P0 {DEFAULT_PRIMARY_HOST}:{DEFAULT_PRIMARY_PORT}")
-    except Exception:
-        print("× Cannot register to P0; please make sure P0 is running")
+    print(f"✓ Node '{id_}' started at {HOST}:{port}")
+    if join_via:
+        try:
+            json_send(join_via[0], join_via[1], {"type":"JOIN_REQUEST","id":id_,"host":HOST,"port":port,
+                                                 "key":pbft_config.keys.get(id_)})
+            print(f"✓ JOIN_REQUEST sent to {join_via[0]}:{join_via[1]}; waiting for the membership change to commit")
+        except Exception:
+            print(f"× Cannot reach {join_via[0]}:{join_via[1]} to join")
+    elif pbft_config.loaded():
+        print(f"✓ Membership from {pbft_config.path}: {', '.join(ids_sorted())} (Byzantine={byzantine_id})")
+    else:
+        try:
+            json_send(DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT, {"type":"REGISTER","id":id_,"host":HOST,"port":port})
+            print(f"✓ Registered to P0 {DEFAULT_PRIMARY_HOST}:{DEFAULT_PRIMARY_PORT}")
+        except Exception:
+            print("× Cannot register to P0; please make sure P0 is running")
     print("="*60)
     print("\nCommands:")
     print("  status                         - show node/view/leader/members/tx")
@@ -75,18 +135,120 @@ def banner():
     print("  ack to <PID> commit|abort      - (Byzantine only) send COMMIT_VOTE to a single peer")
     print("  crash / recover")
     print("  view change                    - request view change")
-    print("  checkpoint                     - if I am leader, coordinate distributed checkpoint")
+    print("  checkpoint [<shard>]           - if I am (shard) leader, coordinate distributed checkpoint")
+    print("  reconfig add <ID> <HOST> <PORT> | reconfig remove <ID> - (leader) ordered membership change")
+    print("  profile dump                   - write collapsed stacks + per-message CPU (--profile)")
+    print("  misbehave on|off               - (Byzantine only) vote no / lie about speculative history")
+    print("  misbehave slow <MS>            - (Byzantine only) delay every PRE_PREPARE by MS while leading")
     print("  quit")
     print(f"\n{id_}> ", end="", flush=True)
 
 def announce_primary_capabilities():
     print(f"\n✓ current view={view}, primary={current_primary}, Byzantine={byzantine_id}")
+    seen = pbft_monitor.new_view(view, current_primary == id_) if pbft_monitor.enabled else []
     if current_primary == id_:
         print("→ I am the leader now: commands available: tx / progress / checkpoint")
         reexec_unfinished()
+        if seen:
+            print(f"→ Ordering {len(seen)} requests the previous leader never ordered")
+            threading.Thread(target=order_seen, args=(seen,), daemon=True).start()
+
+def leader_for(data):
+    # the leader of the request's shard (the view's primary with one shard)
+    return pbft_shard.shard_leader(ids_sorted(), current_primary, pbft_shard.shard_of(data.get("account")))
+
+def order_seen(seen):
+    # --monitor: requests clients sent to every replica, never PRE_PREPAREd in the old view
+    for msg, addr in seen:
+        on_msg(msg, addr)
+
+def watch_request(msg, addr):
+    # --monitor: a request the leader should order soon; one it would refuse is not watched
+    data = parse_kv(msg.get("data") or "")
+    if check_op(data) or not pbft_dedup.is_new(data):
+        return
+    if str(data["operation"]).lower() != "balance" and not ledger.allowed(ledger.compile([data]), tentative_deltas()):
+        return
+    pbft_monitor.seen(data, msg, addr)
+
+def demand_view_change(reason):
+    # --monitor/--rotate: the leader is too slow, or its time is up
+    print(f"\n! {reason}; broadcast VIEW_CHANGE (view={view}, next leader={next_primary_id()})")
+    msg = {"type":"VIEW_CHANGE","from":id_,"view":view,"reason":reason}
+    for pid,(h,p) in list(members.items()):
+        if pid == id_:
+            continue
+        try:
+            json_send(h,p,msg)
+        except Exception:
+            pass
+    print(f"\n{id_}> ", end="", flush=True)
+
+def shard_hint(txid):
+    # the shard argument the console commands need when several shards run
+    return f" {pbft_shard.shard_of_tx(tx_log.get(txid), txid)}" if pbft_shard.num_shards > 1 else ""
+
+def undecided_shards():
+    return {pbft_shard.shard_of_tx(info, tid) for tid, info in tx_log.items()
+            if info.get("status") not in ("COMMITTED", "ABORTED")}
+
+def latest_in_shard(arg):
+    # the console's 'ack': the newest instance of the shard given (or the only busy one)
+    # -> (txid, None) or (None, error)
+    if pbft_shard.num_shards == 1 and arg is None:
+        return (tx_log.latest() if tx_log else None), None
+    shard, err = pbft_shard.pick(arg, undecided_shards())
+    return (None, err) if err else (tx_log.latest(shard), None)
+
+def request_shard_view_change(shard, reason=None):
+    # replace only this shard's leader; the other shards keep ordering
+    ids = ids_sorted()
+    msg = {"type":"VIEW_CHANGE","from":id_,"shard":shard,"rotation":pbft_shard.rotations.get(shard, 0)}
+    if reason:
+        msg["reason"] = reason
+    print(f"→ Broadcast VIEW_CHANGE for shard {shard} (leader {pbft_shard.shard_leader(ids, current_primary, shard)}, "
+          f"next {pbft_shard.next_shard_leader(ids, current_primary, shard)})")
+    for pid,(h,p) in list(members.items()):
+        if pid != id_:
+            json_send(h,p,msg)
+    on_shard_view_change(msg)
 
-def reexec_unfinished():
-    pending = [tid for tid,info in tx_log.items() if info.get("status") in ("STARTED", "PREPARED")]
+def on_shard_view_change(msg):
+    # the shard's next leader collects 2f+1 requests, then announces NEW_VIEW for that shard
+    shard, rotation = msg.get("shard"), msg.get("rotation", 0)
+    if rotation != pbft_shard.rotations.get(shard, 0):
+        print(f"\n→ Stale VIEW_CHANGE for shard {shard} from {msg.get('from')}; ignored")
+        return
+    target = pbft_shard.next_shard_leader(ids_sorted(), current_primary, shard)
+    if msg.get("from") != id_:
+        why = f": {msg['reason']}" if msg.get("reason") else ""
+        print(f"\n→ VIEW_CHANGE for shard {shard} from {msg.get('from')} (next leader {target}){why}")
+    if target != id_ or (shard, rotation) in shard_vc_done:
+        return
+    votes = shard_vc_votes.setdefault((shard, rotation), set())
+    votes.update((msg.get("from"), id_))
+    f, _ = compute_f_and_quorum()
+    if len(votes) >= 2*f+1:
+        shard_vc_done.add((shard, rotation))
+        nv = {"type":"NEW_VIEW","shard":shard,"rotation":rotation + 1,"from":id_}
+        for pid,(h,p) in list(members.items()):
+            if pid != id_:
+                json_send(h,p,nv)
+        print(f"✓ Reached {2*f+1} votes; I ({id_}) take over shard {shard}")
+        install_shard_view(shard, rotation + 1, id_)
+
+def install_shard_view(shard, rotation, leader):
+    if not pbft_shard.rotate(shard, rotation):
+        return
+    now = pbft_shard.shard_leader(ids_sorted(), current_primary, shard)
+    print(f"\n✓ Shard {shard} changed leader: {now} (announced by {leader}); other shards unchanged")
+    rollback_tentative(shard)
+    if now == id_:
+        reexec_unfinished(shard)
+
+def reexec_unfinished(shard=None):
+    pending = [tid for tid,info in tx_log.items() if info.get("status") in ("STARTED", "PREPARED")
+               and (shard is None or pbft_shard.shard_of_tx(info, tid) == shard)]
     if not pending:
         return
     tid = pending[-1]
@@ -94,71 +256,233 @@ def reexec_unfinished():
     if not info.get("data") or info.get("rebroadcasted"):
         return
     print(f"→ Found unfinished tx {tid} (status={info.get('status')}), rebroadcasting PRE-PREPARE as the new leader")
-    for pid,(h,p) in members.items():
-        if pid == id_: 
-            continue
-        json_send(h,p,{"type":"PRE_PREPARE","txid":tid,"data":info["data"],"from":current_primary,
-                       "primary_host":primary_host,"primary_port":primary_port})
+    send_pre_prepare({"type":"PRE_PREPARE","txid":tid,"data":info["data"],"from":id_,
+                      "primary_host":primary_host,"primary_port":primary_port,
+                      "trace_id":info.get("trace_id"),"shard":info.get("shard",0),"seq":info.get("seq")})
     info["rebroadcasted"] = True
     print("✓ PRE-PREPARE rebroadcasted")
 
-def parse_kv(s):
-    out = {}
-    for pair in s.split(","):
-        if not pair.strip(): continue
-        if "=" in pair:
-            k,v = pair.split("=",1)
-            out[k.strip()] = v.strip()
-    return out
+def send_pre_prepare(msg, verbose=False):
+    if pbft_udp.enabled:
+        pbft_udp.watch(msg.get("txid"))     # the leader collects votes too
+    # --tree: payload down the fan-out tree, digest-only PRE_PREPARE to everyone
+    ids = ids_sorted()
+    if pbft_dissem.enabled:
+        payload = pbft_dissem.payload(msg, id_, root=id_)
+        for pid in pbft_dissem.children(ids, id_, id_):
+            h, p = members[pid]
+            pbft_linear.send(h, p, payload)
+        msg = pbft_dissem.digest_only(msg)
+    for pid in ids:
+        if pid == id_ or pid not in members:
+            continue
+        if verbose:
+            print(f"← send PRE-PREPARE to {pid}... ")
+        h, p = members[pid]
+        pbft_linear.send(h, p, msg)
+
+def fetch_payload(msg):
+    # --tree: the payload never came down the tree; ask the leader directly
+    if pbft_dissem.waiting(msg["txid"]):
+        print(f"\n! Payload for tx {msg['txid']} not received; requesting it from {msg.get('from')}")
+        json_send(msg.get("primary_host", primary_host), msg.get("primary_port", primary_port),
+                  {"type":"PAYLOAD_REQUEST","txid":msg["txid"],"from":id_,"host":HOST,"port":port})
+
+def check_op(data):
+    op = str(data.get("operation", "")).lower()
+    if op not in ("deposit", "withdraw", "balance"):
+        return "× Invalid operation. Only 'deposit', 'withdraw' or 'balance' are allowed."
+    if not data.get("account"):
+        return "× Missing 'account'."
+    try:
+        if op != "balance":
+            int(str(data.get("amount")))
+    except Exception:
+        return "× 'amount' must be an integer."
+    return None
 
 def start_tx(data_str):
-    global current_tx
     if len(members) <= 1:
         print("× No participants yet; cannot start a transaction"); return
     data = parse_kv(data_str)
-    op = str(data.get("operation", "")).lower()
-    acct = data.get("account", None)
-    amt = data.get("amount", None)
-    if op not in ("deposit", "withdraw"):
-        print("× Invalid operation. Only 'deposit' or 'withdraw' are allowed.")
+    err = check_op(data)
+    if err:
+        print(err)
         return
-    if not acct:
-        print("× Missing 'account'.")
+    acct = data["account"]
+    shard = pbft_shard.shard_of(acct)
+    leader = pbft_shard.shard_leader(ids_sorted(), current_primary, shard)
+    if leader != id_:
+        print(f"× Account '{acct}' belongs to shard {shard}, led by {leader}; start the tx there.")
         return
-    try:
-        int(str(amt))
-    except Exception:
-        print("× 'amount' must be an integer.")
+    if not pbft_dedup.begin(data):
+        print(f"× Duplicate request {data.get('client_id')}#{data.get('ts')}: already executed or in flight")
+        return
+    return propose(data, shard)
+
+def start_batch(data_strs):
+    # --slo: the batcher cut these requests; one instance per shard
+    if len(members) <= 1:
+        print("× No participants yet; dropping batch")
+        for s in data_strs:
+            reject(parse_kv(s), "no participants")
+        return []
+    groups, txids = {}, []
+    for s in data_strs:
+        data = parse_kv(s)
+        err = check_op(data)
+        if err:
+            print(f"{err} (dropped from batch: {s})")
+            pbft_admit.drop(data)
+            reject(data, err.lstrip("× "))
+            continue
+        shard = pbft_shard.shard_of(data["account"])
+        if pbft_shard.shard_leader(ids_sorted(), current_primary, shard) != id_:
+            print(f"× Not the leader of shard {shard}; dropped from batch: {s}")
+            pbft_admit.drop(data)
+            reject(data, f"not the leader of shard {shard}")
+            continue
+        if str(data["operation"]).lower() == "balance":
+            if begin_or_drop(data):
+                txids.append(propose(data, shard))
+        else:
+            groups.setdefault(shard, []).append(data)
+    run = balances_from_committed(include_tentative=True)
+    for shard, ops in groups.items():
+        ok = []
+        for op in ops:
+            if not begin_or_drop(op):
+                continue
+            # the ops kept so far never overdraw, so only this op's account needs checking
+            acct, val = _op_to_signed_amount(op)
+            if acct is not None and val is not None and run.get(acct, 0) + val >= 0:
+                run[acct] = run.get(acct, 0) + val
+                ok.append(op)
+            else:
+                print(f"× Would overdraw; dropped from batch: {op}")
+                pbft_dedup.release(op)
+                pbft_admit.drop(op)
+                reject(op, "would overdraw")
+        if len(ok) == 1:
+            txids.append(propose(ok[0], shard))
+        elif ok:
+            txids.append(propose({"operation":"batch","ops":ok}, shard))
+    return txids
+
+def begin_or_drop(op):
+    # reserve the client stamp right before the op goes into an instance
+    if pbft_dedup.begin(op):
+        return True
+    print(f"× Duplicate request {op.get('client_id')}#{op.get('ts')}; dropped from batch")
+    pbft_admit.drop(op)
+    return False
+
+def reject(op, reason):
+    # a request dropped before it was ordered still gets an answer: ABORTED, with no txid
+    msg = {"type":"REPLY","txid":None,"result":"ABORTED","reason":reason,"data":op,"from":id_,
+           "view":view,"leader":current_primary}
+    for (h,p) in list(clients):
+        json_send(h,p,msg)
+
+def start_batch_ordered(data_strs):
+    with order_lock:
+        return start_batch(data_strs)
+
+def propose_reconfig(data):
+    err = pbft_reconfig.check(data, members, current_primary)
+    if err:
+        print(err)
         return
-    txid = short_uuid()
-    current_tx = txid
-    tx_log[txid] = {"status":"STARTED","data":parse_kv(data_str),"commit_started":False}
+    with order_lock:
+        return propose(data, 0)
+
+def propose(data, shard):
+    if slow_leader and byzantine_id == id_:
+        time.sleep(slow_leader)
+        if pbft_shard.shard_leader(ids_sorted(), current_primary, shard) != id_:
+            print(f"× No longer the leader of shard {shard}; dropped: {data}")
+            for op in ops_of(data):
+                pbft_dedup.release(op)
+                reject(op, f"no longer the leader of shard {shard}")
+            return None
+    seq = pbft_shard.next_seq(shard)
+    txid = pbft_log.make_txid(view, shard, seq, pbft_shard.num_shards)
+    current_tx[shard] = txid
+    trace_id = pbft_trace.new_trace_id()
+    tx_log[txid] = {"status":"STARTED","data":data,"commit_started":False,"trace_id":trace_id,
+                    "shard":shard,"seq":seq}
+    spec_history = pbft_spec.order(shard, seq, txid, tx_log[txid]["data"]) if pbft_spec.enabled else None
     print("="*60)
     print(f"New tx: {txid}")
+    if pbft_shard.num_shards > 1:
+        print(f"Shard: {shard}  seq: {seq}")
     print(f"Data: {tx_log[txid]['data']}")
     print(f"Total members: {len(members)}")
     print("="*60)
     print("\n[Phase 1/4] Pre-prepare")
     print("-"*60)
-    for pid,(h,p) in members.items():
-        if pid == id_:
-            continue
-        print(f"← send PRE-PREPARE to {pid}... ")
-        json_send(h,p,{"type":"PRE_PREPARE","txid":txid,"data":tx_log[txid]["data"],"from":current_primary,
-                       "primary_host":primary_host,"primary_port":primary_port})
+    t0 = time.time()
+    send_pre_prepare({"type":"PRE_PREPARE","txid":txid,"data":tx_log[txid]["data"],"from":id_,
+                      "primary_host":primary_host,"primary_port":primary_port,"trace_id":trace_id,
+                      "shard":shard,"seq":seq,"spec_history":spec_history}, verbose=True)
+    pbft_trace.span(trace_id, txid, "start", start=t0, members=len(members))
+    if spec_history:
+        spec_execute(txid, spec_history)
+        print("\n[Speculative] Executed; replicas reply to the client directly (fallback on mismatch)")
+        return txid
     print("\n[Phase 2/4] Prepare (manual)")
     print("-"*60)
     print("Hint: on each replica console, run 'prepare yes' or 'prepare no'. Byzantine can target specific nodes.")
+    return txid
+
+def voters_of(txid):
+    # who votes on txid: the membership in force at its seq (pbft_reconfig)
+    parsed = pbft_log.parse_txid(txid)
+    return pbft_reconfig.at(parsed[2] if parsed else None) or members
+
+def leader_of(txid):
+    # the leader of txid's shard: it proposes and does not vote
+    return pbft_shard.shard_leader(ids_sorted(), current_primary, pbft_shard.shard_of_tx(tx_log.get(txid), txid))
+
+def vote_quorum(txid, phase):
+    # for pbft_votes: (threshold, implicit yes, own vote still to come, remote voters)
+    group = voters_of(txid)
+    mine = (self_prepare_vote if phase == "prepare" else self_commit_vote).get(txid, "")
+    is_leader = (leader_of(txid) == id_)
+    self_yes = 1 if is_leader else (1 if mine.upper() == pbft_votes.LABELS[phase][0] else 0)
+    f = max(0, (len(group) - 1)//3)
+    if id_ not in group:
+        return 2 * f + 1, 1, 0, len(group) - 1    # joined after this instance: observe only
+    return 2 * f + 1, self_yes + 1, 0 if is_leader or mine else 1, len(group) - (1 if is_leader else 2)
+
+def tally(txid, phase, v=None):
+    store = prepare_votes if phase == "prepare" else commit_votes
+    key = (txid, view if v is None else v)
+    t = store.get(key)
+    if t is None:
+        t = store.setdefault(key, pbft_votes.Tally(txid, key[1], phase, vote_quorum, on_decide))
+    return t
+
+def count_vote(txid, phase, pid, vote, v=None):
+    if pid not in voters_of(txid):
+        print(f"\n× {phase.capitalize()} vote from {pid} on tx {txid} ignored: not a voting member at its seq")
+        return
+    kind = tally(txid, phase, v).add(pid, vote)
+    if kind != "new":
+        print(f"\n! Byzantine evidence: {kind} {phase} vote from {pid} on tx {txid} ({vote})")
+
+def on_decide(t, outcome):
+    # pbft_votes callback: this view's votes just reached 2f+1, or no longer can
+    if t.view != view:
+        return
+    what = "quorum reached" if outcome == "quorum" else "quorum out of reach"
+    print(f"→ {t.phase.capitalize()} {what} (tx {t.txid}: {t.n_yes} yes, {t.n_no} no received)")
+    auto_progress(t.txid)
 
 def evaluate_prepare(txid):
-    votes = prepare_votes.get(txid, {})
-    yes = sum(1 for v in votes.values() if v.upper()=="VOTE_YES")
-    is_leader = (current_primary == id_)
-    self_yes = 1 if is_leader else (1 if self_prepare_vote.get(txid, "").upper() == "VOTE_YES" else 0)
-    f, _ = compute_f_and_quorum()
-    threshold = 2 * f + 1
-    yes_total = yes + self_yes +1
-    N = len(members)
+    threshold, implicit, _, _ = vote_quorum(txid, "prepare")
+    yes_total = tally(txid, "prepare").n_yes + implicit
+    N = len(voters_of(txid))
 
     print(f"→ Prepare YES(total): {yes_total}/{N}  (threshold ≥ {threshold})")
     return yes_total, threshold
@@ -177,28 +501,86 @@ def do_commit_phase(txid, id_):
         print("→ Entered COMMIT phase (replicas please run 'ack commit' or 'ack abort').")
 
 def evaluate_commit(txid):
-    acks = commit_votes.get(txid, {})
-    yes = sum(1 for v in acks.values() if v.upper()=="ACK_COMMIT")
-    is_leader = (current_primary == id_)
-    self_yes = 1 if is_leader else (1 if self_commit_vote.get(txid, "").upper() == "ACK_COMMIT" else 0)
-
-    f, _ = compute_f_and_quorum()
-    threshold = 2 * f + 1
-    yes_total = yes + self_yes +1
-    N = len(members)
+    threshold, implicit, _, _ = vote_quorum(txid, "commit")
+    yes_total = tally(txid, "commit").n_yes + implicit
+    N = len(voters_of(txid))
 
     print(f"→ Commit ACK_COMMIT(total): {yes_total}/{N}  (threshold ≥ {threshold})")
     return yes_total, threshold
 
+def record_replies(txid, result):
+    # exactly-once table: remember the reply for every client-stamped op of the tx;
+    # with --admit the ops also leave the admission queue
+    ops = ops_of(tx_log.get(txid, {}).get("data"))
+    for op in ops:
+        bal = None
+        if str(op.get("operation", "")).lower() == "balance" and result == "COMMITTED":
+            bal = balances_from_committed().get(op.get("account"), 0)
+        pbft_dedup.record(op, txid, result, bal)
+    pbft_admit.decided(txid, ops)
+
+def admit_request(msg, addr):
+    # --admit: token bucket and bounded queue; a rejected request gets BUSY with a retry hint
+    if not pbft_admit.enabled:
+        return True
+    data = parse_kv(msg.get("data") or "")
+    f, _ = compute_f_and_quorum()
+    busy = pbft_admit.admit(data, data.get("client_id") or f"{addr[0]}:{msg.get('from_port')}", f)
+    if busy is None:
+        return True
+    reason, retry_after = busy
+    if msg.get("from_port"):
+        json_send(msg.get("host") or addr[0], msg["from_port"], {"type":"BUSY","reason":reason,
+                  "retry_after":retry_after,"data":msg.get("data"),"from":id_,
+                  "view":view,"leader":current_primary})
+    print(f"! BUSY ({reason}): {data.get('client_id') or addr[0]} asked to retry in {retry_after} ms")
+    return False
+
+def send_flow(pause, lag):
+    # --admit: execution lags behind ordering (or caught up again)
+    msg = {"type":"FLOW","pause":pause,"lag":lag,"from":id_}
+    for pid,(h,p) in list(members.items()):
+        if pid != id_:
+            json_send(h,p,msg)
+    print(f"\n! Execution lag {lag}: asked the leader to slow down" if pause else
+          f"\n✓ Execution caught up (lag {lag}): leader may speed up again")
+
+def answer_from_cache(msg, addr, me):
+    # a retry of an executed request: reply from the table, no consensus
+    data = parse_kv(msg.get("data") or "")
+    hit = pbft_dedup.cached(data)
+    if not hit:
+        return False
+    reply = {"type":"REPLY","txid":hit["txid"],"result":hit["result"],"data":data,"from":me,"cached":True,
+             "view":view,"leader":current_primary}
+    if "balance" in hit:
+        reply["balance"] = hit["balance"]
+    if msg.get("from_port"):
+        json_send(msg.get("host") or addr[0], msg["from_port"], reply)
+    print(f"→ Retry of {data.get('client_id')}#{data.get('ts')} answered from the reply cache (tx {hit['txid']})")
+    return True
+
 def finalize(txid, commit=True):
     tx = tx_log.get(txid)
     if not tx: return
+    pbft_trace.span(tx.get("trace_id"), txid, "execute", result="COMMITTED" if commit else "ABORTED")
+    pbft_batch.on_done(txid)
     if commit:
         tx["status"] = "COMMITTED"
+        execute(txid)
+        record_replies(txid, "COMMITTED")
+        apply_reconfig(txid)
+        checkpoint_progress(txid)
+        spec_decided(txid)
         print("\n[Phase 4/4] Reply")
         print("-"*60)
         print("→ Broadcast REPLY to clients")
-        msg = {"type":"REPLY","txid":txid,"result":"COMMITTED","data":tx["data"],"from":id_}
+        msg = {"type":"REPLY","txid":txid,"result":"COMMITTED","data":tx["data"],"from":id_,
+               "view":view,"leader":current_primary,
+               "trace_id":tx.get("trace_id"),"msgs":pbft_linear.sent.get(txid, 0),
+               "bytes":pbft_linear.sent_bytes.get(txid, 0)}
+        if str(tx["data"].get("operation", "")).lower() == "balance":
+            msg["balance"] = balances_from_committed().get(tx["data"].get("account"), 0)
         # for pid,(h,p) in members.items():
         #     if pid == id_:
         #         continue
@@ -208,6 +590,10 @@ def finalize(txid, commit=True):
         print("\n"+"="*60); print(f"✓ Tx {txid} committed!"); print("="*60)
     else:
         tx["status"] = "ABORTED"
+        tx["tentative"] = False      # an aborted tx is not undone later, nor re-proposed
+        record_replies(txid, "ABORTED")
+        checkpoint_progress(txid)
+        spec_decided(txid)
         meta = tx_log.setdefault(txid, {})
         if not meta.get("client_replied"):
             meta["client_replied"] = True
@@ -217,10 +603,110 @@ def finalize(txid, commit=True):
                 "result": "ABORTED",
                 "data": tx.get("data"),
                 "from": id_,
+                "view": view,
+                "leader": current_primary,
+                "trace_id": tx.get("trace_id"),
+                "msgs": pbft_linear.sent.get(txid, 0),
+                "bytes": pbft_linear.sent_bytes.get(txid, 0),
             }
             for (h, p) in list(clients):
                 json_send(h, p, abort_reply)
 
+def apply_reconfig(txid):
+    # a committed membership change: send to the new set now, vote with it from its effective seq
+    tx = tx_log.get(txid) or {}
+    data = tx.get("data") or {}
+    if not pbft_reconfig.is_reconfig(data) or tx.get("reconfig_applied"):
+        return
+    tx["reconfig_applied"] = True
+    seq = tx.get("seq") or (pbft_log.parse_txid(txid) or (0, 0, 0))[2]
+    eff, after = pbft_reconfig.schedule(seq, members, data)
+    members.clear(); members.update(after)
+    print(f"✓ Membership change committed (tx {txid}): {data.get('action')} {data.get('id')}; "
+          f"quorums switch at seq {eff}. Members: {', '.join(ids_sorted())}")
+    if data.get("id") == id_ and data.get("action") == "remove":
+        print("! This node has been removed from the cluster")
+    if data.get("action") == "add" and current_primary == id_:
+        threading.Thread(target=send_state, args=(data["host"], int(str(data["port"]))), daemon=True).start()
+
+def checkpoint_progress(txid):
+    # --checkpoint: once every seq up to a multiple of K is decided, snapshot it in the background
+    parsed = pbft_log.parse_txid(txid)
+    if not pbft_checkpoint.interval or not parsed:
+        return
+    shard = parsed[1]
+    def decided(s):
+        return any(tx_log.get(t, {}).get("status") in ("COMMITTED", "ABORTED") for t in tx_log.at(shard, s))
+    for n in pbft_checkpoint.advance(shard, decided):
+        ops = [(s, tx_log[t].get("data")) for s in range(1, n + 1) for t in tx_log.at(shard, s)
+               if tx_log[t].get("status") == "COMMITTED"]
+        pbft_checkpoint.take(id_, shard, n, ops, executed_state, announce_checkpoint)
+
+def executed_state(shard, n):
+    # the balances our ledger holds with exactly shard's committed seqs 1..n applied:
+    # later instances it already executed are wound back, committed ones it has not yet added
+    def txs():
+        return [(s, t) for s in range(1, max(n, pbft_shard.seqs.get(shard, 0)) + 1) for t in tx_log.at(shard, s)]
+    bal, done = ledger.balances_with(lambda: [t for _, t in txs()])
+    for s, t in txs():
+        info = tx_log.get(t, {})
+        if s > n and t in done:
+            sign = -1       # executed past n: wind it back
+        elif s <= n and t not in done and info.get("status") == "COMMITTED":
+            sign = 1        # committed within n but not executed yet
+        else:
+            continue
+        b = ledger.compile(ops_of(info.get("data")), strict=False)
+        for i, d in zip(b.idx, b.delta):
+            bal[ledger.names[i]] = bal.get(ledger.names[i], 0) + sign * d
+    return {a: v for a, v in bal.items() if v and (pbft_shard.num_shards == 1 or pbft_shard.shard_of(a) == shard)}
+
+def announce_checkpoint(shard, seq, digest):
+    msg = {"type":"CHECKPOINT_DIGEST","shard":shard,"seq":seq,"digest":digest,"from":id_}
+    for pid,(h,p) in list(members.items()):
+        if pid != id_:
+            json_send(h,p,msg)
+    count_checkpoint_digest(msg)
+
+def count_checkpoint_digest(msg):
+    f, _ = compute_f_and_quorum()
+    if pbft_checkpoint.vote(msg.get("shard", 0), msg.get("seq"), msg.get("from"), msg.get("digest"), 2*f+1):
+        print(f"\n✓ Checkpoint shard {msg.get('shard', 0)} seq {msg.get('seq')} is stable ({2*f+1} matching digests)")
+
+def on_stable_checkpoint(shard, seq, digest, signers, text):
+    # the shard leader keeps the stable checkpoint that recovery ships
+    if pbft_shard.shard_leader(ids_sorted(), current_primary, shard) == id_:
+        path = pbft_checkpoint.write_final(shard, seq, digest, signers, text)
+        print(f"✓ Final checkpoint written: {path} (signed by {', '.join(signers)})")
+    # every replica can serve this prefix to a lagging one (pbft_sync)
+    entries = committed_upto(shard, seq)
+    balances = pbft_checkpoint.balances_at(shard, seq)
+    threading.Thread(target=pbft_sync.prepare, args=(shard, seq, digest, entries, balances), daemon=True).start()
+
+def tentative_execute(txid):
+    # --tentative: execute once prepared and reply early; undone on view change
+    tx = tx_log.get(txid)
+    if not tentative_mode or not tx or tx.get("tentative"):
+        return
+    tx["tentative"] = True
+    msg = {"type":"REPLY","txid":txid,"result":"COMMITTED","tentative":True,"data":tx["data"],
+           "from":id_,"view":view,"leader":current_primary,"trace_id":tx.get("trace_id")}
+    if str(tx["data"].get("operation", "")).lower() == "balance":
+        msg["balance"] = balances_from_committed(include_tentative=True).get(tx["data"].get("account"), 0)
+    for (h,p) in list(clients):
+        json_send(h,p,msg)
+    print("→ Tentatively executed; early REPLY (tentative) sent to clients")
+
+def rollback_tentative(shard=None):
+    for tid, info in tx_log.items():
+        if shard is not None and pbft_shard.shard_of_tx(info, tid) != shard:
+            continue
+        if info.get("tentative") and info.get("status") not in ("COMMITTED", "ABORTED"):
+            info["tentative"] = False
+            info["status"] = "STARTED"
+            info["commit_started"] = False
+            print(f"↺ Rolled back tentative execution of tx {tid}")
+
 def _op_to_signed_amount(data):
     acct = data.get("account")
     amt = data.get("amount")
@@ -236,14 +722,27 @@ def _op_to_signed_amount(data):
         return None, None
     return acct, v if is_deposit else -v if op == "withdraw" else None
 
-def balances_from_committed():
-    bal = {}
+def execute(txid):
+    # apply a committed tx to the ledger (once per txid)
+    tx = tx_log.get(txid)
+    if tx:
+        ledger.apply(ledger.compile(ops_of(tx.get("data")), strict=False), key=txid)
+
+def tentative_deltas():
+    # executed early (--tentative/--speculative) but not committed yet
+    extra = {}
     for tid, info in tx_log.items():
-        if info.get("status") == "COMMITTED":
-            data = info.get("data") or {}
-            acct, val = _op_to_signed_amount(data)
-            if acct is None or val is None:
-                continue
+        if info.get("tentative") and info.get("status") not in ("COMMITTED", "ABORTED") and info.get("spec_result") != "ABORTED":
+            for op in ops_of(info.get("data")):
+                acct, val = _op_to_signed_amount(op)
+                if acct is not None and val is not None:
+                    extra[acct] = extra.get(acct, 0) + val
+    return extra
+
+def balances_from_committed(include_tentative=False):
+    bal = ledger.balances()
+    if include_tentative:
+        for acct, val in tentative_deltas().items():
             bal[acct] = bal.get(acct, 0) + val
     return bal
 
@@ -256,13 +755,32 @@ def status_print():
         role = "Leader" if nid == current_primary else "Replica"
         roles.append(f"{nid}({role})")
     print("Members: " + ", ".join(roles))
+    if pbft_shard.num_shards > 1:
+        print(pbft_shard.summary(ids_sorted(), current_primary))
+    print(pbft_linear.summary())
+    if pbft_forward.forwarded:
+        print(pbft_forward.summary())
+    if pbft_udp.enabled:
+        print(pbft_udp.summary())
+    print("\n".join(pbft_votes.summary_lines()))
+    print(f"State digest: {ledger.digest()}")
+    if pbft_admit.enabled:
+        print("\n".join(pbft_admit.summary_lines(compute_f_and_quorum()[0])))
+    if pbft_monitor.enabled:
+        print("\n".join(pbft_monitor.summary_lines()))
+    if pbft_batch.enabled:
+        print("\n".join(pbft_batch.summary_lines()))
+    if pbft_checkpoint.interval:
+        print("\n".join(pbft_checkpoint.summary_lines()))
+    if pbft_sync.stats["served"] or pbft_sync.stats["fetched"]:
+        print(pbft_sync.summary())
     print("-"*60)
     if not tx_log:
         print("Tx history: (empty)")
     else:
         print("Tx history:")
         for tid, info in tx_log.items():
-            print(f"  {tid}: {info.get('status','UNKNOWN')} - {info.get('data')}")
+            print(f"  {pbft_shard.label(info)}{tid}: {info.get('status','UNKNOWN')} - {info.get('data')}")
     print("-"*60)
     bal = balances_from_committed()
     if not bal:
@@ -273,24 +791,53 @@ def status_print():
             print(f"  {k}: {v}")
     print("="*60)
 
-def snapshot_text():
+def snapshot_text(shard=None):
     lines = []
-    lines.append(f"# Node {id_} snapshot @ {time.strftime('%Y-%m-%d %H:%M:%S')} (view={view}, leader={current_primary})")
-    if not tx_log:
+    scope = "" if shard is None else f", shard={shard}"
+    lines.append(f"# Node {id_} snapshot @ {time.strftime('%Y-%m-%d %H:%M:%S')} (view={view}, leader={current_primary}{scope})")
+    txs = [(tid, info) for tid, info in tx_log.items() if shard is None or info.get("shard", 0) == shard]
+    if not txs:
         lines.append("Transactions: (empty)")
     else:
         lines.append("Transactions:")
-        for tid, info in tx_log.items():
-            lines.append(f"  - {tid}: {info.get('status','UNKNOWN')} {json.dumps(info.get('data'))}")
+        for tid, info in txs:
+            lines.append(f"  - {pbft_shard.label(info)}{tid}: {info.get('status','UNKNOWN')} {json.dumps(info.get('data'))}")
     bal = balances_from_committed()
+    if shard is not None:
+        bal = {k: v for k, v in bal.items() if pbft_shard.shard_of(k) == shard}
     if not bal:
         lines.append("Balances: (empty)")
     else:
         lines.append("Balances:")
         for k,v in bal.items():
             lines.append(f"  - {k}: {v}")
+    table = pbft_dedup.snapshot()
+    if table:
+        lines.append("Client table:")
+        for cid, entry in sorted(table.items()):
+            lines.append(f"  - {cid}: {json.dumps(entry, sort_keys=True)}")
     return "\n".join(lines) + "\n"
 
+def assemble_checkpoint(cid):
+    # manual checkpoint: done once 2f+1 reports are in
+    if cid in checkpoint_done:
+        return
+    checkpoint_done.add(cid)
+    ensure_dir("checkpoints")
+    final_path = os.path.join("checkpoints", f"final_checkpoint_{cid}.log")
+    with open(final_path, "w", encoding="utf-8") as f:
+        for nid in ids_sorted():
+            txt = checkpoint_reports[cid].get(nid)
+            if txt:
+                f.write(txt + ("\n" if not txt.endswith("\n") else ""))
+    print(f"✓ Final checkpoint assembled: {final_path} ({len(checkpoint_reports[cid])} reports)")
+
+def expire_checkpoint(cid):
+    if cid not in checkpoint_done:
+        checkpoint_done.add(cid)
+        print(f"\n× Checkpoint {cid}: {len(checkpoint_reports.get(cid, {}))}/{checkpoint_expected.get(cid)} "
+              f"reports after {pbft_checkpoint.TIMEOUT:.0f}s; not assembled")
+
 def write_local_checkpoint_file(text):
     ensure_dir("checkpoints")
     path = os.path.join("checkpoints", f"{id_}_checkpoints.log")
@@ -300,7 +847,7 @@ def write_local_checkpoint_file(text):
 def load_latest_final_checkpoint():
     global last_final_checkpoint_path
     ensure_dir("checkpoints")
-    files = sorted(glob.glob(os.path.join("checkpoints", "final_checkpoint_*.log")))
+    files = sorted(glob.glob(os.path.join("checkpoints", "final_checkpoint_*.log")), key=os.path.getmtime)
     if files:
         last_final_checkpoint_path = files[-1]
         try:
@@ -328,6 +875,10 @@ def handle_checkpoint_sync_update_from_payload(msg):
     incoming_state_data = msg.get("state_data")
     if isinstance(incoming_tx_log, dict):
         tx_log.clear(); tx_log.update(incoming_tx_log)
+        ledger.reset()
+        for tid, info in tx_log.items():
+            if info.get("status") == "COMMITTED":
+                execute(tid)
     if isinstance(incoming_state_data, dict):
         state_data.clear(); state_data.update(incoming_state_data)
     else:
@@ -337,12 +888,188 @@ def handle_checkpoint_sync_update_from_payload(msg):
                 state_data[tid] = info.get("data")
     if "byzantine_id" in msg:
         byzantine_id = msg.get("byzantine_id")
+    pbft_dedup.load(msg.get("client_table"))
+    for shard, rotation in (msg.get("shard_rotations") or {}).items():
+        pbft_shard.rotate(int(shard), rotation)
+    pbft_reconfig.load(msg.get("epochs"))
+    clients.update(tuple(c) for c in msg.get("clients") or [])
     print(f"\n✓ Checkpoint/state synced from leader. View={view}, leader={current_primary}, Byzantine={byzantine_id}")
 
+def fetch_state(msg):
+    # chunked state transfer: the checkpointed prefix from every replica that has it
+    mh = msg.get("members") if isinstance(msg.get("members"), dict) else members
+    sources = {pid: tuple(hp) for pid, hp in mh.items() if pid != id_}
+    f = max(0, (len(mh) - 1) // 3)
+    pbft_sync.fetch(msg, sources, id_, (HOST, port), f + 1, install_state,
+                    lambda: request_full_state(msg.get("current_primary"), sources))
+
+def request_full_state(leader, sources):
+    # a snapshot did not rebuild to its digest: its manifest was bad, so ask
+    # another member for its whole state in one CHECKPOINT_SYNC
+    others = [pid for pid in sorted(sources) if pid != leader] or sorted(sources)
+    for pid in others:
+        try:
+            json_send(*sources[pid], {"type":"RECOVER_HELLO","host":HOST,"port":port,"full":True})
+            print(f"→ Asked {pid} for its full state instead")
+            return
+        except Exception:
+            continue
+    print("× No member reachable for a full state transfer; run 'recover' again")
+
+def install_state(msg, entries):
+    # the verified snapshots, the leader's tail, and whatever arrived meanwhile
+    incoming = {txid: {"status":"COMMITTED","data":data,"shard":shard,"seq":s,"commit_started":True}
+                for shard, s, txid, data in entries}
+    incoming.update(msg.get("tx_log") or {})
+    for tid, info in tx_log.items():
+        incoming.setdefault(tid, info)
+    handle_checkpoint_sync_update_from_payload(dict(msg, tx_log=incoming, state_data=None))
+    print(f"\n{id_}> ", end="", flush=True)
+
+def collector(txid):
+    return pbft_shard.shard_leader(ids_sorted(), current_primary, tx_log.get(txid, {}).get("shard", 0))
+
+def vote_targets(txid):
+    # everyone else, or with --linear only the collector
+    if pbft_linear.enabled:
+        c = collector(txid)
+        return [(c, members[c])] if c != id_ and c in members else []
+    return [(pid, hp) for pid, hp in members.items() if pid != id_]
+
+def linear_collect(txid, phase):
+    # --linear collector: once its votes decide the phase, broadcast them as one certificate
+    if not pbft_linear.enabled or txid not in tx_log or collector(txid) != id_:
+        return
+    t = tally(txid, phase)
+    if t.state() != "quorum" and len(t) < len(members) - 1:
+        return
+    votes = t.votes()
+    if not pbft_linear.first_cert(txid, phase):
+        return
+    kind = "PREPARE_CERT" if phase == "prepare" else "COMMIT_CERT"
+    cert = {"type":kind,"txid":txid,"from":id_,"view":view,"votes":votes,"trace_id":tx_log[txid].get("trace_id")}
+    for pid,(h,p) in members.items():
+        if pid != id_:
+            pbft_linear.send(h,p,cert)
+    print(f"→ {kind} broadcast with {len(votes)} votes (tx {txid})")
+
+def send_vote(txid, msg):
+    targets = vote_targets(txid)
+    if pbft_udp.enabled:
+        pbft_udp.send(msg, [hp for _, hp in targets], to_all=not pbft_linear.enabled)
+        pbft_udp.watch(txid)
+        return
+    for pid,(h,p) in targets:
+        pbft_linear.send(h,p,msg)
+
+def undecided(txid):
+    return txid in tx_log and tx_log[txid].get("status") not in ("COMMITTED", "ABORTED")
+
+def broadcast_prepare(txid, vote):
+    self_prepare_vote[txid] = vote
+    trace_id = tx_log.get(txid, {}).get("trace_id")
+    t0 = time.time()
+    send_vote(txid, {"type":"PREPARE","from":id_,"view":view,"txid":txid,"vote":vote,"trace_id":trace_id})
+    pbft_trace.span(trace_id, txid, "vote", start=t0, phase="prepare", vote=vote)
+
+def broadcast_commit_vote(txid, ack):
+    self_commit_vote[txid] = ack
+    trace_id = tx_log.get(txid, {}).get("trace_id")
+    t0 = time.time()
+    send_vote(txid, {"type":"COMMIT_VOTE","from":id_,"view":view,"txid":txid,"ack":ack,"trace_id":trace_id})
+    pbft_trace.span(trace_id, txid, "vote", start=t0, phase="commit", vote=ack)
+    if ack == "ACK_ABORT":
+        state_data.pop(txid, None)
+
+def misbehaving():
+    return misbehave and byzantine_id == id_
+
+def op_allowed(txid):
+    # what an honest replica checks before voting yes: a known operation
+    # that does not overdraw the account (tentative/speculative state included)
+    tx = tx_log[txid]
+    data = tx.get("data") or {}
+    if pbft_reconfig.is_reconfig(data):
+        return pbft_reconfig.check(data, members, current_primary) is None
+    if str(data.get("operation", "")).lower() == "balance":
+        return bool(data.get("account"))
+    if not all(pbft_dedup.is_new(op, txid) for op in ops_of(data)):
+        return False   # carries a client request that already executed
+    counted = tx.get("tentative") and tx.get("spec_result") != "ABORTED"
+    return ledger.allowed(ledger.compile(ops_of(data)), tentative_deltas(), counted)
+
+def auto_vote(txid):
+    ok = op_allowed(txid) and not misbehaving()
+    broadcast_prepare(txid, "VOTE_YES" if ok else "VOTE_NO")
+
+def auto_progress(txid):
+    # --auto: what an operator running 'progress' after every vote would do
+    if not auto_mode:
+        return
+    with auto_lock:
+        tx = tx_log.get(txid)
+        if not tx or tx.get("status") in ("COMMITTED", "ABORTED"):
+            return
+        if not tx.get("commit_started"):
+            py, pq = evaluate_prepare(txid)
+            if py < pq:
+                if tally(txid, "prepare").state() == "impossible":
+                    finalize(txid, commit=False)
+                return
+            pbft_trace.span(tx.get("trace_id"), txid, "quorum", phase="prepare", yes=py, threshold=pq)
+            do_commit_phase(txid, id_)
+            tentative_execute(txid)
+            if leader_of(txid) != id_ and id_ in voters_of(txid):
+                broadcast_commit_vote(txid, "ACK_ABORT" if misbehaving() else "ACK_COMMIT")
+        cy, cq = evaluate_commit(txid)
+        if cy >= cq:
+            pbft_trace.span(tx.get("trace_id"), txid, "quorum", phase="commit", yes=cy, threshold=cq)
+            finalize(txid, commit=True)
+
+def spec_execute(txid, digest):
+    tx = tx_log[txid]
+    if pbft_reconfig.is_reconfig(tx.get("data")):
+        # no client completes a membership change: it always goes through PREPARE/COMMIT
+        tx["spec_history"] = digest
+        if auto_mode and leader_of(txid) != id_:
+            auto_vote(txid)
+            auto_progress(txid)
+        return
+    ok = op_allowed(txid)
+    tx["tentative"] = True
+    tx["spec_history"] = digest
+    tx["spec_result"] = "COMMITTED" if ok else "ABORTED"
+    msg = {"type":"SPEC_REPLY","txid":txid,"view":view,"leader":current_primary,"seq":tx.get("seq"),
+           "history":pbft_spec.reported(digest),"result":tx["spec_result"],"data":tx.get("data"),"from":id_,"trace_id":tx.get("trace_id")}
+    if str((tx.get("data") or {}).get("operation", "")).lower() == "balance":
+        msg["balance"] = balances_from_committed(include_tentative=True).get(tx["data"].get("account"), 0)
+    for (h,p) in list(clients):
+        json_send(h,p,msg)
+    pbft_trace.span(tx.get("trace_id"), txid, "execute", result=tx["spec_result"], speculative=True)
+
+def spec_deliver(txid, data, msg):
+    spec_release(pbft_spec.deliver(msg.get("shard", 0), msg.get("seq"), txid, data, msg["spec_history"]))
+
+def spec_decided(txid):
+    # the slow path decided txid: a history that stopped at it moves on (pbft_spec)
+    if pbft_spec.enabled:
+        spec_release(pbft_spec.decided(txid))
+
+def spec_release(ready):
+    for tid, digest in ready:
+        if tx_log.get(tid, {}).get("status") in ("COMMITTED", "ABORTED"):
+            continue        # the slow path got there first
+        if digest:
+            spec_execute(tid, digest)
+        else:
+            print(f"× Speculative history mismatch on tx {tid}; waiting for client fallback")
+
 def on_msg(msg, addr):
-    global crashed, members, current_primary, primary_host, primary_port, view, current_tx, pending_prepare_tx, byzantine_id
+    global crashed, members, current_primary, primary_host, primary_port, view, byzantine_id
     if crashed: return
     t = msg.get("type")
+    if pbft_trace.enabled and t in ("PRE_PREPARE", "PREPARE", "COMMIT_VOTE", "PREPARE_CERT", "COMMIT_CERT", "REPLY"):
+        pbft_trace.span(msg.get("trace_id"), msg.get("txid"), "receive", msg=t, src=msg.get("from"))
 
     if t == "MEMBERS":
         new_members = msg.get("members", {})
@@ -361,23 +1088,118 @@ def on_msg(msg, addr):
             print(f"\n✓ Client seen: {h}:{p}")
             print(f"\n{id_}> ", end="", flush=True)
 
+    elif t == "CLIENT_TX":
+        print(f"\n→ CLIENT_TX received from {addr[0]}:{msg.get('from_port')}: {msg.get('data')}")
+        pbft_workload.record(msg.get("data"), f"{msg.get('host') or addr[0]}:{msg.get('from_port')}")
+        leader = leader_for(parse_kv(msg.get("data") or ""))
+        if answer_from_cache(msg, addr, id_):
+            pass
+        elif leader != id_:
+            if pbft_monitor.enabled:
+                watch_request(msg, addr)
+            if pbft_forward.needed(msg) and leader in members:
+                pbft_forward.forward(tuple(members[leader]), msg, addr, id_)
+                print(f"→ Forwarded to the leader {leader}")
+        elif auto_mode and admit_request(msg, addr):
+            if pbft_batch.enabled:
+                pbft_batch.submit(msg.get("data") or "")
+            else:
+                with order_lock:
+                    if start_tx(msg.get("data") or "") is None:
+                        pbft_admit.drop(parse_kv(msg.get("data") or ""))
+
+    elif t == "FORWARD":
+        # requests a replica passed on to us as their leader
+        print(f"\n→ FORWARD from {msg.get('from')}: {len(msg.get('requests') or [])} requests")
+        for req in msg.get("requests") or []:
+            on_msg(req, (req.get("host") or addr[0], req.get("from_port")))
+
+    elif t == "SPEC_COMMIT":
+        # client saw 3f+1 matching SPEC_REPLYs: the speculative result is final
+        # (only a registered client may finalize; anyone else falls back to PBFT)
+        tx = tx_log.get(msg.get("txid"))
+        known = (msg.get("host") or addr[0], msg.get("port")) in clients
+        if known and tx and tx.get("spec_history") == msg.get("history") and tx.get("status") not in ("COMMITTED", "ABORTED"):
+            tx["status"] = tx.get("spec_result", "COMMITTED")
+            tx["tentative"] = False
+            if tx["status"] == "COMMITTED":
+                execute(msg["txid"])
+                state_data[msg["txid"]] = tx.get("data")
+            record_replies(msg["txid"], tx["status"])
+            pbft_batch.on_done(msg["txid"])
+            checkpoint_progress(msg["txid"])
+
+    elif t == "SPEC_FALLBACK":
+        txid = msg.get("txid")
+        tx = tx_log.get(txid)
+        if tx and tx.get("status") not in ("COMMITTED", "ABORTED"):
+            print(f"\n→ SPEC_FALLBACK for tx {txid}: finishing through PREPARE/COMMIT")
+            if auto_mode and leader_of(txid) != id_ and txid not in self_prepare_vote:
+                auto_vote(txid)
+            auto_progress(txid)
+            if not auto_mode:
+                pending_prepare_tx[pbft_shard.shard_of_tx(tx, txid)] = txid
+                print(f"  ✓ Waiting for manual vote: run 'prepare yes{shard_hint(txid)}' or 'prepare no{shard_hint(txid)}'")
+            print(f"\n{id_}> ", end="", flush=True)
+
+    elif t == "READ":
+        # read-only fast path: answer from executed state, no ordering
+        acct = msg.get("account")
+        if msg.get("host") and msg.get("port"):
+            json_send(msg["host"], msg["port"], {"type":"READ_REPLY", "qid": msg.get("qid"), "account": acct,
+                                                 "balance": balances_from_committed().get(acct, 0),
+                                                 "from": id_, "view": view})
+
+    elif t == "PAYLOAD" and pbft_dissem.valid(msg):
+        for pid in pbft_dissem.children(ids_sorted(), msg.get("root"), id_):
+            if pid in members:
+                h, p = members[pid]
+                pbft_linear.send(h, p, dict(msg, **{"from": id_}))
+        full = pbft_dissem.on_payload(msg)
+        if full:
+            on_msg(full, addr)
+
+    elif t == "PAYLOAD_REQUEST":
+        info = tx_log.get(msg.get("txid"))
+        if info and info.get("data") is not None and msg.get("host") and msg.get("port"):
+            json_send(msg["host"], msg["port"], pbft_dissem.payload({"txid": msg["txid"], "data": info["data"]}, id_))
+
     elif t == "PRE_PREPARE":
+        if msg.get("data") is None and msg.get("digest"):
+            full = pbft_dissem.on_order(msg)
+            if full is None:
+                threading.Timer(pbft_dissem.FETCH_AFTER, fetch_payload, args=(msg,)).start()
+                return
+            msg = full
         txid = msg["txid"]; data = msg["data"]
         print(f"\n→ Received PRE-PREPARE (tx {txid}) from {msg.get('from')}")
-        if byzantine_id == id_:
-            print("  ✓ Waiting for manual vote: run 'prepare to <PID> yes' or 'prepare to <PID> no'")
-        else:
-            print("  ✓ Waiting for manual vote: run 'prepare yes' or 'prepare no'")
         primary_host = msg.get("primary_host", primary_host); primary_port = msg.get("primary_port", primary_port)
-        pending_prepare_tx = txid
         tx_log.setdefault(txid, {"status":"STARTED","data":data,"commit_started":False})
+        tx_log[txid]["trace_id"] = msg.get("trace_id")
+        if "shard" in msg:
+            tx_log[txid]["shard"] = msg["shard"]; tx_log[txid]["seq"] = msg.get("seq")
+            pbft_shard.observe_seq(msg["shard"], msg.get("seq"))
+        pending_prepare_tx[pbft_shard.shard_of_tx(tx_log[txid], txid)] = txid
+        hint = shard_hint(txid)
+        if byzantine_id == id_:
+            print(f"  ✓ Waiting for manual vote: run 'prepare to <PID> yes{hint}' or 'prepare to <PID> no{hint}'")
+        else:
+            print(f"  ✓ Waiting for manual vote: run 'prepare yes{hint}' or 'prepare no{hint}'")
+        pbft_admit.ordered(txid)
+        pbft_monitor.ordered(ops_of(data))
+        if pbft_spec.enabled and msg.get("spec_history"):
+            spec_deliver(txid, data, msg)
+        elif auto_mode and leader_of(txid) != id_ and id_ in voters_of(txid):
+            auto_vote(txid)
+            auto_progress(txid)
         print(f"\n{id_}> ", end="", flush=True)
 
     elif t == "PREPARE":
         txid = msg["txid"]; pid = msg["from"]; vote = msg["vote"]
         if pid != id_:
-            prepare_votes.setdefault(txid, {})[pid] = vote
             print(f"\n→ PREPARE from {pid}: {vote}")
+            count_vote(txid, "prepare", pid, vote, msg.get("view"))
+            linear_collect(txid, "prepare")
             print(f"\n{id_}> ", end="", flush=True)
 
 
@@ -386,15 +1208,30 @@ def on_msg(msg, addr):
         pid = msg["from"];
         ack = msg["ack"]
         if pid != id_:
-            commit_votes.setdefault(txid, {})[pid] = ack
             print(f"\n→ COMMIT_VOTE from {pid}: {ack} (tx {txid})")
+            count_vote(txid, "commit", pid, ack, msg.get("view"))
+            linear_collect(txid, "commit")
             print(f"\n{id_}> ", end="", flush=True)
 
+    elif t in ("PREPARE_CERT", "COMMIT_CERT"):
+        # --linear: the collector's votes stand in for the ones not sent to us
+        txid = msg["txid"]
+        print(f"\n→ {t} from {msg.get('from')}: {len(msg.get('votes', {}))} votes (tx {txid})")
+        for pid, v in msg.get("votes", {}).items():
+            if pid != id_:
+                count_vote(txid, "prepare" if t == "PREPARE_CERT" else "commit", pid, v, msg.get("view"))
+        auto_progress(txid)
+        print(f"\n{id_}> ", end="", flush=True)
+
     elif t == "ABORT":
         txid = msg["txid"]
         print(f"\n→ ABORT received (tx {txid})")
         tx_log.setdefault(txid, {"status": "ABORTED", "data": state_data.get(txid)})
         tx_log[txid]["status"] = "ABORTED"
+        tx_log[txid]["tentative"] = False
+        record_replies(txid, "ABORTED")
+        checkpoint_progress(txid)
+        spec_decided(txid)
         # abort_reply = {
         #     "type": "REPLY",
         #     "txid": txid,
@@ -414,6 +1251,11 @@ def on_msg(msg, addr):
         state_data[txid] = msg.get("data")
         tx_log.setdefault(txid, {"status": "COMMITTED", "data": state_data[txid]})
         tx_log[txid]["status"] = "COMMITTED"
+        execute(txid)
+        record_replies(txid, "COMMITTED")
+        apply_reconfig(txid)
+        checkpoint_progress(txid)
+        spec_decided(txid)
         # reply_to_client = {
         #     "type": "REPLY",
         #     "txid": txid,
@@ -425,10 +1267,22 @@ def on_msg(msg, addr):
         #     json_send(h, p, reply_to_client)
         print(f"\n  Data: {state_data.get(txid)}")
 
+    elif t == "VIEW_CHANGE" and "shard" in msg:
+        on_shard_view_change(msg)
+        print(f"\n{id_}> ", end="", flush=True)
+
+    elif t == "NEW_VIEW" and "shard" in msg:
+        install_shard_view(msg["shard"], msg.get("rotation", 0), msg.get("from"))
+        print(f"\n{id_}> ", end="", flush=True)
+
+    elif t == "VIEW_CHANGE" and msg.get("view", view) != view:
+        print(f"\n→ Stale VIEW_CHANGE from {msg.get('from')} (for view {msg.get('view')}, now {view}); ignored")
+
     elif t == "VIEW_CHANGE":
         sender = msg.get("from")
         req_view = view + 1
-        print(f"\n→ VIEW_CHANGE from {sender} (request view={req_view})")
+        why = f": {msg['reason']}" if msg.get("reason") else ""
+        print(f"\n→ VIEW_CHANGE from {sender} (request view={req_view}){why}")
         target = next_primary_id()
         if target == id_ and view not in vc_done_for_view:
             vc_votes.setdefault(view, set()).add(sender)
@@ -451,6 +1305,7 @@ def on_msg(msg, addr):
                                                                        "byzantine_id": byzantine_id})
                 view = newv; current_primary = id_
                 print(f"✓ Reached {need} votes; I ({id_}) broadcast NEW_VIEW, view={view}")
+                rollback_tentative()
                 announce_primary_capabilities()
         print(f"\n{id_}> ", end="", flush=True)
 
@@ -466,6 +1321,7 @@ def on_msg(msg, addr):
             byzantine_id = msg["byzantine_id"]
         view = nv; current_primary = leader
         print(f"\n✓ NEW_VIEW received: view={view}, new leader={current_primary} (Byzantine={byzantine_id})")
+        rollback_tentative()
         announce_primary_capabilities()
         print(f"\n{id_}> ", end="", flush=True)
 
@@ -473,7 +1329,7 @@ def on_msg(msg, addr):
         cid = msg.get("checkpoint_id")
         collector_host = msg.get("collector_host", DEFAULT_PRIMARY_HOST)
         collector_port = msg.get("collector_port", DEFAULT_PRIMARY_PORT)
-        text = snapshot_text()
+        text = snapshot_text(msg.get("shard"))
         print("\n" + text)
         write_local_checkpoint_file(text)
         json_send(collector_host, collector_port, {
@@ -490,49 +1346,111 @@ def on_msg(msg, addr):
         node_id = msg.get("node_id", "UNKNOWN")
         text = msg.get("text", "")
         checkpoint_reports.setdefault(cid, {})[node_id] = text
-        expected = checkpoint_expected.get(cid, len(members))
+        f, _ = compute_f_and_quorum()
+        expected = checkpoint_expected.get(cid, 2*f+1)
         got = len(checkpoint_reports[cid])
         print(f"\n→ Received checkpoint report from {node_id} ({got}/{expected})")
         if got >= expected:
-            ensure_dir("checkpoints")
-            final_path = os.path.join("checkpoints", f"final_checkpoint_{cid}.log")
-            with open(final_path, "w", encoding="utf-8") as f:
-                for nid in ids_sorted():
-                    txt = checkpoint_reports[cid].get(nid)
-                    if txt:
-                        f.write(txt + ("\n" if not txt.endswith("\n") else ""))
-            print(f"✓ Final checkpoint assembled: {final_path}")
+            assemble_checkpoint(cid)
         print(f"\n{id_}> ", end="", flush=True)
 
+    elif t == "CHECKPOINT_DIGEST":
+        count_checkpoint_digest(msg)
+
     elif t == "CHECKPOINT_SYNC":
-        handle_checkpoint_sync_update_from_payload(msg)
+        if msg.get("snapshots"):
+            fetch_state(msg)
+        else:
+            handle_checkpoint_sync_update_from_payload(msg)
         print(f"\n{id_}> ", end="", flush=True)
 
+    elif t == "STATE_CHUNK_REQUEST":
+        pbft_sync.serve(msg, id_, committed_upto)
+
+    elif t in ("STATE_HAVE", "STATE_CHUNK"):
+        pbft_sync.on_msg(msg)
+
     elif t == "RECOVER_HELLO":
-        if current_primary == id_:
-            text = load_latest_final_checkpoint()
+        if current_primary == id_ or msg.get("full"):
             dest_h, dest_p = msg.get("host"), msg.get("port")
-            payload = {
-                "type":"CHECKPOINT_SYNC",
-                "text": text,
-                "view": view,
-                "current_primary": current_primary,
-                "members": members,
-                "byzantine_id": byzantine_id,
-                "primary_host": HOST,
-                "primary_port": port,
-                "tx_log": tx_log,
-                "state_data": state_data,
-            }
             if dest_h and dest_p:
-                json_send(dest_h, dest_p, payload)
-                print(f"\n→ Sent latest checkpoint/state to recovering node {dest_h}:{dest_p}")
+                n = send_state(dest_h, dest_p, full=msg.get("full"))
+                print(f"\n→ Sent latest checkpoint/state to recovering node {dest_h}:{dest_p} ({n / 1024:.1f} KiB)")
+
+    elif t == "FLOW":
+        pbft_admit.on_flow(msg.get("from"), msg.get("pause"), msg.get("lag"))
+        print(f"\n→ FLOW from {msg.get('from')}: {'pause' if msg.get('pause') else 'resume'} (lag {msg.get('lag')})")
+
+    elif t == "JOIN_REQUEST":
+        pid = msg.get("id")
+        if current_primary != id_:
+            json_send(primary_host, primary_port, msg)
+            print(f"\n→ JOIN_REQUEST from {pid} forwarded to the leader {current_primary}")
+        elif pbft_config.loaded() and not pbft_config.key_ok(pid, msg.get("key")):
+            print(f"\n× JOIN_REQUEST from {pid} rejected: not in {pbft_config.path} or wrong key")
+        else:
+            print(f"\n→ JOIN_REQUEST from {pid} ({msg.get('host')}:{msg.get('port')}): proposing membership change")
+            propose_reconfig(pbft_reconfig.op("add", pid, msg.get("host"), msg.get("port")))
+        print(f"\n{id_}> ", end="", flush=True)
+
+def committed_upto(shard, seq):
+    # (seq, txid, data) of every committed instance of shard up to seq, as checkpoints see them
+    return [(s, t, tx_log[t].get("data")) for s in range(1, seq + 1) for t in tx_log.at(shard, s)
+            if tx_log[t].get("status") == "COMMITTED"]
+
+def state_snapshots():
+    # stable checkpoints go as chunk manifests (pbft_sync); -> (manifests, the tx_log they do not cover)
+    snaps = [m for m in (pbft_sync.offer(shard, seq, digest, committed_upto)
+                         for shard, (seq, digest, _) in sorted(pbft_checkpoint.stable.items())) if m]
+    covered = {m["shard"]: m["seq"] for m in snaps}
+    tail = {}
+    for tid, info in tx_log.items():
+        parsed = pbft_log.parse_txid(tid)
+        if parsed and info.get("status") == "COMMITTED" and parsed[2] <= covered.get(parsed[1], 0):
+            continue
+        tail[tid] = info
+    return snaps, tail
+
+def snapshot_headers(snaps):
+    return "".join(f"# Chunked snapshot shard={m['shard']} seq={m['seq']} digest={m['digest']} "
+                   f"chunks={len(m['chunks'])} bytes={m['size']}\n" for m in snaps)
+
+def send_state(dest_h, dest_p, full=False):
+    # recovery and joins: the leader's checkpoint text and full state, or chunk manifests and the tail;
+    # full: no manifests (a chunked transfer failed), from any member
+    snaps, tail = ([], tx_log.to_dict()) if full else state_snapshots()
+    primary_at = (HOST, port) if current_primary == id_ else tuple(members.get(current_primary, (HOST, port)))
+    return json_send(dest_h, dest_p, {
+        "type":"CHECKPOINT_SYNC",
+        "text": snapshot_headers(snaps) if snaps else load_latest_final_checkpoint(),
+        "snapshots": snaps,
+        "view": view,
+        "current_primary": current_primary,
+        "members": members,
+        "byzantine_id": byzantine_id,
+        "primary_host": primary_at[0],
+        "primary_port": primary_at[1],
+        "tx_log": tail,
+        "state_data": None if snaps else state_data,
+        "client_table": pbft_dedup.snapshot(),
+        "shard_rotations": dict(pbft_shard.rotations),
+        "epochs": pbft_reconfig.snapshot(),
+        "clients": [list(c) for c in clients],
+    })
 
 def server():
-    json_server(HOST, port, on_msg, on_ready=banner)
+    handler = pbft_profile.wrap(on_msg)
+    if udp_mode:
+        pbft_udp.configure(id_, HOST, port, udp_mode, lambda: {pid: hp for pid, hp in members.items() if pid != id_}, handler, undecided, udp_loss, DEFAULT_PRIMARY_PORT)
+    if workers:
+        json_server_mp(HOST, port, handler, workers=workers, on_ready=banner,
+                       max_queued=pbft_admit.MAX_THREADS if pbft_admit.enabled else None)
+    else:
+        json_server(HOST, port, handler, on_ready=banner,
+                    max_threads=pbft_admit.MAX_THREADS if pbft_admit.enabled else None)
 
 def repl():
-    global crashed, current_tx, pending_prepare_tx
+    global crashed, misbehave, slow_leader
     while True:
         try:
             cmd = input(f"{id_}> ").strip()
@@ -550,104 +1468,142 @@ def repl():
                     print(f"  {k}: {v}")
             else:
                 print("(empty)")
+            tentative = {tid: info.get("data") for tid, info in tx_log.items()
+                         if info.get("tentative") and info.get("status") not in ("COMMITTED", "ABORTED")}
+            if tentative:
+                print("Tentatively executed (not yet committed):")
+                for k,v in tentative.items():
+                    print(f"  {k}: {v}")
 
-        elif cmd == "tx":
+        elif cmd.startswith("reconfig"):
+            parts = cmd.split()
             if current_primary != id_:
+                print("× Only the leader orders membership changes")
+            elif len(parts) == 5 and parts[1] == "add":
+                propose_reconfig(pbft_reconfig.op("add", parts[2], parts[3], parts[4]))
+            elif len(parts) == 3 and parts[1] == "remove":
+                propose_reconfig(pbft_reconfig.op("remove", parts[2]))
+            else:
+                print("Usage: reconfig add <ID> <HOST> <PORT> | reconfig remove <ID>")
+
+        elif cmd == "tx":
+            if not pbft_shard.led_shards(ids_sorted(), current_primary, id_):
                 print("× I am not the leader; cannot start a transaction"); 
             else:
                 data = input("Enter tx data (key=value, e.g., account=alice,amount=100,operation=deposit):\ndata> ").strip()
                 start_tx(data)
 
-        elif cmd == "progress":
+        elif cmd == "progress" or cmd.startswith("progress "):
             # Any node may advance phases locally based on its own view of votes
-            if not current_tx:
-                pending = [tid for tid,info in tx_log.items() if info.get("status")!="COMMITTED"]
-                current_tx = pending[-1] if pending else None
-                if not current_tx:
+            parts = cmd.split()
+            shard, err = pbft_shard.pick(parts[1] if len(parts) > 1 else None,
+                                         {s for s, t in current_tx.items() if t} | undecided_shards())
+            if err:
+                print(err); continue
+            txid = current_tx.get(shard)
+            if not txid:
+                pending = [tid for tid,info in tx_log.items() if info.get("status")!="COMMITTED"
+                           and pbft_shard.shard_of_tx(info, tid) == shard]
+                txid = current_tx[shard] = pending[-1] if pending else None
+                if not txid:
                     print("× No ongoing tx"); continue
-            py, pq = evaluate_prepare(current_tx)
+            py, pq = evaluate_prepare(txid)
 
-            if not tx_log[current_tx].get("commit_started"):
+            if not tx_log[txid].get("commit_started"):
                 if py < pq:
                     print("Prepare not satisfied; aborting the tx.")
-                    finalize(current_tx, commit=False)
-                    current_tx = None
+                    finalize(txid, commit=False)
+                    current_tx.pop(shard, None)
                     continue
                 else:
                     print("\nPrepare threshold satisfied; entering COMMIT")
-                    do_commit_phase(current_tx, id_)
+                    pbft_trace.span(tx_log[txid].get("trace_id"), txid, "quorum",
+                                    phase="prepare", yes=py, threshold=pq)
+                    do_commit_phase(txid, id_)
+                    tentative_execute(txid)
                     continue
-            cy, cq = evaluate_commit(current_tx)
+            cy, cq = evaluate_commit(txid)
 
             if cy >= cq:
-                finalize(current_tx, commit=True)
+                pbft_trace.span(tx_log[txid].get("trace_id"), txid, "quorum",
+                                phase="commit", yes=cy, threshold=cq)
+                finalize(txid, commit=True)
             else:
                 print("Commit threshold not satisfied; aborting the tx.")
-                finalize(current_tx, commit=False)
-            current_tx = None
+                finalize(txid, commit=False)
+            current_tx.pop(shard, None)
 
         elif cmd.startswith("prepare to "):
             parts = cmd.split()
-            if len(parts) != 4 or parts[2] not in members:
-                print("Usage: prepare to <PID> yes|no")
+            if len(parts) not in (4, 5) or parts[2] not in members:
+                print("Usage: prepare to <PID> yes|no [shard]")
                 continue
             if byzantine_id != id_:
                 print("× Only the Byzantine node can send targeted votes"); continue
-            if not pending_prepare_tx:
-                print("× No pending tx to vote on"); continue
+            shard, err = pbft_shard.pick(parts[4] if len(parts) > 4 else None, {s for s, t in pending_prepare_tx.items() if t})
+            txid = None if err else pending_prepare_tx.get(shard)
+            if not txid:
+                print(err or "× No pending tx to vote on"); continue
             pid = parts[2]; choice = parts[3].lower()
             vote = "VOTE_YES" if choice in ("yes","y") else "VOTE_NO"
             h,p = members[pid]
-            json_send(h,p,{"type":"PREPARE","from":id_,"txid":pending_prepare_tx,"vote":vote})
+            trace_id = tx_log.get(txid, {}).get("trace_id")
+            t0 = time.time()
+            pbft_linear.send(h,p,{"type":"PREPARE","from":id_,"view":view,"txid":txid,"vote":vote,"trace_id":trace_id})
+            pbft_trace.span(trace_id, txid, "vote", start=t0, phase="prepare", vote=vote, to=pid)
             print(f"✓ Targeted PREPARE sent to {pid}: {vote}")
 
         elif cmd.startswith("ack to "):
             parts = cmd.split()
-            if len(parts) != 4 or parts[2] not in members:
-                print("Usage: ack to <PID> commit|abort")
+            if len(parts) not in (4, 5) or parts[2] not in members:
+                print("Usage: ack to <PID> commit|abort [shard]")
                 continue
             if byzantine_id != id_:
                 print("× Only the Byzantine node can send targeted acks"); continue
-            txid = None
-            if tx_log: txid = list(tx_log.keys())[-1]
-            if not txid: print("× No tx to ack"); continue
+            txid, err = latest_in_shard(parts[4] if len(parts) > 4 else None)
+            if not txid: print(err or "× No tx to ack"); continue
             pid = parts[2]; choice = parts[3].lower()
             ack = "ACK_COMMIT" if choice == "commit" else "ACK_ABORT"
             h,p = members[pid]
-            json_send(h,p,{"type":"COMMIT_VOTE","from":id_,"txid":txid,"ack":ack})
+            trace_id = tx_log[txid].get("trace_id")
+            t0 = time.time()
+            pbft_linear.send(h,p,{"type":"COMMIT_VOTE","from":id_,"view":view,"txid":txid,"ack":ack,"trace_id":trace_id})
+            pbft_trace.span(trace_id, txid, "vote", start=t0, phase="commit", vote=ack, to=pid)
             print(f"✓ Targeted COMMIT_VOTE sent to {pid}: {ack}")
 
         elif cmd.startswith("prepare "):
-            if not pending_prepare_tx:
-                print("× No pending tx to vote on (PRE_PREPARE not received yet)")
+            parts = cmd.split()
+            shard, err = pbft_shard.pick(parts[2] if len(parts) > 2 else None, {s for s, t in pending_prepare_tx.items() if t})
+            txid = None if err else pending_prepare_tx.get(shard)
+            if not txid:
+                print(err or "× No pending tx to vote on (PRE_PREPARE not received yet)")
             else:
-                choice = cmd.split()[-1].lower()
+                choice = parts[1].lower()
                 vote = "VOTE_YES" if choice in ("yes","y") else "VOTE_NO"
-                self_prepare_vote[pending_prepare_tx] = vote
-                for pid,(h,p) in members.items():
-                    if pid == id_:
-                        continue
-                    json_send(h,p,{"type":"PREPARE","from":id_,"txid":pending_prepare_tx,"vote":vote})
-                print(f"✓ PREPARE broadcast: {vote} (tx={pending_prepare_tx})")
-                pending_prepare_tx = None
+                broadcast_prepare(txid, vote)
+                print(f"✓ PREPARE broadcast: {vote} (tx={txid})")
+                pending_prepare_tx.pop(shard, None)
 
         elif cmd.startswith("ack "):
-            choice = cmd.split()[-1].lower()
+            parts = cmd.split()
+            choice = parts[1].lower()
             ack = "ACK_COMMIT" if choice == "commit" else "ACK_ABORT"
-            txid = None
-            if tx_log: txid = list(tx_log.keys())[-1]
+            txid, err = latest_in_shard(parts[2] if len(parts) > 2 else None)
             if not txid:
-                print("× No tx to ack")
+                print(err or "× No tx to ack")
             else:
-                self_commit_vote[txid] = ack
-                for pid,(h,p) in members.items():
-                    if pid == id_:
-                        continue
-                    json_send(h,p,{"type":"COMMIT_VOTE","from":id_,"txid":txid,"ack":ack})
-                if ack == "ACK_ABORT":
-                    state_data.pop(txid, None)
+                broadcast_commit_vote(txid, ack)
                 print("✓ Broadcast", ack)
 
+        elif cmd.startswith("view change "):
+            shard, err = pbft_shard.pick(cmd.split()[2], ())
+            if pbft_shard.num_shards == 1:
+                print("× Only one shard; use 'view change'")
+            elif err:
+                print(err)
+            else:
+                request_shard_view_change(shard)
+
         elif cmd == "crash":
             crashed = True; print("! Node crashes (will ignore incoming messages)")
 
@@ -663,38 +1619,135 @@ def repl():
                 json_send(h,p,{"type":"VIEW_CHANGE","from":id_})
             json_send(DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT, {"type":"VIEW_CHANGE","from":id_})
 
-        elif cmd == "checkpoint":
-            if current_primary == id_:
+        elif cmd == "checkpoint" or cmd.startswith("checkpoint "):
+            parts = cmd.split()
+            shard = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+            leader = current_primary if shard is None else pbft_shard.shard_leader(ids_sorted(), current_primary, shard)
+            if leader == id_:
                 cid = time.strftime("%Y%m%d_%H%M%S")
-                expected = len(members)
+                if shard is not None:
+                    cid = f"s{shard}_{cid}"
+                f, _ = compute_f_and_quorum()
+                expected = 2*f+1
                 checkpoint_expected[cid] = expected
                 checkpoint_reports[cid] = {}
-                text = snapshot_text()
+                text = snapshot_text(shard)
                 print("\n" + text)
                 write_local_checkpoint_file(text)
                 checkpoint_reports[cid][id_] = text
                 for pid,(h,p) in members.items():
                     if pid == id_:
                         continue
-                    json_send(h,p,{"type":"CHECKPOINT_REQUEST","checkpoint_id": cid,
+                    json_send(h,p,{"type":"CHECKPOINT_REQUEST","checkpoint_id": cid, "shard": shard,
                                    "collector_host": HOST, "collector_port": port})
-                print(f"→ Started distributed checkpoint (expecting {expected} reports)")
+                threading.Timer(pbft_checkpoint.TIMEOUT, expire_checkpoint, args=(cid,)).start()
+                print(f"→ Started distributed checkpoint (done at {expected} of {len(members)} reports)")
+                if expected <= 1:
+                    assemble_checkpoint(cid)
             else:
-                text = snapshot_text()
+                text = snapshot_text(shard)
                 print("\n" + text)
                 write_local_checkpoint_file(text)
 
+        elif cmd.startswith("misbehave slow"):
+            if byzantine_id != id_:
+                print("× Only the Byzantine node can misbehave"); continue
+            parts = cmd.split()
+            slow_leader = (int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 200) / 1000.0
+            print(f"✓ Slow leader: every PRE_PREPARE held back {slow_leader * 1000:.0f} ms while I lead")
+        elif cmd.startswith("misbehave "):
+            if byzantine_id != id_:
+                print("× Only the Byzantine node can misbehave"); continue
+            misbehave = cmd.split()[-1].lower() == "on"
+            pbft_spec.lie = misbehave
+            if not misbehave:
+                slow_leader = 0.0
+            print(f"✓ Byzantine misbehaviour {'on' if misbehave else 'off'} (auto votes / speculative digests)")
+
+        elif cmd == "profile dump":
+            if pbft_profile.enabled:
+                pbft_profile.dump()
+            else:
+                print("× Profiling is off; start the node with --profile[=HZ]")
+
         elif cmd == "quit":
+            if pbft_profile.enabled:
+                pbft_profile.dump()
             print("Bye!"); time.sleep(0.2); break
 
         else:
             print("Unknown command")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python pbft_node.py <ID> <PORT>")
+    args, flags = split_flags(sys.argv[1:])
+    if flags.get("config"):
+        pbft_config.load(flags["config"])
+        if len(args) == 1 and args[0] in pbft_config.nodes:
+            args.append(pbft_config.nodes[args[0]][1])
+    bad = bad_flag(flags, NUMERIC_FLAGS)
+    if bad:
+        print(f"× Invalid value for --{bad}")
+    if len(args) != 2 or not str(args[1]).isdigit() or bad:
+        print("Usage: python pbft_node.py <ID> <PORT> [--config=<file>] [--join[=HOST:PORT]] [--trace[=<file>]] [--profile[=HZ]] [--shards=K] [--workers=N] [--tentative] [--auto] [--speculative] [--linear] [--tree[=K]] [--slo=MS] [--checkpoint[=K]] [--exec-workers=N] [--admit[=QUEUE]] [--client-rate=R] [--monitor[=SECONDS]] [--rotate=SECONDS] [--record[=<file>]] [--udp[=multicast|GROUP:PORT]] [--udp-loss=P] [--sync-codec=auto|none|zlib|lzma]")
         sys.exit(1)
-    id_ = sys.argv[1]
-    port = int(sys.argv[2])
-    threading.Thread(target=server, daemon=True).start()
+    id_ = args[0]
+    port = int(args[1])
+    if pbft_config.loaded():
+        HOST = pbft_config.nodes.get(id_, (HOST, port))[0]
+        DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT = pbft_config.nodes["P0"]
+        primary_host, primary_port = DEFAULT_PRIMARY_HOST, DEFAULT_PRIMARY_PORT
+        if not flags.get("join"):
+            members.clear(); members.update(pbft_config.members())
+        byzantine_id = pbft_config.byzantine
+    if flags.get("join"):
+        h, _, p = ("" if flags["join"] is True else flags["join"]).partition(":")
+        join_via = (h or DEFAULT_PRIMARY_HOST, int(p) if p else DEFAULT_PRIMARY_PORT)
+    if flags.get("trace"):
+        path = pbft_trace.enable(id_, None if flags["trace"] is True else flags["trace"])
+        print(f"✓ Tracing enabled: {path}")
+    if flags.get("record"):
+        path = pbft_workload.enable(id_, None if flags["record"] is True else flags["record"])
+        print(f"✓ Recording client requests: {path}")
+    workers = int(flags.get("workers", 0))
+    tentative_mode = bool(flags.get("tentative"))
+    auto_mode = bool(flags.get("auto"))
+    pbft_spec.enabled = bool(flags.get("speculative"))
+    pbft_linear.enabled = bool(flags.get("linear"))
+    udp_mode = flags.get("udp")
+    udp_loss = float(flags.get("udp-loss", 0))
+    if udp_mode:
+        print(f"✓ Votes over UDP ({'unicast' if udp_mode is True else 'multicast ' + str(udp_mode)})"
+              + (f", dropping {udp_loss:g} of datagrams" if udp_loss else ""))
+    if flags.get("tree"):
+        pbft_dissem.configure(2 if flags["tree"] is True else flags["tree"])
+        print(f"✓ Tree dissemination of payloads (fan-out {pbft_dissem.fanout})")
+    if flags.get("shards"):
+        pbft_shard.configure(flags["shards"])
+        print(f"✓ Sharded consensus: {pbft_shard.num_shards} groups by account")
+    if flags.get("slo"):
+        pbft_batch.configure(50 if flags["slo"] is True else flags["slo"], start_batch_ordered)
+        print(f"✓ Adaptive batching (latency SLO {pbft_batch.slo * 1000:.0f} ms); leader batches CLIENT_TX in --auto")
+    if flags.get("admit"):
+        pbft_admit.configure(16 if flags["admit"] is True else flags["admit"], flags.get("client-rate"), send_flow)
+        print(f"✓ Admission control: queue {pbft_admit.capacity}, {pbft_admit.RATE:g} req/s per client, "
+              f"at most {pbft_admit.MAX_THREADS} connection threads")
+    if flags.get("exec-workers"):
+        pbft_exec.configure(4 if flags["exec-workers"] is True else flags["exec-workers"])
+        print(f"✓ Parallel execution of large batches on {pbft_exec.workers} workers")
+    if flags.get("checkpoint"):
+        pbft_checkpoint.configure(16 if flags["checkpoint"] is True else flags["checkpoint"], on_stable_checkpoint)
+        print(f"✓ Automatic checkpoints every {pbft_checkpoint.interval} seqs (stable at 2f+1 matching digests)")
+    if flags.get("sync-codec") in ("auto", "none", "zlib", "lzma"):
+        pbft_sync.codec = flags["sync-codec"]
+    if flags.get("monitor") or flags.get("rotate"):
+        pbft_monitor.configure(flags.get("monitor"), flags.get("rotate"), current_primary == id_, demand_view_change)
+        if pbft_monitor.timeout:
+            print(f"✓ Leader monitor: view change after a {pbft_monitor.timeout:g}s ordering wait or "
+                  f"throughput under {pbft_monitor.RATIO:g}x baseline")
+        if pbft_monitor.rotate:
+            print(f"✓ Leaders rotate every {pbft_monitor.rotate:g}s")
+    if flags.get("profile"):
+        pbft_profile.start(id_, 100 if flags["profile"] is True else int(flags["profile"]))
+        print(f"✓ Profiling enabled ({pbft_profile.hz} Hz); 'profile dump' or quit writes profiles/")
+    threading.Thread(target=server, name="server", daemon=True).start()
     repl()
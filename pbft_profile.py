@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Sampling profiler for a node process (--profile[=HZ]).
+#
+# A daemon thread samples the Python stacks of every other thread (REPL,
+# json_server accept loop and per-connection handlers) HZ times per second.
+# dump() writes the samples in collapsed-stack format, one
+# "thread;frame;frame... count" line per distinct stack, which flamegraph.pl
+# or speedscope read directly.  wrap() additionally attributes CPU time
+# (time.thread_time) of on_msg to each message type.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+enabled = False
+node_id = None
+hz = 100
+samples = Counter()          # collapsed stack -> count
+msg_cpu = {}                 # msg type -> [count, cpu seconds, wall seconds]
+_lock = threading.Lock()
+_started_at = None
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _thread_label(t):
+    if t is None:
+        return "unknown"
+    if t is threading.main_thread():
+        return "repl"
+    return t.name
+
+def _sampler():
+    me = threading.get_ident()
+    interval = 1.0 / hz
+    while enabled:
+        threads = {t.ident: t for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(_thread_label(threads.get(ident)))
+            key = ";".join(reversed(stack))
+            with _lock:
+                samples[key] += 1
+        time.sleep(interval)
+
+def start(nid, rate=100):
+    global enabled, node_id, hz, _started_at
+    node_id = nid
+    hz = max(1, int(rate))
+    enabled = True
+    _started_at = time.time()
+    threading.Thread(target=_sampler, name="profiler", daemon=True).start()
+
+def wrap(handler):
+    if not enabled:
+        return handler
+
+    def _timed(msg, addr):
+        c0 = time.thread_time(); w0 = time.perf_counter()
+        try:
+            return handler(msg, addr)
+        finally:
+            cpu = time.thread_time() - c0; wall = time.perf_counter() - w0
+            t = msg.get("type", "?") if isinstance(msg, dict) else "?"
+            with _lock:
+                rec = msg_cpu.setdefault(t, [0, 0.0, 0.0])
+                rec[0] += 1; rec[1] += cpu; rec[2] += wall
+    return _timed
+
+def report_lines(top=10):
+    with _lock:
+        snap = Counter(samples)
+        per_type = {k: list(v) for k, v in msg_cpu.items()}
+    total = sum(snap.values()) or 1
+    lines = [f"Profile of {node_id}: {sum(snap.values())} samples @ {hz} Hz over "
+             f"{time.time() - (_started_at or time.time()):.1f}s"]
+    if per_type:
+        lines.append("on_msg CPU by message type:")
+        lines.append(f"  {'type':<20} {'count':>7} {'cpu ms':>10} {'wall ms':>10} {'cpu/msg us':>11}")
+        for t, (n, cpu, wall) in sorted(per_type.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"  {t:<20} {n:>7} {cpu*1000:>10.1f} {wall*1000:>10.1f} {cpu/n*1e6:>11.1f}")
+    leaf = Counter()
+    for stack, n in snap.items():
+        leaf[stack.rsplit(";", 1)[-1]] += n
+    lines.append(f"Top {top} leaf frames:")
+    for frame, n in leaf.most_common(top):
+        lines.append(f"  {100.0*n/total:5.1f}%  {frame}")
+    return lines
+
+def dump(path=None):
+    if path is None:
+        os.makedirs("profiles", exist_ok=True)
+        path = os.path.join("profiles", f"{node_id}_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+    with _lock:
+        snap = list(samples.items())
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, n in sorted(snap):
+            f.write(f"{stack} {n}\n")
+    for line in report_lines():
+        print(line)
+    print(f"✓ Collapsed stacks written: {path}")
+    return path
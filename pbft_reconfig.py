@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Membership changes as ordered consensus operations.
+#
+# Adding or removing a replica is an ordinary instance whose data is
+#   {"operation": "reconfig", "action": "add"|"remove", "id", "host", "port"}
+# proposed by the leader (operator command 'reconfig', or a JOIN_REQUEST from
+# a node started with --join). It is ordered, voted on and committed like any
+# request, so client requests keep flowing around it.
+#
+# When the change commits at seq s, each node immediately switches the set it
+# sends to. A joiner therefore receives new PRE_PREPAREs and votes, and a
+# removed node no longer does. The leader then sends the joiner a state
+# transfer. Quorums switch later, at seq s + WINDOW: instances already in
+# flight when the change committed are still decided by the membership that
+# ordered them. at(seq) is the voting membership for an instance, and votes
+# from anyone outside it are not counted. Seqs are per shard and nothing
+# orders one shard's seqs against another's, so s + WINDOW is no common point
+# with --shards=K>1: membership changes are refused there. The window only
+# holds while no more than WINDOW instances are in flight, and only the --slo
+# batcher caps that, so changes are refused without --slo as well.
+import threading
+
+import pbft_batch
+import pbft_shard
+
+WINDOW = pbft_batch.MAX_INFLIGHT    # the most instances in flight at once
+MIN_MEMBERS = 4             # 3f+1 with f=1: never shrink below one tolerated fault
+
+epochs = []                 # [(effective seq, members before, members after)], by effective seq
+_lock = threading.Lock()
+
+def is_reconfig(data):
+    return str((data or {}).get("operation", "")).lower() == "reconfig"
+
+def op(action, pid, host=None, port=None):
+    data = {"operation": "reconfig", "action": action, "id": pid}
+    if action == "add":
+        data.update({"host": host, "port": str(port)})
+    return data
+
+def check(data, members, leader):
+    # -> an error message, or None if the change can be ordered now
+    action, pid = str(data.get("action", "")).lower(), data.get("id")
+    if pbft_shard.num_shards > 1:
+        return f"× reconfig needs a single shard (running with --shards={pbft_shard.num_shards})"
+    if not pbft_batch.enabled:
+        return f"× reconfig needs --slo: only its batcher keeps at most {WINDOW} instances in flight"
+    if action == "add":
+        if not pid or pid in members:
+            return f"× Cannot add {pid}: already a member"
+        try:
+            int(str(data.get("port")))
+        except Exception:
+            return "× reconfig add needs a host and an integer port"
+        return None if data.get("host") else "× reconfig add needs a host and an integer port"
+    if action == "remove":
+        if pid not in members:
+            return f"× Cannot remove {pid}: not a member"
+        if pid in ("P0", leader):
+            return f"× Cannot remove {pid}: it is P0 or the current leader (change view first)"
+        if len(members) - 1 < MIN_MEMBERS:
+            return f"× Cannot remove {pid}: fewer than {MIN_MEMBERS} members would remain"
+        return None
+    return "× reconfig action must be 'add' or 'remove'"
+
+def schedule(seq, members, data):
+    # a change committed at seq: -> (effective seq, members after)
+    after = dict(members)
+    if str(data.get("action")).lower() == "add":
+        after[data["id"]] = (data["host"], int(str(data["port"])))
+    else:
+        after.pop(data["id"], None)
+    eff = (seq or 0) + WINDOW
+    with _lock:
+        epochs.append((eff, dict(members), after))
+        epochs.sort(key=lambda e: e[0])
+    return eff, after
+
+def at(seq):
+    # the voting membership for an instance at seq, or None for the current one
+    if seq is None:
+        return None
+    with _lock:
+        for eff, before, _ in epochs:
+            if seq < eff:
+                return before
+    return None
+
+def snapshot():
+    with _lock:
+        return [[eff, before, after] for eff, before, after in epochs]
+
+def load(incoming):
+    if not isinstance(incoming, list):
+        return
+    with _lock:
+        epochs[:] = [(int(e[0]), {k: tuple(v) for k, v in e[1].items()}, {k: tuple(v) for k, v in e[2].items()})
+                     for e in incoming]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Request parsing shared by the nodes, the client and the tooling.
+#
+# A client request travels as "key=value,..." text (CLIENT_TX data) and is
+# ordered as a dict. An ordered instance holds one request, or, when the
+# --slo batcher cut it, {"operation": "batch", "ops": [...]}. ops_of gives the
+# requests of either form, and key_of names one request for bookkeeping that
+# must recognise it again (admission, monitoring, workload replay).
+
+def parse_kv(s):
+    # "account=alice,amount=1,..." -> dict
+    out = {}
+    for pair in str(s).split(","):
+        if "=" in pair:
+            k, v = pair.split("=", 1)
+            out[k.strip()] = v.strip()
+    return out
+
+def ops_of(data):
+    # the requests an ordered instance carries
+    data = data or {}
+    if str(data.get("operation", "")).lower() == "batch":
+        return list(data.get("ops") or [])
+    return [data]
+
+def key_of(op):
+    # a hashable identity for one request op
+    return tuple(sorted((str(k), str(v)) for k, v in (op or {}).items()))
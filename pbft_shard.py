@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Account-sharded consensus groups (--shards=K).
+#
+# Operations on different accounts never conflict, so each tx is ordered in
+# shard crc32(account) % K.  Every shard has its own sequence space, its own
+# instance in progress on each node, and its own leader: shard s is led by the
+# member s (+ its rotations) positions after the current primary, so the K
+# leaders are spread over the nodes. A view change moves them all; a shard
+# view change ('view change <s>') replaces only shard s's leader and leaves
+# the others ordering. All shards share the same json_send/json_server
+# transport.
+import threading
+import zlib
+
+num_shards = 1
+seqs = {}                    # shard -> highest seq seen/assigned
+rotations = {}               # shard -> leader moves made by shard view changes
+_lock = threading.Lock()
+
+def configure(k):
+    global num_shards
+    num_shards = max(1, int(k))
+
+def shard_of(account):
+    if num_shards == 1 or not account:
+        return 0
+    return zlib.crc32(str(account).encode("utf-8")) % num_shards
+
+def shard_leader(ids, primary, shard):
+    if primary not in ids:
+        return primary
+    return ids[(ids.index(primary) + shard + rotations.get(shard, 0)) % len(ids)]
+
+def next_shard_leader(ids, primary, shard):
+    # who takes over shard after its next shard view change
+    if primary not in ids:
+        return primary
+    return ids[(ids.index(primary) + shard + rotations.get(shard, 0) + 1) % len(ids)]
+
+def rotate(shard, rotation):
+    # NEW_VIEW for one shard; rotation is the count after the change (never goes back)
+    with _lock:
+        if rotation <= rotations.get(shard, 0):
+            return False
+        rotations[shard] = rotation
+        return True
+
+def led_shards(ids, primary, node):
+    return [s for s in range(num_shards) if shard_leader(ids, primary, s) == node]
+
+def next_seq(shard):
+    with _lock:
+        seqs[shard] = seqs.get(shard, 0) + 1
+        return seqs[shard]
+
+def observe_seq(shard, seq):
+    if seq is None:
+        return
+    with _lock:
+        if seq > seqs.get(shard, 0):
+            seqs[shard] = seq
+
+def shard_of_tx(info, txid=None):
+    # the shard of an instance: from its log entry, else from its txid (view.shard.seq)
+    if "shard" in (info or {}):
+        return info["shard"]
+    parts = str(txid or "").split(".")
+    return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+
+def pick(arg, busy):
+    # a console command's shard: the one given, the only shard, or the only busy one
+    # -> (shard, None) or (None, error)
+    if arg is not None:
+        if not str(arg).isdigit() or int(arg) >= num_shards:
+            return None, f"× No shard {arg} (shards 0..{num_shards - 1})"
+        return int(arg), None
+    if num_shards == 1:
+        return 0, None
+    busy = sorted(busy)
+    if len(busy) == 1:
+        return busy[0], None
+    if not busy:
+        return None, "× Nothing pending in any shard"
+    return None, f"× Shards {', '.join(map(str, busy))} are busy; add the shard number to the command"
+
+def label(info):
+    if num_shards == 1 or "shard" not in info:
+        return ""
+    return f"[s{info['shard']}#{info.get('seq')}] "
+
+def summary(ids, primary):
+    parts = []
+    for s in range(num_shards):
+        parts.append(f"s{s}:{shard_leader(ids, primary, s)}(seq {seqs.get(s, 0)})")
+    return f"Shards: {num_shards} - " + ", ".join(parts)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Zyzzyva-style speculative execution (--speculative).
+#
+# The leader orders a request by sending PRE_PREPARE with the history digest
+# obtained by appending it to its speculative history. A replica appends the
+# same request, in sequence order, to its own history and compares the
+# digests. If they match it executes at once and answers the client with
+# SPEC_REPLY. Replicas do not exchange votes. The client completes on 3f+1
+# matching SPEC_REPLYs and tells the replicas with SPEC_COMMIT. Otherwise it
+# sends SPEC_FALLBACK and the tx finishes through the normal
+# PREPARE/COMMIT_VOTE exchange.
+#
+# On a digest mismatch the replica's history stops at that request: later
+# ones are held, not checked against a history that lacks it. Once the slow
+# path decides it (committed or aborted, as the leader's history has it
+# either way), decided() extends the history with it in the committed order
+# and releases the requests held behind it.
+#
+# Histories and sequence numbers are kept per shard (see pbft_shard).
+import hashlib
+import json
+import threading
+
+enabled = False
+lie = False                 # Byzantine misbehaviour: report a corrupted digest
+histories = {}              # shard -> digest of everything executed speculatively
+applied = {}                # shard -> last seq appended to the history
+_held = {}                  # (shard, seq) -> (txid, data, leader digest), arrived early
+_stuck = {}                 # shard -> (seq, txid, data) that mismatched, until the slow path decides it
+_lock = threading.Lock()
+
+GENESIS = "0" * 16
+
+def extend(digest, txid, data):
+    h = hashlib.sha256()
+    h.update(digest.encode("utf-8"))
+    h.update(str(txid).encode("utf-8"))
+    h.update(json.dumps(data, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def order(shard, seq, txid, data):
+    # leader: append to the history and return the digest to send
+    with _lock:
+        d = extend(histories.get(shard, GENESIS), txid, data)
+        histories[shard] = d
+        if seq is not None:
+            applied[shard] = seq
+        return d
+
+def deliver(shard, seq, txid, data, leader_digest):
+    # replica: returns [(txid, digest or None on mismatch)] for every request
+    # that is now next in sequence order; early arrivals are held back
+    ready = []
+    with _lock:
+        if seq is None:
+            _held[(shard, None)] = (txid, data, leader_digest)
+            nxt = None
+        else:
+            _held[(shard, seq)] = (txid, data, leader_digest)
+            nxt = applied.get(shard, 0) + 1
+        _drain(shard, nxt, ready)
+    return ready
+
+def _drain(shard, nxt, ready):
+    # under _lock: check held requests from nxt on, until a gap or a mismatch
+    while shard not in _stuck and (shard, nxt) in _held:
+        tid, d, want = _held.pop((shard, nxt))
+        mine = extend(histories.get(shard, GENESIS), tid, d)
+        if mine == want:
+            histories[shard] = mine
+            ready.append((tid, mine))
+        else:
+            ready.append((tid, None))
+            if nxt is not None:
+                _stuck[shard] = (nxt, tid, d)
+                break
+        if nxt is None:
+            break
+        applied[shard] = nxt
+        nxt += 1
+
+def decided(txid):
+    # the slow path decided txid: -> as deliver, for the requests it released
+    ready = []
+    with _lock:
+        for shard, (seq, tid, d) in list(_stuck.items()):
+            if tid == txid:
+                del _stuck[shard]
+                histories[shard] = extend(histories.get(shard, GENESIS), tid, d)
+                applied[shard] = seq
+                _drain(shard, seq + 1, ready)
+    return ready
+
+def reported(digest):
+    return ("bad" + digest)[:16] if lie else digest
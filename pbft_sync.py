@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+# Chunked, compressed and resumable state transfer.
+#
+# The committed prefix of a shard up to its stable checkpoint (pbft_checkpoint)
+# is the same on every correct replica, so it can be fetched from all of them
+# at once. A replica turns it into a snapshot: canonical JSON
+#   {"shard", "seq", "txs": [[seq, txid, data], ...], "balances": {...}}
+# cut into CHUNK_SIZE pieces, each named by its SHA-256 (content-addressed).
+# The snapshot's checkpoint digest (pbft_checkpoint.state_of over its ops and
+# the executed balances of its checkpoint) must equal the stable digest, or
+# the replica does not offer or serve it.
+#
+# The leader's CHECKPOINT_SYNC then carries a manifest per shard ("snapshots":
+# shard, seq, digest, chunk ids and sizes) instead of the checkpointed part of
+# tx_log; the rest of tx_log (the tail) and the metadata still come inline.
+# The receiver:
+#   - asks every member whether it has the snapshot (STATE_CHUNK_REQUEST with
+#     no ids -> STATE_HAVE), and fetches chunks from the leader and every
+#     member that says yes, WINDOW requests in flight per source;
+#   - checks each STATE_CHUNK against its id and stores it under
+#     sync/<id>/<shard>_<seq>_<digest>/, so a transfer interrupted by a timeout, a
+#     crash or a restart resumes with the chunks already on disk;
+#   - gives a request that is not answered within CHUNK_TIMEOUT to another
+#     source, and drops a source that sends a chunk that does not match;
+#   - once every chunk is in and f+1 replicas (the leader included) vouched
+#     for the digest, rebuilds the snapshot, recomputes the checkpoint digest
+#     and installs snapshot + tail only if it matches. If it does not, the
+#     manifest itself was bad (every chunk matched its id), so more sources
+#     would not help: the transfer is dropped and the node asks another member
+#     for its full state in one CHECKPOINT_SYNC (fallback).
+# Chunks are compressed when that pays off; --sync-codec=auto picks by the
+# snapshot's size (none under RAW_BELOW, lzma under LZMA_BELOW, zlib above,
+# where lzma would be slower than the network). none|zlib|lzma force a codec.
+import base64
+import collections
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import threading
+import time
+import zlib
+
+import pbft_checkpoint
+from pbft_utils import json_send
+
+CHUNK_SIZE = 64 * 1024
+WINDOW = 4                  # chunk requests in flight per source
+CHUNK_TIMEOUT = 2.0         # seconds before a request goes to another source
+STALL = 30.0                # no chunk for this long: give up (chunks on disk stay for the next try)
+RAW_BELOW = 512
+LZMA_BELOW = 256 * 1024
+codec = "auto"
+stats = {"served": 0, "served_bytes": 0, "fetched": 0, "fetched_bytes": 0, "resumed": 0}
+_snapshots = collections.OrderedDict()     # (shard, seq) -> {"digest", "ids", "chunks": {id: raw}, "size"}
+_fetches = {}                              # (shard, seq, digest) -> Fetch
+_lock = threading.Lock()
+
+def chunk_id(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+def build(shard, seq, entries, balances):
+    # entries [(seq, txid, data)] committed, in seq order, and the balances
+    # they executed to -> (body bytes, checkpoint digest)
+    body = json.dumps({"shard": shard, "seq": seq, "txs": entries, "balances": balances},
+                      sort_keys=True, separators=(",", ":"))
+    _, digest = pbft_checkpoint.state_of([(s, d) for s, _, d in entries], balances)
+    return body.encode("utf-8"), digest
+
+def prepare(shard, seq, digest, entries, balances):
+    # our own checkpoint at seq just became stable with this digest, so there
+    # is nothing to check: cut the snapshot now, off the recovery path
+    body = json.dumps({"shard": shard, "seq": seq, "txs": entries, "balances": balances},
+                      sort_keys=True, separators=(",", ":"))
+    _store(shard, seq, digest, body.encode("utf-8"))
+
+def snapshot(shard, seq, digest, entries_of):
+    # -> our snapshot of (shard, seq), built once; None if its digest is not `digest`
+    with _lock:
+        snap = _snapshots.get((shard, seq))
+    if snap is None or snap["digest"] != digest:
+        balances = pbft_checkpoint.balances_at(shard, seq)
+        if balances is None:
+            return None     # no checkpoint of ours at seq (yet)
+        body, mine = build(shard, seq, entries_of(shard, seq), balances)
+        if mine != digest:
+            return None     # we lag behind seq or diverged; maybe later
+        snap = _store(shard, seq, digest, body)
+    return snap
+
+def _store(shard, seq, digest, body):
+    pieces = [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)] or [b""]
+    snap = {"digest": digest, "ids": [chunk_id(p) for p in pieces], "size": len(body),
+            "chunks": {chunk_id(p): p for p in pieces}}
+    with _lock:
+        _snapshots[(shard, seq)] = snap
+        while len(_snapshots) > 4:
+            _snapshots.popitem(last=False)
+    return snap
+
+def offer(shard, seq, digest, entries_of):
+    # the manifest the leader puts in CHECKPOINT_SYNC, or None
+    snap = snapshot(shard, seq, digest, entries_of)
+    if snap is None:
+        return None
+    return {"shard": shard, "seq": seq, "digest": digest, "size": snap["size"],
+            "chunks": [[cid, len(snap["chunks"][cid])] for cid in snap["ids"]]}
+
+def _pick(size):
+    if codec != "auto":
+        return codec
+    if size < RAW_BELOW:
+        return "none"
+    return "lzma" if size < LZMA_BELOW else "zlib"
+
+def encode(raw, size):
+    name = _pick(size)
+    if name == "lzma":
+        packed = lzma.compress(raw, preset=1)
+    elif name == "zlib":
+        packed = zlib.compress(raw, 6)
+    else:
+        return "none", raw
+    return (name, packed) if len(packed) < len(raw) else ("none", raw)
+
+def decode(name, packed):
+    if name == "lzma":
+        return lzma.decompress(packed)
+    if name == "zlib":
+        return zlib.decompress(packed)
+    return packed
+
+def serve(msg, me, entries_of):
+    # STATE_CHUNK_REQUEST: no ids -> STATE_HAVE; otherwise one STATE_CHUNK per id
+    shard, seq, digest = msg.get("shard", 0), msg.get("seq"), msg.get("digest")
+    dest = (msg.get("host"), msg.get("port"))
+    try:
+        snap = snapshot(shard, seq, digest, entries_of)
+    except Exception:
+        snap = None         # we do not have every instance up to seq
+    base = {"shard": shard, "seq": seq, "digest": digest, "from": me}
+    try:
+        if not msg.get("ids"):
+            json_send(dest[0], dest[1], dict(base, type="STATE_HAVE", have=snap is not None))
+            return
+        for cid in msg["ids"]:
+            raw = snap["chunks"].get(cid) if snap else None
+            if raw is None:
+                json_send(dest[0], dest[1], dict(base, type="STATE_CHUNK", id=cid, missing=True))
+                continue
+            name, packed = encode(raw, snap["size"])
+            n = json_send(dest[0], dest[1], dict(base, type="STATE_CHUNK", id=cid, codec=name,
+                                                 data=base64.b64encode(packed).decode("ascii")))
+            with _lock:
+                stats["served"] += 1
+                stats["served_bytes"] += n
+    except OSError:
+        pass
+
+class Fetch:
+    # one snapshot being downloaded
+    def __init__(self, manifest, leader, sources, me, addr, need):
+        self.shard, self.seq, self.digest = manifest["shard"], manifest["seq"], manifest["digest"]
+        self.ids = [cid for cid, _ in manifest["chunks"]]
+        self.size = manifest.get("size", 0)
+        self.me, self.addr, self.need = me, addr, need
+        self.sources = dict(sources)            # id -> (host, port), every member but us
+        self.ready = [leader] if leader in self.sources else []
+        self.vouched = {leader}
+        self.strikes = collections.Counter()
+        self.dir = os.path.join("sync", me, f"{self.shard}_{self.seq}_{self.digest[:16]}")
+        self.todo = collections.deque()
+        self.inflight = {}                      # id -> (source, sent at)
+        self.last = time.time()
+        self.done = False
+        self.failed = False
+        self.t0 = time.time()
+        self.lock = threading.Lock()
+        self.on_complete = None
+        os.makedirs(self.dir, exist_ok=True)
+        for cid in self.ids:
+            if cid not in self.todo and not self._on_disk(cid):
+                self.todo.append(cid)
+        self.resumed = len(self.ids) - len(self.todo)
+
+    def _on_disk(self, cid):
+        try:
+            with open(os.path.join(self.dir, cid), "rb") as f:
+                return chunk_id(f.read()) == cid
+        except OSError:
+            return False
+
+    def _request(self, source, body):
+        h, p = self.sources[source]
+        try:
+            json_send(h, p, dict(body, type="STATE_CHUNK_REQUEST", shard=self.shard, seq=self.seq,
+                                 digest=self.digest, host=self.addr[0], port=self.addr[1], **{"from": self.me}))
+            return True
+        except OSError:
+            return False
+
+    def start(self):
+        for pid in list(self.sources):
+            if pid not in self.ready:
+                self._request(pid, {"ids": []})
+        self.pump()
+        threading.Thread(target=self._watch, name="sync-watch", daemon=True).start()
+
+    def pump(self):
+        sends = []
+        with self.lock:
+            if self.done or self.failed:
+                return
+            for pid in list(self.ready):
+                busy = sum(1 for s, _ in self.inflight.values() if s == pid)
+                while busy < WINDOW and self.todo:
+                    cid = self.todo.popleft()
+                    self.inflight[cid] = (pid, time.time())
+                    sends.append((pid, cid))
+                    busy += 1
+        for pid, cid in sends:
+            if not self._request(pid, {"ids": [cid]}):
+                self._retry(cid, pid)
+
+    def _retry(self, cid, pid):
+        with self.lock:
+            if self.inflight.pop(cid, None) is not None:
+                self.todo.appendleft(cid)
+            self.strikes[pid] += 1
+            if self.strikes[pid] >= 3 and len(self.ready) > 1 and pid in self.ready:
+                self.ready.remove(pid)
+                print(f"\n! State transfer: dropped {pid} as a chunk source (no answers)")
+
+    def on_have(self, msg):
+        pid = msg.get("from")
+        if msg.get("have") and pid in self.sources:
+            with self.lock:
+                self.vouched.add(pid)
+                if pid not in self.ready:
+                    self.ready.append(pid)
+            self.pump()
+            self._maybe_finish()
+
+    def on_chunk(self, msg):
+        pid, cid = msg.get("from"), msg.get("id")
+        with self.lock:
+            if cid not in self.inflight or self.done:
+                return
+        if msg.get("missing"):
+            self._retry(cid, pid)
+            self.pump()
+            return
+        try:
+            raw = decode(msg.get("codec"), base64.b64decode(msg.get("data") or ""))
+        except Exception:
+            raw = None
+        if raw is None or chunk_id(raw) != cid:
+            print(f"\n× State transfer: chunk {cid[:12]}… from {pid} does not match its id; not using {pid}")
+            with self.lock:
+                self.inflight.pop(cid, None)
+                self.todo.appendleft(cid)
+                self.vouched.discard(pid)
+                if pid in self.ready and len(self.ready) > 1:
+                    self.ready.remove(pid)
+            self.pump()
+            return
+        with open(os.path.join(self.dir, cid), "wb") as f:
+            f.write(raw)
+        with self.lock:
+            self.inflight.pop(cid, None)
+            self.vouched.add(pid)
+            self.last = time.time()
+        with _lock:
+            stats["fetched"] += 1
+            stats["fetched_bytes"] += len(raw)
+        self.pump()
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        with self.lock:
+            if self.done or self.todo or self.inflight or len(self.vouched) < self.need:
+                return
+            self.done = True
+        self.on_complete(self)
+
+    def entries(self):
+        # -> [(shard, seq, txid, data)] after checking the rebuilt snapshot against the digest
+        parts = []
+        for cid in self.ids:
+            with open(os.path.join(self.dir, cid), "rb") as f:
+                parts.append(f.read())
+        body = b"".join(parts)
+        snap = json.loads(body.decode("utf-8"))
+        entries = [tuple(e) for e in snap.get("txs") or []]
+        if build(self.shard, self.seq, [list(e) for e in entries], snap.get("balances") or {})[1] != self.digest:
+            return None
+        return [(self.shard, s, txid, data) for s, txid, data in entries]
+
+    def _watch(self):
+        while True:
+            time.sleep(0.25)
+            with self.lock:
+                if self.done or self.failed:
+                    return
+                now = time.time()
+                late = [(cid, pid) for cid, (pid, t) in self.inflight.items() if now - t > CHUNK_TIMEOUT]
+                stalled = now - self.last > STALL
+                if stalled:
+                    self.failed = True
+            if stalled:
+                print(f"\n× State transfer shard {self.shard} seq {self.seq} stalled "
+                      f"({len(self.ids) - len(self.todo) - len(self.inflight)}/{len(self.ids)} chunks on disk; "
+                      f"'recover' resumes)")
+                return
+            for cid, pid in late:
+                self._retry(cid, pid)
+            if late:
+                self.pump()
+
+def fetch(msg, sources, me, addr, need, install, fallback=None):
+    # msg: CHECKPOINT_SYNC with "snapshots"; install(msg, entries) once every snapshot
+    # checks out, fallback() once if one does not
+    leader = msg.get("current_primary")
+    parts = [Fetch(m, leader, sources, me, addr, need) for m in msg["snapshots"]]
+    left = {"n": len(parts), "entries": [], "failed": False}
+    t0 = time.time()
+
+    def complete(fx):
+        entries = fx.entries()
+        if entries is None:
+            with _lock:
+                first = not left["failed"]
+                left["failed"] = True
+                for other in parts:
+                    other.failed = True
+                    _fetches.pop((other.shard, other.seq, other.digest), None)
+            print(f"\n× State transfer shard {fx.shard} seq {fx.seq}: rebuilt snapshot does not match digest "
+                  f"{fx.digest[:12]}…; discarding its chunks")
+            shutil.rmtree(fx.dir, ignore_errors=True)
+            if first and fallback:
+                fallback()
+            return
+        with _lock:
+            if left["failed"]:
+                return
+            _fetches.pop((fx.shard, fx.seq, fx.digest), None)
+            left["entries"].extend(entries)
+            left["n"] -= 1
+            last = left["n"] == 0
+        shutil.rmtree(fx.dir, ignore_errors=True)
+        print(f"\n✓ Snapshot shard {fx.shard} seq {fx.seq} verified: {len(fx.ids)} chunks "
+              f"({fx.resumed} already on disk), {fx.size / 1024:.1f} KiB from {', '.join(sorted(fx.vouched))} "
+              f"in {time.time() - fx.t0:.2f}s")
+        if last:
+            install(msg, left["entries"])
+            print(f"✓ State transfer done in {time.time() - t0:.2f}s")
+
+    for fx in parts:
+        fx.on_complete = complete
+        with _lock:
+            old = _fetches.get((fx.shard, fx.seq, fx.digest))
+            if old:
+                old.failed = True       # 'recover' again: this transfer takes over
+            _fetches[(fx.shard, fx.seq, fx.digest)] = fx
+            stats["resumed"] += fx.resumed
+        print(f"→ Fetching snapshot shard {fx.shard} seq {fx.seq}: {len(fx.ids)} chunks "
+              f"({fx.size / 1024:.1f} KiB), {fx.resumed} already on disk")
+        fx.start()
+        fx._maybe_finish()
+
+def on_msg(msg):
+    # STATE_HAVE / STATE_CHUNK for a transfer in progress
+    with _lock:
+        fx = _fetches.get((msg.get("shard", 0), msg.get("seq"), msg.get("digest")))
+    if fx is None:
+        return
+    if msg.get("type") == "STATE_HAVE":
+        fx.on_have(msg)
+    else:
+        fx.on_chunk(msg)
+
+def summary():
+    return (f"State transfer: served {stats['served']} chunks ({stats['served_bytes'] / 1024:.1f} KiB sent), "
+            f"fetched {stats['fetched']} ({stats['fetched_bytes'] / 1024:.1f} KiB), "
+            f"{stats['resumed']} resumed from disk, codec {codec}")
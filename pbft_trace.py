@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Optional span tracing for PBFT instances.
+#
+# Every consensus instance gets a trace id (carried as "trace_id" in PRE_PREPARE,
+# PREPARE, COMMIT_VOTE and REPLY).  Each node appends one JSON line per span to
+# traces/<ID>_trace.jsonl.  When tracing is off, span() returns immediately.
+#
+# Merge the per-node files into per-tx timelines:
+#   python pbft_trace.py traces/*.jsonl [--tx=<txid>]
+import json
+import os
+import sys
+import threading
+import time
+from pbft_utils import short_uuid, split_flags
+
+enabled = False
+node_id = None
+_fh = None
+_lock = threading.Lock()
+
+def enable(nid, path=None):
+    global enabled, node_id, _fh
+    node_id = nid
+    path = path or os.path.join("traces", f"{nid}_trace.jsonl")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _fh = open(path, "a", encoding="utf-8")
+    enabled = True
+    return path
+
+def new_trace_id():
+    return short_uuid() if enabled else None
+
+def span(trace_id, txid, name, start=None, **attrs):
+    if not enabled or not trace_id:
+        return
+    end = time.time()
+    rec = {"trace_id": trace_id, "txid": txid, "node": node_id, "span": name,
+           "start": end if start is None else start, "end": end}
+    rec.update(attrs)
+    line = json.dumps(rec) + "\n"
+    with _lock:
+        _fh.write(line)
+        _fh.flush()
+
+# ---------------------------------------------------------------- merge tool
+
+# Milestones of one instance, in protocol order: (span, phase/msg attribute)
+MILESTONES = [
+    ("start", None),
+    ("receive", "PRE_PREPARE"),
+    ("vote", "prepare"),
+    ("quorum", "prepare"),
+    ("vote", "commit"),
+    ("quorum", "commit"),
+    ("execute", None),
+]
+
+def _milestone_of(rec):
+    key = rec.get("phase") or rec.get("msg")
+    for i, (name, attr) in enumerate(MILESTONES):
+        if rec.get("span") == name and (attr is None or attr == key):
+            return i
+    return None
+
+def load_spans(paths):
+    traces = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                traces.setdefault(rec.get("trace_id"), []).append(rec)
+    return traces
+
+def critical_path(spans):
+    # A phase is done once a quorum (2f+1) of the nodes seen in the trace has
+    # passed it; single-node milestones (start, quorum, execute) gate on the
+    # earliest node that reached them.
+    nodes = {s.get("node") for s in spans if not str(s.get("node", "")).startswith("C")}
+    f = max(0, (len(nodes) - 1) // 3)
+    quorum = 2 * f + 1
+    gates = []
+    for i, (name, attr) in enumerate(MILESTONES):
+        first = {}
+        for s in spans:
+            if _milestone_of(s) == i and s.get("node") not in first:
+                first[s.get("node")] = s["end"]
+        hits = sorted((ts, node) for node, ts in first.items())
+        if not hits:
+            continue
+        k = min(quorum, len(hits)) if name in ("receive", "vote") else 1
+        ts, node = hits[k - 1]
+        label = name if attr is None else f"{name}:{attr}"
+        gates.append((label, ts, node))
+    return gates
+
+def print_timeline(trace_id, spans):
+    spans = sorted(spans, key=lambda s: (s.get("start", 0), s.get("end", 0)))
+    t0 = spans[0].get("start", 0)
+    txid = next((s.get("txid") for s in spans if s.get("txid")), "?")
+    print("=" * 60)
+    print(f"Tx {txid}  (trace {trace_id}, {len(spans)} spans)")
+    print("-" * 60)
+    for s in spans:
+        extra = {k: v for k, v in s.items()
+                 if k not in ("trace_id", "txid", "node", "span", "start", "end")}
+        dur = (s.get("end", 0) - s.get("start", 0)) * 1000
+        print(f"  +{(s.get('start', 0) - t0) * 1000:9.1f} ms  {s.get('node', '?'):>5}  "
+              f"{s.get('span', '?'):<8} {dur:7.1f} ms  {json.dumps(extra) if extra else ''}")
+    gates = critical_path(spans)
+    if gates:
+        print("Critical path:")
+        prev = gates[0][1]
+        for label, ts, node in gates:
+            print(f"  {label:<20} +{max(0.0, ts - prev) * 1000:9.1f} ms  (gated by {node})")
+            prev = max(prev, ts)
+        print(f"  total                {(gates[-1][1] - gates[0][1]) * 1000:10.1f} ms")
+
+def main(argv):
+    paths, flags = split_flags(argv)
+    if not paths:
+        print("Usage: python pbft_trace.py <trace.jsonl>... [--tx=<txid>]")
+        return 1
+    traces = load_spans(paths)
+    want = flags.get("tx")
+    ordered = sorted(traces.items(), key=lambda kv: min(s.get("start", 0) for s in kv[1]))
+    for trace_id, spans in ordered:
+        if want and not any(s.get("txid") == want for s in spans):
+            continue
+        print_timeline(trace_id, spans)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Datagram transport for the normal-case votes (--udp[=multicast|GROUP:PORT]).
+#
+# PREPARE and COMMIT_VOTE are a few hundred bytes each, yet over TCP every one
+# costs a connect, a send and a close per member. With --udp a replica sends
+# its votes as datagrams from a UDP socket bound to its own host:port (UDP
+# and TCP ports do not clash):
+#   --udp               one unicast datagram per target
+#   --udp=multicast     one datagram to the group MULTICAST_GROUP (on the
+#                       node's interface) that every member receives, on P0's
+#                       port + MULTICAST_OFFSET so clusters on one host stay
+#                       apart; --udp=G:P picks the group. With --linear votes
+#                       still go unicast to the collector.
+# A datagram is only taken from a current peer at its own address, so
+# another cluster on the same group is ignored.
+# Everything else (PRE_PREPARE, certificates, payloads, state transfer,
+# replies) stays on TCP. Give --udp to every node: a node without it never
+# sees the votes.
+#
+# Datagrams can be lost, so each vote carries a sequence number per stream
+# ("useq": one stream per unicast destination plus one for the group) and the
+# sender's start time ("uepoch"). Receivers drop duplicates and track the
+# highest contiguous number they have from each sender. There are no ACKs:
+# retransmission follows the protocol's own timeout. When a replica votes on
+# an instance it arms VOTE_TIMEOUT; if the instance is still undecided then,
+# it sends VOTE_NACK {"have": {stream: highest contiguous}} to every peer, and
+# each peer sends again whatever it still holds past that point. The timeout
+# doubles up to RETRIES times.
+import json
+import random
+import socket
+import struct
+import threading
+import time
+
+import pbft_linear
+from pbft_utils import ENCODING
+
+enabled = False
+multicast = None            # (group, port) or None for unicast
+MULTICAST_GROUP = "239.255.80.67"
+MULTICAST_OFFSET = 899      # group port = P0's port + this (5899 for P0 on 5000)
+VOTE_TIMEOUT = 0.2          # seconds
+RETRIES = 5
+RING = 1024                 # datagrams kept per stream for retransmission
+MAX_DATAGRAM = 8192         # larger messages go over TCP
+loss = 0.0                  # --udp-loss: drop this fraction of outgoing datagrams (testing)
+stats = {"sent": 0, "bytes": 0, "received": 0, "duplicates": 0, "nacks": 0, "resent": 0, "tcp": 0}
+_me = None
+_addr = None
+_sock = None
+_epoch = int(time.time() * 1000)
+_next = {}                  # stream -> last sequence number used
+_ring = {}                  # stream -> {seq: datagram}
+_have = {}                  # (sender, stream kind) -> [epoch, contiguous, {seqs above}]
+_watched = set()
+_peers = None
+_handler = None
+_pending = None
+_lock = threading.Lock()
+
+def configure(me, host, port, mode, peers, handler, pending, drop=0.0, p0_port=5000):
+    # peers() -> {id: (host, port)} of the others; pending(txid) -> still undecided
+    global enabled, multicast, loss, _me, _addr, _sock, _peers, _handler, _pending
+    _me, _addr = me, (host, port)
+    _peers, _handler, _pending = peers, handler, pending
+    loss = max(0.0, float(drop or 0))
+    _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    _sock.bind(_addr)
+    threading.Thread(target=_recv_loop, args=(_sock,), name="udp-recv", daemon=True).start()
+    if mode and mode is not True:
+        default = (MULTICAST_GROUP, int(p0_port) + MULTICAST_OFFSET)
+        group, _, gport = (f"{default[0]}:{default[1]}" if mode == "multicast" else mode).partition(":")
+        multicast = (group, int(gport or default[1]))
+        _sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(host))
+        _sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        msock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        msock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        msock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        msock.bind(("", multicast[1]))
+        msock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                         struct.pack("4s4s", socket.inet_aton(multicast[0]), socket.inet_aton(host)))
+        threading.Thread(target=_recv_loop, args=(msock,), name="udp-mcast", daemon=True).start()
+    enabled = True
+
+def _emit(data, dest):
+    if loss and random.random() < loss:
+        return
+    try:
+        _sock.sendto(data, dest)
+    except OSError:
+        pass
+
+def _stamp(msg, stream, kind):
+    with _lock:
+        seq = _next[stream] = _next.get(stream, 0) + 1
+        data = json.dumps(dict(msg, useq=seq, ustream=kind, uepoch=_epoch)).encode(ENCODING)
+        ring = _ring.setdefault(stream, {})
+        ring[seq] = data
+        ring.pop(seq - RING, None)
+    return data
+
+def send(msg, targets, to_all=True):
+    # votes to targets [(host, port)]; one multicast datagram when they are everyone
+    if len(json.dumps(msg)) > MAX_DATAGRAM:
+        for h, p in targets:
+            pbft_linear.send(h, p, msg)
+            stats["tcp"] += 1
+        return
+    txid = msg.get("txid")
+    if multicast and to_all:
+        data = _stamp(msg, "m", "m")
+        _emit(data, multicast)
+        sends = [data]
+    else:
+        sends = []
+        for h, p in targets:
+            data = _stamp(msg, (h, p), "u")
+            _emit(data, (h, p))
+            sends.append(data)
+    with _lock:
+        stats["sent"] += len(sends)
+        stats["bytes"] += sum(len(d) for d in sends)
+    for d in sends:
+        pbft_linear.count(txid, len(d))
+
+def watch(txid):
+    # the protocol timeout: ask peers for what we missed while txid is undecided
+    with _lock:
+        if txid in _watched:
+            return
+        _watched.add(txid)
+    threading.Timer(VOTE_TIMEOUT, _check, args=(txid, 1)).start()
+
+def _check(txid, attempt):
+    if not _pending(txid):
+        with _lock:
+            _watched.discard(txid)
+        return
+    for pid, (h, p) in list(_peers().items()):
+        with _lock:
+            have = {kind: st[1] for (sender, kind), st in _have.items() if sender == pid}
+        try:
+            _sock.sendto(json.dumps({"type": "VOTE_NACK", "from": _me, "have": have}).encode(ENCODING), (h, p))
+            stats["nacks"] += 1
+        except OSError:
+            pass
+    if attempt < RETRIES:
+        threading.Timer(VOTE_TIMEOUT * 2 ** attempt, _check, args=(txid, attempt + 1)).start()
+    else:
+        with _lock:
+            _watched.discard(txid)
+        print(f"\n× Tx {txid} still undecided after {RETRIES} vote retransmission rounds")
+
+def _resend(msg, addr):
+    # a peer at addr is missing datagrams past msg["have"]
+    have = msg.get("have") or {}
+    with _lock:
+        todo = [d for s, d in sorted(_ring.get(addr, {}).items()) if s > have.get("u", 0)]
+        todo += [d for s, d in sorted(_ring.get("m", {}).items()) if s > have.get("m", 0)]
+    for d in todo:
+        _emit(d, addr)
+    stats["resent"] += len(todo)
+
+def _fresh(msg):
+    # -> False for a duplicate; records the sequence number otherwise
+    key = (msg.get("from"), msg.get("ustream"))
+    seq, epoch = msg.get("useq"), msg.get("uepoch")
+    with _lock:
+        st = _have.get(key)
+        if st is None or st[0] != epoch:
+            st = _have[key] = [epoch, 0, set()]
+        if seq <= st[1] or seq in st[2]:
+            return False
+        st[2].add(seq)
+        while st[1] + 1 in st[2]:
+            st[1] += 1
+            st[2].discard(st[1])
+    return True
+
+def _known(msg, addr):
+    # the sender is a current peer and sent from its own host:port
+    hp = (_peers() or {}).get(msg.get("from"))
+    if not hp or int(hp[1]) != addr[1]:
+        return False
+    if hp[0] == addr[0]:
+        return True
+    try:
+        return socket.gethostbyname(hp[0]) == addr[0]
+    except OSError:
+        return False
+
+def _recv_loop(sock):
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+        except ConnectionError:
+            continue
+        except OSError:
+            break
+        try:
+            msg = json.loads(data.decode(ENCODING))
+        except Exception as e:
+            print("× Failed to parse incoming datagram: ", e)
+            continue
+        if msg.get("from") == _me or not _known(msg, addr):
+            continue
+        if msg.get("type") == "VOTE_NACK":
+            _resend(msg, addr)
+            continue
+        if isinstance(msg.get("useq"), int) and not _fresh(msg):
+            stats["duplicates"] += 1
+            continue
+        stats["received"] += 1
+        # one thread per message, as json_server does per connection: a handler that
+        # blocks (locks, TCP sends) must not hold up the votes behind it
+        threading.Thread(target=_handler, args=(msg, addr), daemon=True).start()
+
+def summary():
+    mode = f"multicast {multicast[0]}:{multicast[1]}" if multicast else "unicast"
+    return (f"UDP votes ({mode}): {stats['sent']} datagrams sent ({stats['bytes'] / 1024:.1f} KiB), "
+            f"{stats['received']} received, {stats['duplicates']} duplicates dropped, "
+            f"{stats['nacks']} NACKs sent, {stats['resent']} resent" + (f", loss {loss:g}" if loss else ""))
@@ -17,6 +17,7 @@ def json_send(host, port, obj, timeout=3.0):
         s.connect((host, port))
         data = (json.dumps(obj) + "\n").encode(ENCODING)
         s.sendall(data)
+        return len(data)
     finally:
         try:
             s.shutdown(socket.SHUT_RDWR)
@@ -24,7 +25,9 @@ def json_send(host, port, obj, timeout=3.0):
             pass
         s.close()
 
-def json_server(host, port, handler, on_ready=None):
+def json_server(host, port, handler, on_ready=None, max_threads=None):
+    # max_threads: at most this many connections handled at once; the rest wait in the backlog
+    slots = threading.BoundedSemaphore(max_threads) if max_threads else None
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     srv.bind((host, port))
@@ -34,13 +37,22 @@ def json_server(host, port, handler, on_ready=None):
 
     def _loop():
         while True:
+            if slots:
+                slots.acquire()
             try:
                 c, addr = srv.accept()
             except OSError:
                 break
-            threading.Thread(target=_handle, args=(c, addr), daemon=True).start()
+            threading.Thread(target=_handle, args=(c, addr), name="json-conn", daemon=True).start()
 
     def _handle(conn, addr):
+        try:
+            _read(conn, addr)
+        finally:
+            if slots:
+                slots.release()
+
+    def _read(conn, addr):
         conn.settimeout(10.0)
         buff = b""
         try:
@@ -68,6 +80,32 @@ def json_server(host, port, handler, on_ready=None):
             except Exception as e:
                 print("× Failed to parse incoming data: ", e)
 
-    t = threading.Thread(target=_loop, daemon=True)
+    t = threading.Thread(target=_loop, name="json-accept", daemon=True)
     t.start()
     return srv
+
+def split_flags(argv):
+    # "--name" -> True, "--name=value" -> "value"; everything else is positional
+    args, flags = [], {}
+    for a in argv:
+        if a.startswith("--"):
+            k, eq, v = a[2:].partition("=")
+            flags[k] = v if eq else True
+        else:
+            args.append(a)
+    return args, flags
+
+def bad_flag(flags, rules):
+    # rules: {name: (int|float, lowest, highest, bare)}; bare: "--name" alone is allowed.
+    # -> the first flag that is not such a number within [lowest, highest], or None
+    for name, (kind, lo, hi, bare) in rules.items():
+        v = flags.get(name)
+        if v is None or (v is True and bare):
+            continue
+        try:
+            x = kind(v) if v is not True else None
+        except ValueError:
+            return name
+        if x is None or x != x or (lo is not None and x < lo) or (hi is not None and x > hi):
+            return name
+    return None
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Vote tallies as member-index bitsets, with quorum callbacks and evidence.
+#
+# There is one Tally per (txid, view, phase). Every node id gets a bit the
+# first time it votes. A tally keeps one int bitset for yes and one for no,
+# plus their counts. A vote is an O(1) update, and evaluate_prepare and
+# evaluate_commit read the counts instead of re-scanning vote strings.
+#
+# The node passes quorum(txid, phase) -> (threshold, implicit, pending,
+# voters):
+#   implicit  yes votes that never arrive as messages (the leader's, our own)
+#   pending   our own vote, if it is not cast yet
+#   voters    remote nodes whose votes can arrive
+#
+# After each vote, on_decide(tally, outcome) fires once, the moment either
+# condition holds:
+#   yes + implicit >= threshold                     "quorum"
+#   yes + implicit + pending + not voted < threshold  "impossible"
+#
+# A second vote from the same node in the same view is never counted. If it
+# repeats the vote it is a duplicate; if it differs it is a conflict. Both
+# are kept as Byzantine evidence. A node's vote can reach us directly and
+# also inside a --linear certificate, so a node that tells peers different
+# things shows up here.
+import collections
+import threading
+import time
+
+LABELS = {"prepare": ("VOTE_YES", "VOTE_NO"), "commit": ("ACK_COMMIT", "ACK_ABORT")}
+
+evidence = collections.deque(maxlen=32)     # (time, kind, pid, txid, view, phase, first, second)
+_index = {}                                 # pid -> bit
+_ids = []                                   # bit -> pid
+_lock = threading.Lock()
+
+def index_of(pid):
+    with _lock:
+        if pid not in _index:
+            _index[pid] = len(_ids)
+            _ids.append(pid)
+        return _index[pid]
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+class Tally:
+    def __init__(self, txid, view, phase, quorum, on_decide=None):
+        self.txid, self.view, self.phase = txid, view, phase
+        self.yes = 0            # bitset of members that voted yes
+        self.no = 0
+        self.n_yes = 0
+        self.n_no = 0
+        self.decided = None     # None | "quorum" | "impossible"
+        self._quorum = quorum
+        self._on_decide = on_decide
+        self._lock = threading.Lock()
+
+    def vote_of(self, pid):
+        bit = 1 << index_of(pid)
+        return LABELS[self.phase][0] if self.yes & bit else LABELS[self.phase][1] if self.no & bit else None
+
+    def add(self, pid, vote):
+        # -> "new", "duplicate" or "conflict"
+        bit = 1 << index_of(pid)
+        yes = str(vote).upper() == LABELS[self.phase][0]
+        with self._lock:
+            if (self.yes | self.no) & bit:
+                first = self.vote_of(pid)
+                kind = "duplicate" if bool(self.yes & bit) == yes else "conflict"
+                evidence.append((time.time(), kind, pid, self.txid, self.view, self.phase, first, str(vote).upper()))
+                return kind
+            if yes:
+                self.yes |= bit; self.n_yes += 1
+            else:
+                self.no |= bit; self.n_no += 1
+        outcome = self.state()
+        with self._lock:
+            fire = outcome is not None and self.decided is None
+            if fire:
+                self.decided = outcome
+        if fire and self._on_decide:
+            self._on_decide(self, outcome)
+        return "new"
+
+    def state(self):
+        # None while undecided, else "quorum" or "impossible" (does not fire the callback)
+        threshold, implicit, pending, voters = self._quorum(self.txid, self.phase)
+        have = self.n_yes + implicit
+        if have >= threshold:
+            return "quorum"
+        if have + pending + max(0, voters - self.n_yes - self.n_no) < threshold:
+            return "impossible"
+        return None
+
+    def votes(self):
+        # {pid: vote} as carried in --linear certificates
+        yes_label, no_label = LABELS[self.phase]
+        out = {}
+        for i, pid in enumerate(list(_ids)):
+            if self.yes >> i & 1:
+                out[pid] = yes_label
+            elif self.no >> i & 1:
+                out[pid] = no_label
+        return out
+
+    def __len__(self):
+        return self.n_yes + self.n_no
+
+def describe(entry):
+    ts, kind, pid, txid, view, phase, first, second = entry
+    return f"{kind} {phase} vote from {pid} on tx {txid} (view {view}): {first}, then {second}"
+
+def summary_lines():
+    if not evidence:
+        return ["Byzantine evidence: none"]
+    lines = [f"Byzantine evidence: {len(evidence)} (latest last)"]
+    for entry in evidence:
+        lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(entry[0]))}  {describe(entry)}")
+    return lines
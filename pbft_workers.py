@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Multi-process receive path for a replica (--workers=N).
+#
+# N worker processes share the listening socket. Each one accepts connections,
+# reads the newline-delimited JSON and decodes it, then hands the decoded
+# messages to the parent over a multiprocessing queue. Socket I/O and JSON
+# parsing therefore run outside the consensus process's GIL. In the parent a
+# single dispatcher thread calls handler(msg, addr) in arrival order. That
+# thread is the one ordered executor for votes and state changes.
+# max_queued bounds the connections decoded but not yet dispatched: a worker
+# blocks on a full queue and stops accepting, as json_server's max_threads does.
+import json
+import multiprocessing as mp
+import socket
+import threading
+import time
+
+from pbft_utils import ENCODING, BUFSIZE
+
+def _ctx():
+    # not "fork": a child forked while the REPL thread sits in input() would
+    # deadlock closing the inherited sys.stdin
+    methods = mp.get_all_start_methods()
+    return mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _read_all(conn):
+    conn.settimeout(10.0)
+    buff = b""
+    try:
+        while True:
+            data = conn.recv(BUFSIZE)
+            if not data:
+                break
+            buff += data
+    except Exception:
+        pass
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return buff
+
+def _worker(srv, q, cpu, slot):
+    while True:
+        try:
+            c, addr = srv.accept()
+        except OSError:
+            break
+        buff = _read_all(c)
+        batch = []
+        for line in buff.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                batch.append(json.loads(line.decode(ENCODING)))
+            except Exception as e:
+                print("× Failed to parse incoming data: ", e)
+        if batch:
+            q.put((batch, addr))
+        cpu[slot] = time.process_time()
+
+class WorkerPool:
+    def __init__(self, srv, procs, queue, cpu):
+        self.sock = srv
+        self.procs = procs
+        self.queue = queue
+        self.cpu = cpu
+        self.dispatched = 0
+        self.dispatcher = None
+
+    def worker_cpu(self):
+        return list(self.cpu)
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=1.0)
+        except Exception:
+            pass
+        if self.dispatcher:
+            self.dispatcher.join(1.0)
+        for p in self.procs:
+            p.terminate()
+        for p in self.procs:
+            p.join(1.0)
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+def json_server_mp(host, port, handler, workers=2, on_ready=None, max_queued=None):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind((host, port))
+    srv.listen(128)
+    ctx = _ctx()
+    q = ctx.Queue(max_queued or 0)
+    cpu = ctx.Array("d", workers, lock=False)
+    procs = []
+    for i in range(workers):
+        p = ctx.Process(target=_worker, args=(srv, q, cpu, i), name=f"json-worker-{i}", daemon=True)
+        p.start()
+        procs.append(p)
+    pool = WorkerPool(srv, procs, q, cpu)
+
+    def _dispatch():
+        while True:
+            try:
+                item = q.get()
+            except Exception:
+                break
+            if item is None:
+                break
+            batch, addr = item
+            for msg in batch:
+                try:
+                    handler(msg, addr)
+                except Exception as e:
+                    print("× Handler failed: ", e)
+                pool.dispatched += 1
+
+    pool.dispatcher = threading.Thread(target=_dispatch, name="json-dispatch", daemon=True)
+    pool.dispatcher.start()
+    if on_ready:
+        on_ready()
+    return pool
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Workload recording and replay.
+#
+# Start any node or the client with --record[=FILE] to append one JSON line
+# per client request to workloads/<ID>_workload.jsonl:
+#   {"t": <unix time>, "source": "P0", "client": "127.0.0.1:7000", "data": "account=..."}
+# Nodes record every CLIENT_TX they receive, and the client records every
+# 'send'. When record() is not enabled it returns immediately.
+#
+# Replay one or more recordings into a running cluster:
+#   python pbft_workload.py workloads/*.jsonl [--speed=1|<x>|max] [--window=32]
+#          [--to=HOST:PORT] [--all] [--config=cluster.json] [--port=7200]
+#          [--restamp] [--timeout=10]
+# Records are merged by time. The same request recorded by several nodes
+# (a client that sends to every replica) is kept once. --speed=1 keeps the
+# original gaps, --speed=x makes them x times shorter, and --speed=max sends
+# back to back with at most --window requests unanswered. Requests go to
+# --to (default P0, which forwards what it does not lead) or, with --all, to
+# every member. A request is done at f+1 matching REPLYs, and BUSY replies are
+# retried after their retry_after.
+# --restamp gives each client_id a per-run suffix, so a recording can be
+# replayed against the same cluster again without hitting the exactly-once
+# table.
+import collections
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import pbft_config
+from pbft_request import key_of, ops_of, parse_kv
+from pbft_utils import json_server, json_send, split_flags, short_uuid
+
+enabled = False
+source = None
+DEDUP_WINDOW = 1.0          # seconds; the same request from another recorder within this is one request
+MAX_BUSY_RETRIES = 5
+_fh = None
+_lock = threading.Lock()
+
+def enable(nid, path=None):
+    global enabled, source, _fh
+    source = nid
+    path = path or os.path.join("workloads", f"{nid}_workload.jsonl")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _fh = open(path, "a", encoding="utf-8")
+    enabled = True
+    return path
+
+def record(data, client=None):
+    if not enabled or not data:
+        return
+    line = json.dumps({"t": time.time(), "source": source, "client": client, "data": data}) + "\n"
+    with _lock:
+        _fh.write(line)
+        _fh.flush()
+
+# ---------------------------------------------------------------- replay tool
+
+def load(paths):
+    # -> records sorted by time, a request seen by several recorders kept once
+    recs = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                if rec.get("data") and isinstance(rec.get("t"), (int, float)):
+                    recs.append(rec)
+    recs.sort(key=lambda r: r["t"])
+    out, last = [], {}      # data -> (time, source) of the copy kept
+    for rec in recs:
+        prev = last.get(rec["data"])
+        if prev and prev[1] != rec.get("source") and rec["t"] - prev[0] <= DEDUP_WINDOW:
+            continue
+        last[rec["data"]] = (rec["t"], rec.get("source"))
+        out.append(rec)
+    return out
+
+def restamp(data, run):
+    op = parse_kv(data)
+    if not op.get("client_id"):
+        return data
+    return ",".join(f"{k}={v}.{run}" if k.strip() == "client_id" else f"{k}={v}"
+                    for k, v in (p.split("=", 1) for p in data.split(",") if "=" in p))
+
+class Replayer:
+    def __init__(self, port, targets):
+        self.port = port
+        self.targets = targets
+        self.cv = threading.Condition()
+        self.members = {}
+        self.sent = collections.defaultdict(collections.deque)   # key -> send times, oldest first
+        self.votes = {}          # (key, txid) -> {node: result}
+        self.closed = set()      # (key, txid) already counted
+        self.done = []           # (latency, result)
+        self.busy = 0
+        self.gave_up = 0
+        self.tries = {}          # data -> BUSY replies so far
+
+    def f(self):
+        return max(0, (len(self.members) or 4) - 1) // 3
+
+    def outstanding(self):
+        return sum(len(q) for q in self.sent.values())
+
+    def send(self, data):
+        msg = {"type": "CLIENT_TX", "data": data, "from_port": self.port}
+        if len(self.targets) > 1:
+            msg["to_all"] = True    # every replica has a copy; none needs forwarding
+        for h, p in self.targets:
+            try:
+                json_send(h, p, msg)
+            except OSError:
+                pass
+
+    def submit(self, data):
+        with self.cv:
+            self.sent[key_of(parse_kv(data))].append(time.time())
+        self.send(data)
+
+    def on_msg(self, msg, addr):
+        t = msg.get("type")
+        if t == "MEMBERS":
+            with self.cv:
+                self.members = dict(msg.get("members") or {})
+        elif t == "BUSY":
+            data = msg.get("data")
+            with self.cv:
+                self.busy += 1
+                n = self.tries[data] = self.tries.get(data, 0) + 1
+                if n > MAX_BUSY_RETRIES and self.sent.get(key_of(parse_kv(data))):
+                    self.sent[key_of(parse_kv(data))].popleft()
+                    self.gave_up += 1
+                    self.cv.notify_all()
+            if n <= MAX_BUSY_RETRIES:
+                threading.Timer(msg.get("retry_after", 100) / 1000.0, self.send, args=(data,)).start()
+        elif t == "REPLY" and not msg.get("tentative"):
+            now = time.time()
+            with self.cv:
+                for op in ops_of(msg.get("data")):
+                    slot = (key_of(op), msg.get("txid"))
+                    if slot in self.closed or not self.sent.get(slot[0]):
+                        continue
+                    votes = self.votes.setdefault(slot, {})
+                    votes[msg.get("from")] = msg.get("result")
+                    if sum(1 for r in votes.values() if r == msg.get("result")) >= self.f() + 1:
+                        self.closed.add(slot)
+                        self.votes.pop(slot, None)
+                        self.done.append((now - self.sent[slot[0]].popleft(), msg.get("result")))
+                self.cv.notify_all()
+
+def percentile(ms, q):
+    return ms[min(len(ms) - 1, int(q * len(ms)))]
+
+def main(argv):
+    paths, flags = split_flags(argv)
+    if not paths:
+        print("Usage: python pbft_workload.py <workload.jsonl>... [--speed=1|<x>|max] [--window=32] "
+              "[--to=HOST:PORT] [--all] [--config=<file>] [--port=7200] [--restamp] [--timeout=10]")
+        return 1
+    recs = load(paths)
+    if not recs:
+        print("× No requests recorded in " + ", ".join(paths))
+        return 1
+    speed = str(flags.get("speed", "1"))
+    fastest = speed == "max"
+    factor = 1.0 if fastest else max(1e-6, float(speed))
+    window = int(flags.get("window", 32))
+    port = int(flags.get("port", 7200))
+    primary = ("127.0.0.1", 5000)
+    members = {}
+    if flags.get("config"):
+        pbft_config.load(flags["config"])
+        primary, members = pbft_config.nodes["P0"], pbft_config.members()
+    if isinstance(flags.get("to"), str):
+        h, _, p = flags["to"].partition(":")
+        primary = (h or primary[0], int(p) if p else primary[1])
+    rep = Replayer(port, [primary])
+    rep.members = dict(members)
+    json_server("127.0.0.1", port, rep.on_msg)
+    json_send(primary[0], primary[1], {"type": "CLIENT_HELLO", "host": "127.0.0.1", "port": port})
+    time.sleep(0.3)
+    if flags.get("all") and rep.members:
+        rep.targets = [tuple(hp) for hp in rep.members.values()]
+    targets = rep.targets
+    span = recs[-1]["t"] - recs[0]["t"]
+    print(f"Workload: {len(recs)} requests over {span:.1f}s ({len(recs) / max(span, 1e-3):.1f} req/s) "
+          f"from {', '.join(paths)}")
+    print(f"→ Replaying {'as fast as possible (window ' + str(window) + ')' if fastest else f'at {factor:g}x'} "
+          f"to {'every member' if len(targets) > 1 else '%s:%d' % primary}")
+    run = short_uuid()[:6]
+    timeout = float(flags.get("timeout", 10))
+    t0, first = time.time(), recs[0]["t"]
+    for rec in recs:
+        data = restamp(rec["data"], run) if flags.get("restamp") else rec["data"]
+        if fastest:
+            with rep.cv:
+                stall = time.time() + timeout
+                while rep.outstanding() >= window and time.time() < stall:
+                    rep.cv.wait(0.5)
+        else:
+            due = t0 + (rec["t"] - first) / factor
+            if due > time.time():
+                time.sleep(due - time.time())
+        rep.submit(data)
+    sent_for = time.time() - t0
+    deadline = time.time() + timeout
+    with rep.cv:
+        while rep.outstanding() and time.time() < deadline:
+            rep.cv.wait(0.2)
+        elapsed = time.time() - t0
+        done = list(rep.done)
+        left, busy, gave_up = rep.outstanding(), rep.busy, rep.gave_up
+    results = collections.Counter(r for _, r in done)
+    print(f"✓ Sent {len(recs)} in {sent_for:.1f}s; answered {len(done)} "
+          f"({', '.join(f'{n} {r}' for r, n in results.items()) or 'none'}), unanswered {left}, BUSY {busy} ({gave_up} given up)")
+    if done:
+        ms = sorted(x * 1000 for x, _ in done)
+        print(f"  Throughput {len(done) / elapsed:.1f} req/s over {elapsed:.1f}s")
+        print(f"  Latency ms: mean {statistics.mean(ms):.1f}, p50 {statistics.median(ms):.1f}, "
+              f"p95 {percentile(ms, 0.95):.1f}, p99 {percentile(ms, 0.99):.1f}, max {ms[-1]:.1f}")
+    return 0 if not left else 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))